@@ -0,0 +1,145 @@
+"""
+代码片段读写基准测试
+生成一个合成PNE程序（一个application依次调起若干module，module中是map取值、if/else、isValid和表达式赋值），
+完整编译一次（collect、generate、aggregate、output），统计打开文件的次数和耗时
+
+用法：
+    python benchmarks/fragment_io.py [--modules 100] [--repeat 3] [--dump-fragments] [--repo 其他检出目录]
+
+--repo 指向另一份代码（例如 git worktree 检出的旧版本），用来对比改动前后的结果。
+--dump-fragments 同时测量把代码片段落盘的调试模式。
+每次测量都在独立的子进程中进行，打开文件的次数通过 audit hook 的 open 事件统计（每次对应一对open/close系统调用）。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#每个module中的指令组数
+GROUPS_PER_MODULE = 10
+
+
+def synth_program(module_num:int):
+    """生成合成程序，application A 依次调起 M0 ... M(n-1)。"""
+    lines = ["#include <geo.domain>", ""]
+    for m in range(module_num):
+        lines.append("module M%d() {" % m)
+        lines.append("    control {")
+        lines.append("        map< bit<32>, bit<32> >[16] t%d" % m)
+        lines.append("            {")
+        lines.append("                (1, 7);")
+        lines.append("                (2, 8);")
+        lines.append("            };")
+        for g in range(GROUPS_PER_MODULE):
+            lines.append("        bit<32> v%d;" % g)
+            lines.append("        v%d = t%d[hdr.gbc.geoAreaPosLat];" % (g, m))
+            lines.append("        if ( v%d == %d ) { hdr.gbc.lat = v%d; } else { drop(); }" % (g, g, g))
+            lines.append("        if ( hdr.gbc.isValid() ) { hdr.gbc.tst = hdr.gbc.lat + %d; }" % g)
+        lines.append("    }")
+        lines.append("}")
+        lines.append("")
+    lines.append("application A using Parser {")
+    for m in range(module_num):
+        lines.append("    M%d.apply();" % m)
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def prepare(repo:str, module_num:int):
+    """在临时目录中准备输入和component目录，返回 (输入目录, lynette目录)。"""
+    work_dir = tempfile.mkdtemp()
+    sys_path = os.path.join(work_dir, "lynette")
+    for sub in ("topo", "path", "code", "main"):
+        os.makedirs(os.path.join(sys_path, "component", sub))
+    shutil.copytree(os.path.join(repo, "lynette", "component", "rest"), os.path.join(sys_path, "component", "rest"))
+
+    input_path = os.path.join(work_dir, "input")
+    for sub in ("path", "log_out", "pne_out", "path_out"):
+        os.makedirs(os.path.join(input_path, sub))
+    shutil.copytree(os.path.join(repo, "input", "include"), os.path.join(input_path, "include"))
+    with open(os.path.join(input_path, "Bench_main.pne"), "w") as file:
+        file.write(synth_program(module_num))
+    hosts = [{"device_uuid": "s1", "ports": {"h1": 21}}, {"device_uuid": "s2", "ports": {"h2": 22}}]
+    with open(os.path.join(input_path, "service.json"), "w") as file:
+        json.dump({"Bench": {"services": [{"service_name": "S", "applications": ["A"], "service_hosts": hosts}]}}, file)
+    with open(os.path.join(input_path, "path", "path.json"), "w") as file:
+        json.dump({"S": {"s1": {"next": {"s2": 2}, "tables": 1000000, "ip": "192.168.0.1"},
+                         "s2": {"next": {"s1": 1}, "tables": 1000000, "ip": "192.168.0.2"}}}, file)
+    return work_dir, input_path, sys_path
+
+
+def measure(repo:str, module_num:int, repeat:int, dump:bool):
+    """在当前进程中对repo下的代码测量，结果以json打印到标准输出。"""
+    sys.path.insert(0, repo)
+    from lynette.__main__ import LynetteRunner
+
+    opens = [0]
+    def hook(event, args):
+        if event == "open":
+            opens[0] = opens[0] + 1
+    sys.addaudithook(hook)
+
+    wall_s = []
+    open_num = []
+    for _ in range(repeat):
+        work_dir, input_path, sys_path = prepare(repo, module_num)
+        os.chdir(input_path)
+        if dump:
+            runner = LynetteRunner(sys_path, "pne_out/", "service.json", None, dump_fragments=True)
+        else:
+            runner = LynetteRunner(sys_path, "pne_out/", "service.json", None)
+        before = opens[0]
+        start = time.perf_counter()
+        runner.run()
+        wall_s.append(time.perf_counter() - start)
+        open_num.append(opens[0] - before)
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir)
+    print(json.dumps({"opens": min(open_num), "wall_s": min(wall_s)}))
+
+
+def run(repo:str, module_num:int, repeat:int, dump=False):
+    """在子进程中对某一份代码测量一次。"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--measure", repo,
+           "--modules", str(module_num), "--repeat", str(repeat)]
+    if dump:
+        cmd.append("--dump-fragments")
+    out = subprocess.run(cmd, env=dict(os.environ, LYNETTE_NO_CACHE="1"),
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(label:str, result:dict):
+    print("[%s]" % label)
+    print("  open/close : %10d" % result["opens"])
+    print("  wall       : %10.3f s" % result["wall_s"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fragment I/O benchmark")
+    parser.add_argument("--modules", help="Number of modules in the synthetic program.", type=int, default=100)
+    parser.add_argument("--repeat", help="Repeat the compile and keep the best result.", type=int, default=3)
+    parser.add_argument("--dump-fragments", help="Also measure writing fragments to disk.", action="store_true", default=False)
+    parser.add_argument("--repo", help="Another checkout to compare against.", default=None)
+    parser.add_argument("--measure", help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        measure(args.measure, args.modules, args.repeat, args.dump_fragments)
+        return
+    report("current", run(ROOT, args.modules, args.repeat))
+    if args.dump_fragments:
+        report("current --dump-fragments", run(ROOT, args.modules, args.repeat, dump=True))
+    if args.repo is not None:
+        report(os.path.basename(os.path.abspath(args.repo)), run(os.path.abspath(args.repo), args.modules, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
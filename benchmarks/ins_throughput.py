@@ -0,0 +1,134 @@
+"""
+collect + generate 吞吐量基准测试
+生成一个合成PNE程序（一个application调起若干module，module中是if/else if/else、isValid、assert和原语），
+分别统计collect和generate每秒处理的指令数
+
+用法：
+    python benchmarks/ins_throughput.py [--modules 200] [--repeat 3] [--repo 其他检出目录]
+
+--repo 指向另一份代码（例如 git worktree 检出的旧版本），用来对比改动前后的结果。
+每次测量都在独立的子进程中进行。计时包含 generate 写代码片段（写在内存中的FragmentStore里，旧版本写到临时目录中）。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#每个module中的指令组数
+GROUPS_PER_MODULE = 20
+
+
+def synth_program(module_num:int):
+    """生成合成程序，application A 依次调起 M0 ... M(n-1)。"""
+    lines = ["service[S] { A }", "application A {"]
+    for m in range(module_num):
+        lines.append("    M%d.apply();" % m)
+    lines.append("}")
+    for m in range(module_num):
+        lines.append("module M%d() {" % m)
+        lines.append("    control {")
+        for g in range(GROUPS_PER_MODULE):
+            lines.append("        bit<32> v%d;" % g)
+            lines.append("        if ( v%d == %d ) { drop(); } else if ( v%d == %d ) { nop(); } else { drop(); }"
+                         % (g, g, g, g + 1))
+            lines.append("        if ( hdr.ipv4.isValid() ) { nop(); }")
+            lines.append("        assert( hdr.ipv4.ttl != %d );" % g)
+            lines.append("        drop();")
+        lines.append("    }")
+        lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def count_ins(all_ins):
+    """递归统计指令数（包括if分支中的指令）。"""
+    n = 0
+    for ins in all_ins:
+        n = n + 1
+        if ins.type == "if":
+            while True:
+                for block in ins.condition_block:
+                    n = n + count_ins(block.ins)
+                if ins.default == 1:
+                    n = n + count_ins(ins.default_bolck.ins)
+                if ins.else_ins_t != 1:
+                    break
+                ins = ins.else_ins
+    return n
+
+
+def measure(repo:str, module_num:int, repeat:int):
+    """在当前进程中对repo下的代码测量，结果以json打印到标准输出。"""
+    sys.path.insert(0, repo)
+    from lynette.lynette_lib import collect
+    from lynette.lynette_lib import generate
+    from lynette.lynette_lib.grammar import registry
+
+    tree = registry.get_parser("grammar_lalr").parse(synth_program(module_num))
+    #generate 从 work_dir/include 读取 define.pne
+    work_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work_dir, "log_out"))
+    os.makedirs(os.path.join(work_dir, "include"))
+    shutil.copy(os.path.join(repo, "input", "include", "define.pne"), os.path.join(work_dir, "include"))
+    os.chdir(work_dir)
+
+    collect_s = []
+    generate_s = []
+    ins_num = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        services, applications, modules = collect.execute({"bench": tree}, work_dir)
+        collect_s.append(time.perf_counter() - start)
+        ins_num = sum(count_ins(a.ins) for a in applications.values()) + \
+                  sum(count_ins(m.ins) for m in modules.values())
+
+        shutil.rmtree(os.path.join(work_dir, "component"), ignore_errors=True)
+        os.makedirs(os.path.join(work_dir, "component"))
+        generator = generate.Generator(sys_path=work_dir)
+        start = time.perf_counter()
+        generator.execute(services, applications, modules, work_dir)
+        generate_s.append(time.perf_counter() - start)
+    shutil.rmtree(work_dir)
+    print(json.dumps({"instructions": ins_num, "collect_s": min(collect_s), "generate_s": min(generate_s)}))
+
+
+def run(repo:str, module_num:int, repeat:int):
+    """在子进程中对某一份代码测量一次。"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--measure", repo,
+           "--modules", str(module_num), "--repeat", str(repeat)]
+    out = subprocess.run(cmd, env=dict(os.environ, LYNETTE_NO_CACHE="1"),
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(label:str, result:dict):
+    n = result["instructions"]
+    print("[%s] %d instructions" % (label, n))
+    print("  collect  : %.3f s  %10.0f ins/s" % (result["collect_s"], n / result["collect_s"]))
+    print("  generate : %.3f s  %10.0f ins/s" % (result["generate_s"], n / result["generate_s"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="collect + generate throughput benchmark")
+    parser.add_argument("--modules", help="Number of modules in the synthetic program.", type=int, default=200)
+    parser.add_argument("--repeat", help="Repeat each phase and keep the best time.", type=int, default=3)
+    parser.add_argument("--repo", help="Another checkout to compare against.", default=None)
+    parser.add_argument("--measure", help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        measure(args.measure, args.modules, args.repeat)
+        return
+    report("current", run(ROOT, args.modules, args.repeat))
+    if args.repo is not None:
+        report(os.path.basename(os.path.abspath(args.repo)), run(os.path.abspath(args.repo), args.modules, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+IR内存基准测试
+生成一个约10万条指令的合成PNE程序，解析后执行collect，报告IR占用的内存和对象数量
+
+用法：
+    python benchmarks/ir_memory.py [--ins 100000] [--repo 其他检出目录]
+
+--repo 指向另一份代码（例如 git worktree 检出的旧版本），用来对比改动前后的结果。
+每次测量都在独立的子进程中进行，峰值RSS互不影响。
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#每个module中的指令组数，每组4条顶层指令
+GROUPS_PER_MODULE = 25
+
+
+def synth_program(ins_num:int):
+    """生成合成程序，每组指令依次为：变量定义、赋值、算术赋值、if/else。"""
+    lines = []
+    modules = max(1, ins_num // (GROUPS_PER_MODULE * 4))
+    for m in range(modules):
+        lines.append("module M%d() {" % m)
+        lines.append("    control {")
+        for g in range(GROUPS_PER_MODULE):
+            lines.append("        bit<32> v%d;" % g)
+            lines.append("        v%d = hdr.ipv4.ttl;" % g)
+            lines.append("        v%d = v%d + %d;" % (g, g, g))
+            lines.append("        if ( v%d == %d ) { T%d.apply(); } else { drop(); }" % (g, g, g))
+        lines.append("    }")
+        lines.append("}")
+    return "\n".join(lines) + "\n", modules * GROUPS_PER_MODULE * 4
+
+
+def _rss_kb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _count_objects():
+    counts = {}
+    for o in gc.get_objects():
+        name = type(o).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def measure(repo:str, ins_num:int):
+    """在当前进程中对repo下的代码测量一次，结果以json打印到标准输出。"""
+    sys.path.insert(0, repo)
+    from lynette.lynette_lib import collect
+    from lynette.lynette_lib.grammar import registry
+
+    code, ins_total = synth_program(ins_num)
+    tree = registry.get_parser("grammar_lalr").parse(code)
+    work_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work_dir, "log_out"))
+
+    gc.collect()
+    rss_before = _rss_kb()
+    objects_before = _count_objects()
+    start = time.perf_counter()
+    _, _, modules = collect.execute({"bench": tree}, work_dir)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    rss_after = _rss_kb()
+    objects_after = _count_objects()
+
+    delta = {}
+    for name in objects_after:
+        d = objects_after[name] - objects_before.get(name, 0)
+        if d > 0:
+            delta[name] = d
+    print(json.dumps({
+        "modules": len(modules),
+        "instructions": ins_total,
+        "collect_s": round(elapsed, 3),
+        "ir_rss_kb": rss_after - rss_before,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "objects": delta,
+    }))
+
+
+def run(repo:str, ins_num:int):
+    """在子进程中对某一份代码测量一次。"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--measure", repo, "--ins", str(ins_num)]
+    out = subprocess.run(cmd, env=dict(os.environ, LYNETTE_NO_CACHE="1"),
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(label:str, result:dict):
+    print("[%s] %d instructions in %d modules" % (label, result["instructions"], result["modules"]))
+    print("  collect time   : %.3f s" % result["collect_s"])
+    print("  IR RSS         : %.1f MB" % (result["ir_rss_kb"] / 1024))
+    print("  peak RSS       : %.1f MB" % (result["peak_rss_kb"] / 1024))
+    print("  new objects    : %d" % sum(result["objects"].values()))
+    top = sorted(result["objects"].items(), key=lambda kv: -kv[1])[:8]
+    for name, n in top:
+        print("    %-18s %d" % (name, n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IR memory benchmark")
+    parser.add_argument("--ins", help="Number of instructions in the synthetic program.",
+                        type=int, default=100000)
+    parser.add_argument("--repo", help="Another checkout to compare against.", default=None)
+    parser.add_argument("--measure", help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        measure(args.measure, args.ins)
+        return
+    report("current", run(ROOT, args.ins))
+    if args.repo is not None:
+        report(os.path.basename(os.path.abspath(args.repo)), run(os.path.abspath(args.repo), args.ins))
+
+
+if __name__ == "__main__":
+    main()
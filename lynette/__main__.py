@@ -3,13 +3,18 @@ import argparse, json, time
 import socket
 
 from lynette.lynette_lib import parser_tree
-from lynette.lynette_lib import collect
 from lynette.lynette_lib.generate import Generator
+from lynette.lynette_lib.fragments import FragmentStore
 from lynette.lynette_lib import aggregate
 from lynette.lynette_lib import output
+from lynette.lynette_lib import snapshot
+from lynette.lynette_lib import fold
+from lynette.lynette_lib import dce
+from lynette.lynette_lib import defines
 from lynette.lynette_lib import data_structure
 from lynette.lynette_lib.clean import sh
 from lynette.lynette_lib.path_generator import generate_path_json
+from lynette.lynette_lib.watch import Watcher
 
 class LynetteRunner():
     """Lynette编译器主运行类，负责协调整个编译流程。
@@ -24,9 +29,14 @@ class LynetteRunner():
         input_path (str): 输入文件所在目录路径
         debug (str): 是否为debug模式，'yes'或'no'
         topo (dict): 网络拓扑信息字典
+        parser_backend (str): PNE语法解析后端，lalr、fused或earley
+        jobs (int): 并行解析include文件、并行生成各服务代码片段的进程数
+        share_tables (str): 是否合并同一节点上结构相同的表，'yes'或'no'
+        fragments (FragmentStore): 内存中的代码片段，所有用户共用，aggregate从这里读取
+        dump_fragments (str): 是否在aggregate之前把代码片段写到component目录下（调试用），'yes'或'no'
     """
     # @pysnooper.snoop()
-    def __init__(self, sys_path, output_dir, service_conf, debug_main) -> None:
+    def __init__(self, sys_path, output_dir, service_conf, debug_main, parser_backend="lalr", jobs=1, share_tables=False, dump_fragments=False) -> None:
         """初始化LynetteRunner实例。
         
         Args:
@@ -34,6 +44,10 @@ class LynetteRunner():
             output_dir (str): 输出目录路径，用于存放最终生成的P4文件和表项文件
             service_conf (str): 服务配置文件路径，JSON格式，包含服务、应用和拓扑信息
             debug_main (str, optional): Debug模式下的主PNE文件路径。如果为None，则使用service模式编译
+            parser_backend (str, optional): PNE语法解析后端，默认lalr，解析失败时自动回退到earley
+            jobs (int, optional): 并行解析include文件、并行生成各服务代码片段的进程数，默认1即串行
+            share_tables (bool, optional): 是否合并同一节点上结构相同的表，默认不合并
+            dump_fragments (bool, optional): 是否把代码片段写到component目录下，只用于调试，默认不写
         """
         self.sys_path = sys_path.replace("/","//")
         self.component_path = self.sys_path  + '//component'
@@ -41,6 +55,11 @@ class LynetteRunner():
 
         self.debug_main = debug_main
         self.service_conf = service_conf
+        self.parser_backend = parser_backend
+        self.jobs = jobs
+        self.share_tables = 'yes' if share_tables else 'no'
+        self.fragments = FragmentStore()
+        self.dump_fragments = 'yes' if dump_fragments else 'no'
 
         self.service_json = {}
 
@@ -90,11 +109,15 @@ class LynetteRunner():
             self.deploy_entry()
 
 
-    def clean_component(self):
+    def clean_component(self, fragments=True):
         """清理组件目录中的临时文件。
         
         删除component目录下所有子目录（topo、path、code、main）中的文件，
         以及component根目录下的文件，为新的编译做准备。
+
+        Args:
+            fragments (bool, optional): 是否删除component根目录下生成的代码片段。
+                                        watch模式增量编译时为False，未变化用户的片段会被复用。默认为True
         """
         # folder_path = sys_parameter["sys_path"] + "component//topo"
         folder_path = self.component_path + "//topo"
@@ -140,6 +163,10 @@ class LynetteRunner():
                 # 如果是文件则直接删除
                 os.remove(file_path)
         
+        if not fragments:
+            return
+        self.fragments.clear()
+
         # folder_path = sys_parameter["sys_path"] + "component"
         folder_path = self.component_path
         file_list = os.listdir(folder_path) 
@@ -159,20 +186,7 @@ class LynetteRunner():
         以便后续解析处理。
         """
         # 预处理
-        pre_code = ''
-        with open(self.debug_main, "r") as f:
-            pre_code = f.read()
-        pre_code = pre_code.split('"')
-        code = ''
-        if len(pre_code) > 1:
-            len_c = len(pre_code)
-            code = pre_code[0] + "<" + pre_code[1] + ">" + pre_code[2]
-            i = 3
-            while i < len_c:
-                code = code + "<" + pre_code[i] + ">" + pre_code[i+1]
-                i = i + 2
-        else:
-            code = pre_code[0]
+        code = parser_tree.read_source(self.debug_main, "<", ">")
         with open(self.component_path + "//main//" + self.debug_main, "w") as f:
             f.write(code)
 
@@ -192,10 +206,9 @@ class LynetteRunner():
         parser_tree_paremeter["main_file_name"] = self.debug_main
         parser_tree_paremeter["input_path"] = self.input_path
         parser_tree_paremeter["sys_path"]   = self.sys_path
-        forest = parser_tree.execute(parser_tree_paremeter)
-        print("debug ",end = '')
-
-        _, applications, _ = collect.execute(forest, self.input_path)
+        parser_tree_paremeter["backend"]    = self.parser_backend
+        parser_tree_paremeter["jobs"]       = self.jobs
+        applications = snapshot.collect(parser_tree_paremeter, label="debug").applications
         for i in applications:
             self.service_json[debug_main_name]["services"].append({
                 "service_name":"admin_" + str(service_name_id), 
@@ -282,7 +295,7 @@ class LynetteRunner():
         """编译服务（完整编译流程）。
         
         执行完整的编译流程：
-        1. 解析PNE文件生成语法树
+        1. 解析PNE文件生成语法树（所有用户的include先统一建图，每个文件只解析一次）
         2. 收集服务、应用和模块信息
         3. 生成P4代码片段
         4. 聚合代码到各个节点
@@ -294,53 +307,135 @@ class LynetteRunner():
         services = {}
         relation = {}
 
+        #输入没变的用户直接读取IR快照；其余用户共用一张include依赖图，公共的domain和模块库只解析一次
+        parser_tree_paremeters = {}
+        snapshots = {}
         for u in users:
-            #1.对输入文件做语法树提取
-            print(u + "_main.pne"+" ", end='')
-            with open(self.input_path + "//log_out//log.txt","w") as file:
-                file.write(u + "_main.pne"+" ")
-            parser_tree_paremeter = {}
-            parser_tree_paremeter["main_file_name"] = u + "_main.pne"
-            parser_tree_paremeter["input_path"] = self.input_path
-            parser_tree_paremeter["sys_path"]   = self.sys_path
-            forest = parser_tree.execute(parser_tree_paremeter)
-
-            #2.对程序组件做扫描提取
-            print(u + "_main.pne"+" ",end='')
-            with open(self.input_path + "//log_out//log.txt","a") as file:
-                file.write(u + "_main.pne"+" ")
-            _, applications, modules = collect.execute(forest,self.input_path)
-            services_t = {}
-            for s in self.service_json[u]["services"]:
-                serv = data_structure.LYNETTE_SERVICE()
-                serv.name = s["service_name"]
-                for app in s["applications"]:
-                    serv.application.append(app)
-                    services_t[serv.name] = serv
+            parser_tree_paremeters[u] = self.parser_tree_paremeter(u)
+            snapshots[u] = snapshot.load(parser_tree_paremeters[u])
+        parameters = [parser_tree_paremeters[u] for u in users if snapshots[u] is None]
+        include_graph = parser_tree.build_include_graph(parameters) if parameters else None
+
+        for u in users:
+            services_t, relation_t = self.compile_user(u, parser_tree_paremeters[u], include_graph, snapshots[u])
             for s in services_t:
                 if s not in services:
                     services[s] = services_t[s]
-
-            #3.转译成p4语法，也包含宏替换
-            print(u + "_main.pne"+" ",end='')
-            with open(self.input_path + "//log_out//log.txt","a") as file:
-                file.write(u + "_main.pne"+" ")
-            generator = Generator(sys_path=self.sys_path)
-            relation_t = generator.execute(services_t, applications, modules, self.input_path)
             for r in relation_t:
                 if r not in relation:
                     relation[r] = relation_t[r]
-        
-        #4.出代码
+
+        self.output_service(relation, services)
+
+    def parser_tree_paremeter(self, user):
+        """构造某个用户的语法树提取参数。
+
+        Args:
+            user (str): 用户名称
+
+        Returns:
+            dict: parser_tree.execute 的参数
+        """
+        parser_tree_paremeter = {}
+        parser_tree_paremeter["main_file_name"] = user + "_main.pne"
+        parser_tree_paremeter["input_path"] = self.input_path
+        parser_tree_paremeter["sys_path"]   = self.sys_path
+        parser_tree_paremeter["backend"]    = self.parser_backend
+        parser_tree_paremeter["jobs"]       = self.jobs
+        return parser_tree_paremeter
+
+    def compile_user(self, u, parser_tree_paremeter, include_graph, ir=None):
+        """编译单个用户：语法树提取、组件收集、常量折叠和死代码消除、转译成p4代码片段。
+
+        Args:
+            u (str): 用户名称
+            parser_tree_paremeter (dict): 该用户的语法树提取参数
+            include_graph (dict): parser_tree.build_include_graph 的结果
+            ir (Snapshot, 可选): 已经读取的IR快照，有效时跳过语法树提取和组件收集
+
+        Returns:
+            tuple: (services_t, relation_t)，该用户的服务字典和代码片段关系字典
+        """
+        #1.对输入文件做语法树提取，2.对程序组件做扫描提取，输入没变时直接读取IR快照
+        print(u + "_main.pne"+" ", end='')
+        with open(self.input_path + "//log_out//log.txt","w") as file:
+            file.write(u + "_main.pne"+" ")
+        if ir is None:
+            ir = snapshot.collect(parser_tree_paremeter, include_graph)
+        else:
+            print('snapshot...')
+            with open(self.input_path + "//log_out//log.txt","a") as file:
+                file.write('snapshot...\n')
+        #3.常量折叠和死代码消除，快照中保存的是变换前的IR
+        print(u + "_main.pne"+" ",end='')
+        with open(self.input_path + "//log_out//log.txt","a") as file:
+            file.write(u + "_main.pne"+" ")
+        define_table = defines.load(self.input_path)
+        applications, modules = fold.execute(ir.applications, ir.modules, self.input_path, define_table)
+        print(u + "_main.pne"+" ",end='')
+        with open(self.input_path + "//log_out//log.txt","a") as file:
+            file.write(u + "_main.pne"+" ")
+        applications, modules = dce.execute(applications, modules, self.input_path, define_table)
+        services_t = {}
+        for s in self.service_json[u]["services"]:
+            serv = data_structure.LYNETTE_SERVICE()
+            serv.name = s["service_name"]
+            for app in s["applications"]:
+                serv.application.append(app)
+                services_t[serv.name] = serv
+
+        #4.转译成p4语法，也包含宏替换
+        print(u + "_main.pne"+" ",end='')
+        with open(self.input_path + "//log_out//log.txt","a") as file:
+            file.write(u + "_main.pne"+" ")
+        generator = Generator(sys_path=self.sys_path, entry_files=self.read_entry_files(u), fragments=self.fragments, jobs=self.jobs,
+                              define_table=define_table)
+        relation_t = generator.execute(services_t, applications, modules, self.input_path)
+        return services_t, relation_t
+
+    def output_service(self, relation, services):
+        """聚合所有用户的代码片段并输出最终文件。
+
+        Args:
+            relation (dict): 所有用户合并后的代码片段关系字典
+            services (dict): 所有用户合并后的服务字典
+        """
+        #调试时把内存中的代码片段落盘
+        if self.dump_fragments == 'yes':
+            self.fragments.flush(self.component_path)
+        #5.出代码
         hdr_type_use = self.aggregate_code(relation, services)
         with open(self.input_path + "//log_out//log.txt","a") as file:
             file.write("All aggregate...\n")
-        #5.出文件
+        #6.出文件
         self.output_code(hdr_type_use)
         with open(self.input_path + "//log_out//log.txt","a") as file:
             file.write("ALL output...\n")
             file.write("ALL compile success!!\n")
 
+    def read_entry_files(self, user):
+        """读取某个用户在service.json中绑定的外部表项文件。
+
+        services中的每一项都可以有 entry_files 字段，形如 {"map或set名": "表项文件路径"}，
+        相对路径以service.json所在目录为基准，支持 .csv/.jsonl/.bin 格式。
+
+        Args:
+            user (str): 用户名称
+
+        Returns:
+            dict: {map/set名: 表项文件绝对路径}
+        """
+        entry_files = {}
+        for s in self.service_json[user]["services"]:
+            for name, file_name in s.get("entry_files", {}).items():
+                if not os.path.isabs(file_name):
+                    file_name = os.path.join(self.input_path.replace("//","/"), file_name)
+                if name in entry_files and entry_files[name] != file_name:
+                    print("error-read_entry_files entry file bound twice", name)
+                    exit()
+                entry_files[name] = file_name
+        return entry_files
+
     def read_service_conf(self):
         """读取服务配置文件。
         
@@ -362,20 +457,7 @@ class LynetteRunner():
                 users.append(i)
 
         for f_main in users:
-            pre_code = ''
-            with open(f_main + "_main.pne","r") as f:
-                pre_code = f.read()
-            pre_code = pre_code.split('"')
-            code = ''
-            if len(pre_code) > 1:
-                len_c = len(pre_code)
-                code = pre_code[0] + ">-<" + pre_code[1] + ">-<" + pre_code[2]
-                i = 3
-                while i < len_c:
-                    code = code + ">-<" + pre_code[i] + ">-<" + pre_code[i+1]
-                    i = i + 2
-            else:
-                code = pre_code[0]
+            code = parser_tree.read_source(f_main + "_main.pne")
             with open( self.component_path + "//main//" + f_main + "_main.pne","w") as f:
                 f.write(code)
 
@@ -383,19 +465,7 @@ class LynetteRunner():
             if "main_file" in self.service_json[i]['services'][0]:
                 users.append(i)
                 main_file = self.service_json[i]['services'][0]["main_file"]
-                with open(main_file,"r") as f:
-                    pre_code = f.read()
-                pre_code = pre_code.split('"')
-                code = ''
-                if len(pre_code) > 1:
-                    len_c = len(pre_code)
-                    code = pre_code[0] + ">-<" + pre_code[1] + ">-<" + pre_code[2]
-                    i = 3
-                    while i < len_c:
-                        code = code + ">-<" + pre_code[i] + ">-<" + pre_code[i+1]
-                        i = i + 2
-                else:
-                    code = pre_code[0]
+                code = parser_tree.read_source(main_file)
                 with open( self.component_path + "//main//" + i + "_main.pne","w") as f:
                     f.write(code)
         
@@ -421,6 +491,9 @@ class LynetteRunner():
         aggregate_parameter["if_debug"]          = self.debug
         aggregate_parameter["sys_path"]          = self.sys_path
         aggregate_parameter["input_path"]        = self.input_path
+        aggregate_parameter["share_tables"]      = self.share_tables
+        aggregate_parameter["fragments"]         = self.fragments
+        aggregate_parameter["define_table"]      = defines.load(self.input_path)
         return aggregate.execute(relation, services, aggregate_parameter)
     
     def output_code(self, header_name):
@@ -548,6 +621,21 @@ def get_args():
     
     - ``--deploy`` (bool): 是否部署P4代码到后端设备。如果指定，编译完成后会将P4文件发送到
                            配置的后端设备。默认为False。
+    
+    - ``--parser`` (str): PNE语法解析后端。可选值：lalr、fused 或 earley，默认为 ``lalr``。
+                          fused在LALR解析的同时完成collect，不保留组件的语法树。
+                          lalr/fused解析失败时会打印警告并自动回退到earley。
+    
+    - ``--jobs`` (int): 并行解析include文件、并行生成各服务代码片段的进程数。默认为1，即串行。
+    
+    - ``--share-tables`` (bool): 合并同一节点上结构相同的表（不同服务调起同一个module时生成的表），
+                                 表项不同时按服务编号区分。合并后一张表会在多处apply，需要target支持。默认为False。
+
+    - ``--dump-fragments`` (bool): 代码片段默认只保存在内存中，指定时在聚合之前把片段写到
+                                   component目录下，用于调试。默认为False。
+
+    - ``--watch`` (bool): 监视模式。编译完成后进程常驻，入口文件、include文件、service.json、
+                          path/path.json 变化时增量重编译，并打印每次重编译的耗时。默认为False。
     """
 
     cwd = os.getcwd()
@@ -579,6 +667,16 @@ def get_args():
                         action='store_true', required=False, default=False)
     parser.add_argument('--deploy', help='Send .p4 to back-end according to service config.',
                         action='store_true', required=False, default=False)
+    parser.add_argument('--parser', help='Parser backend for PNE files.',
+                        type=str, required=False, default='lalr', choices=['lalr', 'fused', 'earley'])
+    parser.add_argument('--jobs', help='Number of processes used to parse include files and generate services.',
+                        type=int, required=False, default=1)
+    parser.add_argument('--share-tables', help='Merge structurally identical tables placed on the same node.',
+                        action='store_true', required=False, default=False)
+    parser.add_argument('--dump-fragments', help='Write generated code fragments to the component folder for debugging.',
+                        action='store_true', required=False, default=False)
+    parser.add_argument('--watch', help='Keep running and recompile incrementally when inputs change.',
+                        action='store_true', required=False, default=False)
     return parser.parse_args()
 
 def main():
@@ -601,8 +699,11 @@ def main():
                 os.remove(file_path)
 
     sys_path = os.path.dirname(__file__)
-    app = LynetteRunner(sys_path, args.output_dir, args.config, args.debug_main)
+    app = LynetteRunner(sys_path, args.output_dir, args.config, args.debug_main, args.parser, args.jobs, args.share_tables, args.dump_fragments)
     # print(args.output_dir)
+    if args.watch:
+        Watcher(app).run(if_deploy=args.deploy, if_entry=args.entry)
+        return
     app.run(if_p4=args.p4, if_deploy=args.deploy, if_entry=args.entry)
 
     print("ALL compile success!!")
@@ -1,17 +1,20 @@
-from lark import Lark, Tree, Token
+from lark import Tree, Token
 from lynette.lynette_lib import data_structure
-from lynette.lynette_lib.grammar.grammar_define import grammar_define
-from lynette.lynette_lib.grammar.grammar_header import grammar_header
-from lynette.lynette_lib.grammar.grammar_parser import grammar_parser
+from lynette.lynette_lib import dedup
+from lynette.lynette_lib import defines
+from lynette.lynette_lib.output import BfrtEntries, JsonEntries
+from lynette.lynette_lib import symbols
+from lynette.lynette_lib.grammar import registry
 import json, copy
 
-type_dict_global = {}
-const_dict_global = {}
 # debug = 'no', json_file = ''
 def execute(relation:dict, services:dict, aggregate_parameter):
     print("aggregate...")
 
-    construct_type_dict_global(aggregate_parameter)
+    #define.pne的解析结果，runner没有传入时读取一次
+    define_table = aggregate_parameter.get("define_table")
+    if define_table is None:
+        define_table = defines.load(aggregate_parameter["input_path"])
 
     #根据path.json重构topo和path
     with open(aggregate_parameter["input_path"] + "//path//path.json","r") as file:
@@ -55,6 +58,18 @@ def execute(relation:dict, services:dict, aggregate_parameter):
     with open(aggregate_parameter["sys_path"] + "//component//path//path.json",'r') as file:
         path = json.load(file)
     
+    #--share-tables时同一节点上结构相同的表只占一份表数量，输出时合并
+    budget = None
+    if aggregate_parameter.get("share_tables", "no") == "yes":
+        frag_tables = {}
+        def load(frag, node):
+            if (frag, node) not in frag_tables:
+                frag_tables[(frag, node)] = dedup.tables(frag,
+                    read_frag(aggregate_parameter, frag, "action", node, path, topo),
+                    read_frag(aggregate_parameter, frag, "table", node, path, topo))
+            return frag_tables[(frag, node)]
+        budget = dedup.Budget(load)
+
     #对全服务/全节点执行运算
     #这里在划分的时候要么整数线性规划要么sat，样例情况特殊写了个特例算法
     frag_to_service_name = {}
@@ -74,19 +89,22 @@ def execute(relation:dict, services:dict, aggregate_parameter):
             #先放head
             relation_node_frag[node].append(app_head)
             frag_to_service_name[app_head] = service_name
-            topo[node]["tables"] = topo[node]["tables"] - relation[app_head].table_num
-            topo[node]["tables"] = topo[node]["tables"] - relation[app_tail].table_num
+            topo[node]["tables"] = topo[node]["tables"] - table_cost(budget, node, app_head, relation[app_head].table_num, take=True)
+            #只有一个切片时head就是tail，不要放两次
+            if app_tail != app_head:
+                topo[node]["tables"] = topo[node]["tables"] - table_cost(budget, node, app_tail, relation[app_tail].table_num, take=True)
             #如果user切片还没够到tail,并且node里面还有空间
             app_user = frag + "_" + str(app_user_id)
-            while app_user_id < relation[frag] and topo[node]["tables"] >= relation[app_user].table_num:
+            while app_user_id < relation[frag] and topo[node]["tables"] >= table_cost(budget, node, app_user, relation[app_user].table_num):
                 relation_node_frag[node].append(app_user)
                 frag_to_service_name[app_user] = service_name
-                topo[node]["tables"] = topo[node]["tables"] - relation[app_user].table_num
+                topo[node]["tables"] = topo[node]["tables"] - table_cost(budget, node, app_user, relation[app_user].table_num, take=True)
                 app_user_id = app_user_id + 1
                 app_user = frag + "_" + str(app_user_id)
             #最后放tail
-            relation_node_frag[node].append(app_tail)
-            frag_to_service_name[app_tail] = service_name
+            if app_tail != app_head:
+                relation_node_frag[node].append(app_tail)
+                frag_to_service_name[app_tail] = service_name
             #如果user切片够到tail了，并且还有其他的app
             if app_user_id == relation[frag] and app_i < app_num:
                 app_i = app_i  + 1
@@ -124,6 +142,21 @@ def execute(relation:dict, services:dict, aggregate_parameter):
     # 获取该文件夹下的所有文件名列表
     #开始按节点输出
     for node in relation_node_frag:
+        #先读出各片段的文本，action和control中的Next换成实际端口
+        #表项可能有几百万条，不读进内存，entries中是每次调用都从头逐条读取片段表项的函数
+        texts = {}
+        entries = {}
+        for frag in relation_node_frag[node]:
+            texts[frag] = {}
+            for part in ("tem", "action", "table", "reg", "control"):
+                texts[frag][part] = read_frag(aggregate_parameter, frag, part, node, path, topo, if_print=True)
+            entries[frag] = frag_entry_reader(aggregate_parameter, frag, node, path, topo, frag_to_service_name)
+        #结构相同的表合并成一张
+        if budget is not None:
+            merged = dedup.share(relation_node_frag[node], texts, entries)
+            if merged > 0:
+                print("share", node, merged, "tables")
+
         #先组合一下var文件
         var_file = {}
         for frag in relation_node_frag[node]:
@@ -133,59 +166,27 @@ def execute(relation:dict, services:dict, aggregate_parameter):
         #生成var文件
         with open(folder_path + "//" + node + "_control","w") as file_w:
             for var in var_file:
-                with open(aggregate_parameter["sys_path"] + "//component//" + var,"r") as file_r:
-                    line = file_r.readline()
-                    while line :
-                        file_w.write(line)
-                        line = file_r.readline()
+                file_w.write(aggregate_parameter["fragments"].read(var))
             file_w.write("\n")
             for frag in relation_node_frag[node]:
-                with open(aggregate_parameter["sys_path"] + "//component//" + frag + "_tem.pne","r") as file_r:
-                    line = file_r.readline()
-                    while line :
-                        file_w.write(line)
-                        line = file_r.readline()
+                file_w.write(texts[frag]["tem"])
 
         #生成action
         with open(folder_path + "//" + node + "_control","a") as file_w:
             for frag in relation_node_frag[node]:
-                with open(aggregate_parameter["sys_path"] + "//component//" + frag + "_action.pne","r") as file_r:
-                    line = file_r.readline()
-                    while line :
-                        if line.find('Next') != -1:
-                            tt = frag.split('_')
-                            print("ag 555",tt)
-                            tt = tt[0]
-                            next_node = path[tt].index(node) + 1
-                            if next_node == len(path[tt]):
-                                next_node = 0
-                            else:
-                                next_node = path[tt][next_node]
-                            if next_node in topo[node]['next']:
-                                next_node = topo[node]['next'][next_node]
-                            line = line.replace('Next',str(next_node))
-                        file_w.write(line)
-                        line = file_r.readline()
+                file_w.write(texts[frag]["action"])
             file_w.write("\n")
         
         #生成table
         with open(folder_path + "//" + node + "_control","a") as file_w:
             for frag in relation_node_frag[node]:
-                with open(aggregate_parameter["sys_path"] + "//component//" + frag + "_table.pne","r") as file_r:
-                    line = file_r.readline()
-                    while line : 
-                        file_w.write(line)
-                        line = file_r.readline()
+                file_w.write(texts[frag]["table"])
             file_w.write("\n")
 
         #生成reg
         with open(folder_path + "//" + node + "_control","a") as file_w:
             for frag in relation_node_frag[node]:
-                with open(aggregate_parameter["sys_path"] + "//component//" + frag + "_reg.pne","r") as file_r:
-                    line = file_r.readline()
-                    while line :
-                        file_w.write(line)
-                        line = file_r.readline()
+                file_w.write(texts[frag]["reg"])
             file_w.write("\n")
 
         #生成control
@@ -193,77 +194,47 @@ def execute(relation:dict, services:dict, aggregate_parameter):
             file_w.write("apply {\n")
             file_w.write("\n    /*******************************************/\n\n") 
             for frag in relation_node_frag[node]:
-                with open(aggregate_parameter["sys_path"] + "//component//" + frag + "_control.pne","r") as file_r:
-                    line = file_r.readline()
-                    while line :
-                        if line.find('Next') != -1:
-                            tt = frag.split('_')
-                            print("ag 555",tt)
-                            tt = tt[0]
-                            next_node = path[tt].index(node) + 1
-                            if next_node == len(path[tt]):
-                                next_node = 0
-                            else:
-                                next_node = path[tt][next_node]
-                            if next_node in topo[node]['next']:
-                                next_node = topo[node]['next'][next_node]
-                            line = line.replace('Next',str(next_node))
-                        file_w.write("    ")
-                        file_w.write(line)
-                        line = file_r.readline()
-                    file_w.write("\n    /*******************************************/\n\n")
+                for line in texts[frag]["control"].splitlines(keepends=True):
+                    file_w.write("    ")
+                    file_w.write(line)
+                file_w.write("\n    /*******************************************/\n\n")
             file_w.write("}\n")
 
-        #生成entry
+        #生成entry，逐条写出json，ASIC节点同时写出bfrt脚本，output按资源类型复制
         with open(folder_path + "//" + node + "_entry","a") as file_w:
-            entry = {}
-            entry["target"] = node
-            entry["entries"] = []
+            writers = [JsonEntries(file_w, node)]
+            file_b = None
+            if topo[node]["resource"] == "ASIC":
+                file_b = open(folder_path + "//" + node + "_entry_bfrt","w")
+                writers.append(BfrtEntries(file_b, node))
             for frag in relation_node_frag[node]:
-                with open(aggregate_parameter["sys_path"] + "//component//" + frag + "_entry.pne","r") as file_r:
-                    line = file_r.readline()
-                    while line:
-                        if len(line) > 10:
-                            e = json.loads(line)
-                            for v in e['action_params']:
-                                for vi in e['action_params'][v]:
-                                    if vi == '_Next':
-                                        e['action_params'][v] = ['0']
-                                        index = path[frag_to_service_name[frag]].index(node)
-                                        if index+1 < len(path[frag_to_service_name[frag]]):
-                                            e['action_params'][v] = [str(topo[node]['next'][path[frag_to_service_name[frag]][index+1]])]
-                                        else:
-                                            if aggregate_parameter["if_debug"] == 'no':
-                                                with open(aggregate_parameter["input_path"] + "//" + aggregate_parameter["service_json_file"],"r") as f_r:
-                                                    serv_json = json.load(f_r)
-                                                for user in serv_json:
-                                                    for serv in serv_json[user]["services"]:
-                                                        if "service_hosts" in serv:
-                                                            if serv["service_name"] == frag_to_service_name[frag]:
-                                                                for h in serv["service_hosts"][-1]["ports"]:
-                                                                    e['action_params'][v] = [str(serv["service_hosts"][-1]["ports"][h])]
-                            entry["entries"].append(e)
-                        line = file_r.readline()
-            json.dump(entry,file_w,indent=2)
+                for e in entries[frag]():
+                    for writer in writers:
+                        writer.write(e)
+            for writer in writers:
+                writer.close()
+            if file_b is not None:
+                file_b.close()
 
     #整理每个node上的hdr都有什么
     relation_node_hdr = {}
     for node in relation_node_frag:
         hdr_list = {}
 
+        #input/output中是符号ID，symbols.header直接给出引用的hdr名
         #先看输入有什么，其实是读取了什么
         for frag in relation_node_frag[node]:
             for input in relation[frag].input:
-                input = input.split(".")
-                if input[0] == "hdr":
-                    hdr_list[input[1]] = 1 
+                hdr = symbols.header(input)
+                if hdr is not None:
+                    hdr_list[hdr] = 1 
         
         #先看输出有什么，其实是写入了什么
         for frag in relation_node_frag[node]:
             for output in relation[frag].output:
-                output = output.split(".")
-                if output[0] == "hdr":
-                    hdr_list[output[1]] = 1 
+                hdr = symbols.header(output)
+                if hdr is not None:
+                    hdr_list[hdr] = 1 
 
         relation_node_hdr[node] = hdr_list
     
@@ -276,7 +247,7 @@ def execute(relation:dict, services:dict, aggregate_parameter):
     tree = aggregate_parse_header(aggregate_parameter)
 
     #提取header和struct组件,gmeta其实也是一种结构体
-    header,struct = aggregate_collect_header(tree)
+    header,struct = aggregate_collect_header(tree,define_table.types)
 
     #解析parser树
     tree = aggregate_parse_parser(aggregate_parameter)
@@ -291,7 +262,7 @@ def execute(relation:dict, services:dict, aggregate_parameter):
 
     #构建解析树，通常来讲，这东西应该是个树，避免成环
     #至于成环了怎么办，凉拌
-    parser = aggregate_collect_parser(tree,hdr_type,hdr_name,struct)
+    parser = aggregate_collect_parser(tree,hdr_type,hdr_name,struct,define_table.consts)
 
     #针对每个节点开始构建节点级别的parser
     #在这个过程中需要记录header里面都用到什么了
@@ -361,13 +332,13 @@ def execute(relation:dict, services:dict, aggregate_parameter):
                         ins = ins.children[0]
                         if ins.data == "data":
                             ins = ins.children[0].children[0].value
-                            if ins in const_dict_global:
-                                ins = const_dict_global[ins]
+                            if ins in define_table.consts:
+                                ins = define_table.consts[ins]
                             file.write(ins)
                         elif ins.data == "data_plus":
                             ins_h = ins.children[0].children[0].children[0].value
-                            if ins_h in const_dict_global:
-                                ins_h = const_dict_global[ins_h]
+                            if ins_h in define_table.consts:
+                                ins_h = define_table.consts[ins_h]
                             file.write(ins_h)
                             int_t = ins.children[1].children[0].value
                             file.write(" * ")
@@ -392,8 +363,8 @@ def execute(relation:dict, services:dict, aggregate_parameter):
                                 exit()
                         elif data.data == "name":
                             d = data.children[0].value
-                            if d in const_dict_global:
-                                d = const_dict_global[d]
+                            if d in define_table.consts:
+                                d = define_table.consts[d]
                             file.write(d)
                         else:
                             print("error-aggragate_execute 9991")
@@ -414,8 +385,8 @@ def execute(relation:dict, services:dict, aggregate_parameter):
                                 exit()
                         elif data.data == "name":
                             d = data.children[0].value
-                            if d in const_dict_global:
-                                d = const_dict_global[d]
+                            if d in define_table.consts:
+                                d = define_table.consts[d]
                             file.write(d)
                         else:
                             print("error-aggragate_execute 9993")
@@ -472,8 +443,8 @@ def execute(relation:dict, services:dict, aggregate_parameter):
                     else:
                         for next in parser_node_have[pn].next:
                             file.write("            ")
-                            if parser_node_have[pn].next[next] in const_dict_global:
-                                cond = const_dict_global[parser_node_have[pn].next[next]]
+                            if parser_node_have[pn].next[next] in define_table.consts:
+                                cond = define_table.consts[parser_node_have[pn].next[next]]
                             else:
                                 cond = parser_node_have[pn].next[next]
                             file.write(cond)
@@ -547,7 +518,75 @@ def execute(relation:dict, services:dict, aggregate_parameter):
 
 
 #提取解析树
-def aggregate_collect_parser(tree:Tree,hdr_type:str,hdr_name:str,struct:dict):
+#片段放到节点上占用的表数量，take为True时记为已放下
+def table_cost(budget, node:str, frag:str, table_num:int, take=False):
+    if budget is None:
+        return table_num
+    cost = budget.cost(node, frag, table_num)
+    if take:
+        budget.take(node, frag)
+    return cost
+
+#片段中Next对应的端口：服务路径上本节点的下一个节点，最后一个节点为0
+def next_port(frag:str, node:str, path:dict, topo:dict):
+    tt = frag.split('_')
+    tt = tt[0]
+    next_node = path[tt].index(node) + 1
+    if next_node == len(path[tt]):
+        next_node = 0
+    else:
+        next_node = path[tt][next_node]
+    if next_node in topo[node]['next']:
+        next_node = topo[node]['next'][next_node]
+    return str(next_node)
+
+#读取片段的一部分（tem/action/table/reg/control），action和control中的Next换成本节点的端口
+def read_frag(aggregate_parameter, frag:str, part:str, node:str, path:dict, topo:dict, if_print=False):
+    lines = []
+    for line in aggregate_parameter["fragments"].read(frag + "_" + part + ".pne").splitlines(keepends=True):
+        if (part == "action" or part == "control") and line.find('Next') != -1:
+            if if_print:
+                print("ag 555",frag.split('_'))
+            line = line.replace('Next',next_port(frag, node, path, topo))
+        lines.append(line)
+    return "".join(lines)
+
+#片段表项中_Next对应的端口：本节点去往下一个节点的端口，最后一个节点换成主机端口，debug时为0
+def next_entry_port(aggregate_parameter, frag:str, node:str, path:dict, topo:dict, frag_to_service_name:dict):
+    port = '0'
+    index = path[frag_to_service_name[frag]].index(node)
+    if index+1 < len(path[frag_to_service_name[frag]]):
+        port = str(topo[node]['next'][path[frag_to_service_name[frag]][index+1]])
+    else:
+        if aggregate_parameter["if_debug"] == 'no':
+            with open(aggregate_parameter["input_path"] + "//" + aggregate_parameter["service_json_file"],"r") as f_r:
+                serv_json = json.load(f_r)
+            for user in serv_json:
+                for serv in serv_json[user]["services"]:
+                    if "service_hosts" in serv:
+                        if serv["service_name"] == frag_to_service_name[frag]:
+                            for h in serv["service_hosts"][-1]["ports"]:
+                                port = str(serv["service_hosts"][-1]["ports"][h])
+    return port
+
+#读取片段表项的函数，每次调用从头逐行读取片段，逐条产出表项dict，action参数中的_Next换成 next_entry_port
+#任何时候内存中只有一条表项，_Next的端口在第一次用到时算一次
+def frag_entry_reader(aggregate_parameter, frag:str, node:str, path:dict, topo:dict, frag_to_service_name:dict):
+    port = []
+    def entries():
+        for line in aggregate_parameter["fragments"].lines(frag + "_entry.pne"):
+            if len(line) > 10:
+                e = json.loads(line)
+                for v in e['action_params']:
+                    for vi in e['action_params'][v]:
+                        if vi == '_Next':
+                            if not port:
+                                port.append(next_entry_port(aggregate_parameter, frag, node, path, topo, frag_to_service_name))
+                            e['action_params'][v] = [port[0]]
+                yield e
+    return entries
+
+def aggregate_collect_parser(tree:Tree,hdr_type:str,hdr_name:str,struct:dict,consts:dict):
     nodet = []
     nodes = {}
     for t in tree.children:
@@ -589,11 +628,11 @@ def aggregate_collect_parser(tree:Tree,hdr_type:str,hdr_name:str,struct:dict):
                             else:
                                 cond = cond.children[0].value
                                 if cond != 'default':
-                                    if cond not in const_dict_global:
+                                    if cond not in consts:
                                         print("error-aggregate_collect_parser 777888")
                                         print(cond)
                                         exit()
-                                    cond = const_dict_global[cond]
+                                    cond = consts[cond]
                             node.next[next_node] = cond
         #记录指令
         for ins in n.children:
@@ -669,17 +708,16 @@ def aggregate_collect_deparser(tree:Tree,hdr_type:str,hdr_name:str,struct:dict):
 
 #解析parser，把树返回回来
 def aggregate_parse_parser(aggregate_parameter):
-    parser = Lark(grammar_parser)
+    parser = registry.get_parser("grammar_parser")
     with open(aggregate_parameter["input_path"] + '//include//parser.pne','r') as file:
         code = file.read()
         tree = parser.parse(code)
         return tree
 
 #针对header和struct做组件提取,环境需要高于3.6，因为只有3.6以后字典是有序的
-def aggregate_collect_header(tree:Tree):
+def aggregate_collect_header(tree:Tree,type_dict:dict):
     #先提取一下header
     header_ts = {}
-    global type_dict_global
     for header in tree.children:
         if header.data == "header":
             header_t_name = ''
@@ -691,8 +729,8 @@ def aggregate_collect_header(tree:Tree):
                     name_t = h_def.children[1].value
                     type_t = h_def.children[0].value
                     if type_t[:4] != "bit<":
-                        if type_t in type_dict_global:
-                            type_t = type_dict_global[type_t]
+                        if type_t in type_dict:
+                            type_t = type_dict[type_t]
                         else:
                             print("error-aggregate_collect_header what type",type_t)
                             exit()
@@ -714,8 +752,8 @@ def aggregate_collect_header(tree:Tree):
                     if type_t[:4] != "bit<":
                         if type_t in header_ts:
                             pass
-                        elif type_t in type_dict_global:
-                            type_t = type_dict_global[type_t]
+                        elif type_t in type_dict:
+                            type_t = type_dict[type_t]
                         elif type_t in struct_ts:
                             #我不想支持这个东西
                             pass
@@ -731,30 +769,8 @@ def aggregate_collect_header(tree:Tree):
 
 #解析header，把树返回出来
 def aggregate_parse_header(aggregate_parameter):
-    parser = Lark(grammar_header)
+    parser = registry.get_parser("grammar_header")
     with open(aggregate_parameter["input_path"] + '//include//header.pne','r') as file:
         code = file.read()
         tree = parser.parse(code)
         return tree
-
-#这是构建define列表
-#我其实没想到这里也要用到这个东西，所以其实预编译确实应该扔出去做
-def construct_type_dict_global(aggregate_parameter):
-    global type_dict_global,const_dict_global
-    type_dict_global = {}
-    parser = Lark(grammar_define)
-    with open(aggregate_parameter["input_path"] + '//include//define.pne','r') as file:
-        code = file.read()
-        tree = parser.parse(code)
-        for define_t in tree.children:
-            if define_t.data == "type_define":
-                type_dict_global[define_t.children[1].value] = define_t.children[0].value
-            elif define_t.data == "const_define":
-                name = define_t.children[1]
-                value = define_t.children[2]
-                const_dict_global[name.children[0].children[0].value] = value.children[0].children[0].value
-            else:
-                print("666565",define_t.data)
-                exit()
-            type_dict_global['bool'] = 'bit<1>'
-    return type_dict_global
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""cache.py - 编译缓存的公共工具
+
+功能说明：
+    Lynette 的多个阶段（语法构建、语法树、模块IR等）都会把中间结果缓存到磁盘，
+    这里统一负责缓存目录的定位、内容哈希以及原子写入，避免各处各写一套。
+
+缓存目录：
+    - 默认位于 ~/.cache/lynette/<子目录>
+    - 可以通过环境变量 LYNETTE_CACHE_DIR 指定根目录
+    - 设置环境变量 LYNETTE_NO_CACHE=1 可以关闭全部磁盘缓存
+    - 每个子目录的大小上限默认 256MB，可以通过环境变量 LYNETTE_CACHE_SIZE（单位MB）修改，
+      超出后按最近使用时间淘汰
+    - 进程内的缓存（LRU）使用同样的大小上限
+    - 进程内的记忆表（Memo）在 --watch 每次重编译前用 sweep() 删掉上一次编译中没有用到的项
+"""
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+#每个缓存子目录默认的大小上限（字节）
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+#淘汰时删到上限的这个比例，留出余量，避免接近上限后每次写入都要扫描目录
+EVICT_RATIO = 0.9
+
+#所有的进程内记忆表，sweep() 逐个清理
+_memos = []
+
+#各缓存子目录的总大小 {目录: 字节数}，第一次淘汰时扫描一次目录，之后由 atomic_write 累加
+_sizes = {}
+
+
+def cache_enabled():
+    """磁盘缓存是否开启。"""
+    return os.environ.get("LYNETTE_NO_CACHE", "") in ("", "0")
+
+
+def cache_dir(sub:str):
+    """返回某一类缓存的目录，不存在则创建。
+
+    Args:
+        sub (str): 子目录名，例如 grammar、tree。
+
+    Returns:
+        str: 缓存目录的绝对路径；创建失败时返回None，调用方应退化为不缓存。
+    """
+    root = os.environ.get("LYNETTE_CACHE_DIR")
+    if not root:
+        root = os.path.join(os.path.expanduser("~"), ".cache", "lynette")
+    path = os.path.join(root, sub)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    return path
+
+
+def digest(*parts):
+    """对若干字符串/字节串做sha256，返回十六进制摘要。"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def atomic_write(path:str, data:bytes):
+    """先写临时文件再rename，保证并发编译时不会读到写了一半的缓存。
+
+    写入失败（只读目录、磁盘满等）时静默放弃，缓存只是加速手段。
+    """
+    directory = os.path.dirname(path)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+        if directory in _sizes:
+            #覆盖已有文件时会多算，只会让下一次淘汰提前扫描一次，扫描时重新统计
+            _sizes[directory] += len(data)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except (OSError, UnboundLocalError):
+            pass
+
+
+def read(path:str):
+    """读取缓存文件，命中时刷新文件的修改时间，供LRU淘汰使用。
+
+    Returns:
+        bytes: 文件内容；不存在或读取失败时返回None。
+    """
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def max_bytes():
+    """每个缓存子目录的大小上限（字节）。"""
+    size = os.environ.get("LYNETTE_CACHE_SIZE", "")
+    try:
+        return int(float(size) * 1024 * 1024) if size else DEFAULT_MAX_BYTES
+    except ValueError:
+        return DEFAULT_MAX_BYTES
+
+
+def evict(directory:str, limit:int=None):
+    """目录总大小超过上限时，按修改时间从旧到新删除文件，直到低于上限的 EVICT_RATIO。
+
+    read() 命中时会刷新修改时间，所以这里的顺序就是最近最少使用的顺序。
+    目录的总大小只在第一次调用和超过上限时扫描统计，其余时候用 atomic_write 累加的值，
+    每次写入后调用的开销是常数。
+
+    Args:
+        directory (str): 缓存目录。
+        limit (int): 大小上限（字节），默认取 max_bytes()。
+    """
+    if limit is None:
+        limit = max_bytes()
+    if directory in _sizes and _sizes[directory] <= limit:
+        return
+    entries = []
+    total = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(".tmp_"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    if total > limit:
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= limit * EVICT_RATIO:
+                break
+    _sizes[directory] = total
+
+
+class LRU():
+    """进程内按字节数计的LRU缓存，总大小超过上限时淘汰最久没有使用的项。
+
+    各项的大小由调用方给出（例如pickle后的长度），只用来估计占用的内存。
+
+    Attributes:
+        limit (int): 大小上限（字节），默认取 max_bytes()
+        total (int): 当前各项大小之和
+    """
+
+    def __init__(self, limit:int=None):
+        self.limit = max_bytes() if limit is None else limit
+        self.total = 0
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """取出一项并标记为最近使用。"""
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value, size:int):
+        """放入一项，超过上限时从最久没有使用的开始淘汰，刚放入的一项总是保留。"""
+        if key in self._items:
+            self.total -= self._items.pop(key)[1]
+        self._items[key] = (value, size)
+        self.total += size
+        while self.total > self.limit and len(self._items) > 1:
+            _, (_, old_size) = self._items.popitem(last=False)
+            self.total -= old_size
+
+    def clear(self):
+        self._items.clear()
+        self.total = 0
+
+
+class Memo(dict):
+    """进程内的记忆表，用法同dict，记下上一次 sweep 之后读写过的key。
+
+    单次编译中表的大小由输入决定；--watch 常驻时每次修改都会带来新的项，
+    sweep 删掉上一次编译中没有用到的项，表的大小不超过最近一次编译用到的内容。
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.used = set()
+        _memos.append(self)
+
+    def __getitem__(self, key):
+        self.used.add(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self:
+            self.used.add(key)
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        self.used.add(key)
+        dict.__setitem__(self, key, value)
+
+    def sweep(self):
+        """删掉上一次 sweep 之后没有读写过的项。"""
+        for key in [key for key in self if key not in self.used]:
+            del self[key]
+        self.used = set()
+
+
+def sweep():
+    """清理所有的进程内记忆表，--watch 在每次重编译前调用。"""
+    for memo in _memos:
+        memo.sweep()
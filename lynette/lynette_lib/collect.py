@@ -29,6 +29,10 @@
     5. 主入口函数：
        - execute()               : 遍历语法森林，调度所有收集函数
 
+    6. 融合解析：
+       - CollectTransformer      : 作为LALR解析器的内联transformer，在规约service/application/module
+                                   时直接调用上面的收集函数，组件的语法树用完即丢
+
 Application 组件结构：
     collect_app() 处理的子组件：
     ├─ define
@@ -65,15 +69,20 @@ Module 组件结构：
 注意事项：
     - 所有 collect_xxx 函数遵循相同模式：输入Tree → 提取数据 → 输出data_structure对象
     - Module 比 Application 支持更多的特性（如 assert、switch、func、reg等）
+    - 指令节点由 CODE_BODY_INS / APP_INS / MODULE_INS 三张表分派到收集函数，每种指令收集成对应的 LYNETTE_INS 子类
+    - 源码片段相同的module在进程内共享同一个 LYNETTE_MODULE（collect_shared_module），收集结果不要修改
     - 遇到未识别的节点类型时，程序会打印错误信息并退出
 """
 
+
 from lark import Lark, Tree, Token
+from lynette.lynette_lib import cache
 from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import entry_scanner
+from lynette.lynette_lib.grammar.grammar_lalr import RetagDataType
 
 def collect_ins_assign(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "ins_assign"
+    ins_data = data_structure.LYNETTE_INS_ASSIGN()
     ins_left_tem = ins.children[0]
     for data_tem in ins_left_tem.children:
         ins_data.left.append(data_tem)
@@ -81,8 +90,7 @@ def collect_ins_assign(ins:Tree):
     return ins_data
 
 def collect_ins_cul(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "ins_cul"
+    ins_data = data_structure.LYNETTE_INS_CUL()
     ins_data.left.append(ins.children[0])
     ins_data.right1 = ins.children[1]
     ins_data.op = ins.children[2].value
@@ -90,8 +98,7 @@ def collect_ins_cul(ins:Tree):
     return ins_data
 
 def collect_ins_call(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "ins_call"
+    ins_data = data_structure.LYNETTE_INS_CALL()
     ins_call_name = ins.children[0].value
     ins_data.call_name = ins_call_name
     if len(ins.children) > 1:
@@ -101,8 +108,7 @@ def collect_ins_call(ins:Tree):
     return ins_data
 
 def collect_func_call(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "func_call"
+    ins_data = data_structure.LYNETTE_FUNC_CALL()
     ins_call_name = ins.children[0].value
     ins_data.call_name = ins_call_name
     if len(ins.children) > 1:
@@ -112,8 +118,7 @@ def collect_func_call(ins:Tree):
     return ins_data
 
 def collect_primitive(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "primitive"
+    ins_data = data_structure.LYNETTE_INS_PRIMITIVE()
     ins_data.primitive_type = ins.children[0].data
     if ins_data.primitive_type == "addheader":
         ins_data.primitive_par.append(ins.children[0].children[0])
@@ -139,24 +144,11 @@ def collect_code_body(body:Tree):
     for ins_p in body.children:
         if ins_p.data == "instruction":
             ins = ins_p.children[0]
-            if ins.data == "ins_assign":
-                ins_data = collect_ins_assign(ins)
-                code_body.ins.append(ins_data)
-            elif ins.data == "ins_call":
-                ins_data = collect_ins_call(ins)
-                code_body.ins.append(ins_data)
-            elif ins.data == "if":
-                ins_data = collect_if(ins)
-                code_body.ins.append(ins_data)
-            elif ins.data == "primitive":
-                ins_data = collect_primitive(ins)
-                code_body.ins.append(ins_data)
-            elif ins.data == "ins_cul":
-                ins_data = collect_ins_cul(ins)
-                code_body.ins.append(ins_data)
-            else:
+            collector = CODE_BODY_INS.get(ins.data)
+            if collector is None:
                 print("?-collect.py-collect_code_body-ins_type",ins.data)
                 exit()
+            code_body.ins.append(collector(ins))
     return code_body
 
 def collect_condition(condition_define:Tree):
@@ -180,8 +172,7 @@ def collect_condition(condition_define:Tree):
     return condition
 
 def collect_assert(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "assert"
+    ins_data = data_structure.LYNETTE_INS_ASSERT()
     condition = data_structure.LYNETTE_CONDITION()
     for node in ins.children:
         condition = collect_condition(node)
@@ -189,8 +180,7 @@ def collect_assert(ins:Tree):
     return ins_data
 
 def collect_if(ins:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "if"
+    ins_data = data_structure.LYNETTE_INS_IF()
     for block_tem in ins.children:
         if block_tem.data == "if_block":
             condition = data_structure.LYNETTE_CONDITION()
@@ -236,18 +226,8 @@ def collect_app(tree:Tree):
             else:
                 print("?-collect.py-collect_app-define_type",ins.data)
                 exit()
-        elif ins.data == "ins_assign":
-            ins_data = collect_ins_assign(ins)
-            app.ins.append(ins_data)
-        elif ins.data == "ins_call":
-            ins_data = collect_ins_call(ins)
-            app.ins.append(ins_data)
-        elif ins.data == "if":
-            ins_data = collect_if(ins)
-            app.ins.append(ins_data)
-        elif ins.data == "primitive":
-            ins_data = collect_primitive(ins)
-            app.ins.append(ins_data)
+        elif ins.data in APP_INS:
+            app.ins.append(APP_INS[ins.data](ins))
         else:
             print("?-collect.py-collect_app-ins_type",ins.data)
             exit()
@@ -263,8 +243,7 @@ def collect_service(tree:Tree):
     return service_name , service
 
 def collect_switch(tree:Tree):
-    ins_data = data_structure.LYNETTE_INS()
-    ins_data.type = "switch"
+    ins_data = data_structure.LYNETTE_INS_SWITCH()
     for node in tree.children:
         if node.data == "switch_key":
             for key in node.children:
@@ -284,6 +263,33 @@ def collect_switch(tree:Tree):
             exit()
     return ins_data
 
+#指令节点 -> 收集函数，三处允许的指令种类不同
+#代码块（if分支、func）
+CODE_BODY_INS = {
+    "ins_assign": collect_ins_assign,
+    "ins_call": collect_ins_call,
+    "if": collect_if,
+    "primitive": collect_primitive,
+    "ins_cul": collect_ins_cul,
+}
+#application
+APP_INS = {
+    "ins_assign": collect_ins_assign,
+    "ins_call": collect_ins_call,
+    "if": collect_if,
+    "primitive": collect_primitive,
+}
+#module的control块，define/annotation/ins_null单独处理
+MODULE_INS = {
+    "assert": collect_assert,
+    "switch": collect_switch,
+    "if": collect_if,
+    "ins_assign": collect_ins_assign,
+    "ins_call": collect_ins_call,
+    "ins_cul": collect_ins_cul,
+    "primitive": collect_primitive,
+}
+
 def collect_module(tree:Tree):
     module_name = tree.children[0].children[0].value
     module = data_structure.LYNETTE_MODULE()
@@ -296,9 +302,9 @@ def collect_module(tree:Tree):
         elif node.data == "control":
             for inss in node.children[0].children:
                 ins = inss.children[0]
-                if ins.data == "assert":
-                    ins_data = collect_assert(ins)
-                    module.ins.append(ins_data)
+                collector = MODULE_INS.get(ins.data)
+                if collector is not None:
+                    module.ins.append(collector(ins))
                 elif ins.data == "define":
                     ins = ins.children[0]
                     if ins.data == "tuple":
@@ -316,14 +322,7 @@ def collect_module(tree:Tree):
                                 for j in i.children:
                                    setl.key.append(j) 
                             elif i.data == "entry":
-                                int_i = 0
-                                for entry_i in i.children:
-                                    entry = []
-                                    for entry_data in entry_i.children:
-                                        entry_data = entry_data.children[0].children[0].value
-                                        entry.append(entry_data)
-                                    setl.entry[int_i] = entry
-                                    int_i = int_i + 1
+                                setl.entry = entry_scanner.scan(i.children[0].value)
                             else:
                                 print("?-collect.py-collect_module-define-set",i.data)
                                 exit()
@@ -342,14 +341,7 @@ def collect_module(tree:Tree):
                             elif i.data == "map_len":
                                 mapl.size = int(i.children[0].children[0].value)
                             elif i.data == "entry":
-                                int_i = 0
-                                for entry_i in i.children:
-                                    entry = []
-                                    for entry_data in entry_i.children:
-                                        entry_data = entry_data.children[0].children[0].value
-                                        entry.append(entry_data)
-                                    mapl.entry[int_i] = entry
-                                    int_i = int_i + 1
+                                mapl.entry = entry_scanner.scan(i.children[0].value)
                             else:
                                 print("?-collect.py-collect_module-define-map",i.data)
                                 exit()
@@ -378,24 +370,6 @@ def collect_module(tree:Tree):
                     else:
                         print("?-collect.py-collect_module-define",ins.data)
                         exit()
-                elif ins.data == "switch":
-                    ins_data = collect_switch(ins)
-                    module.ins.append(ins_data)
-                elif ins.data == "if":
-                    ins_data = collect_if(ins)
-                    module.ins.append(ins_data)
-                elif ins.data == "ins_assign":
-                    ins_data = collect_ins_assign(ins)
-                    module.ins.append(ins_data)
-                elif ins.data == "ins_call":
-                    ins_data = collect_ins_call(ins)
-                    module.ins.append(ins_data)
-                elif ins.data == "ins_cul":
-                    ins_data = collect_ins_cul(ins)
-                    module.ins.append(ins_data)
-                elif ins.data == "primitive":
-                    ins_data = collect_primitive(ins)
-                    module.ins.append(ins_data)
                 elif ins.data == "annotation":
                     pass
                 elif ins.data == "ins_null":
@@ -418,6 +392,101 @@ def collect_module(tree:Tree):
             exit()
     return module_name, module
 
+class CollectTransformer(RetagDataType):
+    """解析和收集融合的内联transformer。
+
+    LALR规约到service/application/module时，子树已经完整，直接调用对应的collect函数
+    转换成data_structure对象，code节点中保存的是 (组件类型, 组件名, 组件对象, 组件在源码中的起点)，
+    组件本身的语法树不再保留。include等其它节点和普通语法树一样，parser_tree仍可以据此找include文件。
+    parser_tree 解析完成后按起点算出module的源码片段哈希，登记为共享的模块IR，并去掉起点（见 share_fused）。
+    """
+
+    def service(self, children):
+        return ("service",) + collect_service(Tree("service", children)) + (_start_pos(children),)
+
+    def application(self, children):
+        return ("application",) + collect_app(Tree("application", children)) + (_start_pos(children),)
+
+    def module(self, children):
+        return ("module",) + collect_module(Tree("module", children)) + (_start_pos(children),)
+
+
+def _start_pos(children):
+    """组件第一个token在源码中的位置。"""
+    node = children[0] if children else None
+    while isinstance(node, Tree):
+        node = node.children[0] if node.children else None
+    return getattr(node, "start_pos", None)
+
+
+#进程内共享的模块IR {模块源码片段的哈希: LYNETTE_MODULE}，多个用户include同一个模块库时只收集一次
+_modules = cache.Memo()
+
+
+def collect_shared_module(tree:Tree):
+    """收集一个module，源码片段相同的module直接返回同一个对象。
+
+    片段哈希由 parser_tree 在解析时记在module节点的meta中（meta.source_key），
+    没有记录的节点照常收集，不参与共享。返回的对象在用户之间共享，不要修改。
+    """
+    key = getattr(tree.meta, "source_key", None)
+    if key is None:
+        return collect_module(tree)
+    module = _modules.get(key)
+    if module is None:
+        _, module = collect_module(tree)
+        module.source = key
+        _modules[key] = module
+    return module.name, module
+
+
+def share_fused(component:tuple, key):
+    """融合解析得到的组件去掉起点；module按源码片段哈希key（可以为None）登记为共享的模块IR。
+
+    Returns:
+        tuple: (组件类型, 组件名, 组件对象)，module相同时为进程内共享的对象。
+    """
+    node_type, name, obj = component[:3]
+    if node_type != "module" or key is None:
+        return (node_type, name, obj)
+    obj.source = key
+    return (node_type, name, shared_module(key, lambda: obj))
+
+
+def shared_module(key, load):
+    """按源码片段哈希取共享的模块IR，进程内还没有时调用load()得到并登记，IR快照读取模块时使用。"""
+    module = _modules.get(key)
+    if module is None:
+        module = load()
+        _modules[key] = module
+    return module
+
+
+def clear():
+    """清空进程内共享的模块IR。"""
+    _modules.clear()
+
+
+def collect_node(node):
+    """收集code下的一个组件，返回 (组件类型, 组件名, 组件对象)。
+
+    融合解析得到的组件已经收集好了，语法树缓存会在多个用户之间共享同一个对象，
+    generate不会修改IR，这里直接返回；带源码片段哈希的module换成进程内共享的对象（磁盘缓存读出的语法树）。
+    """
+    if isinstance(node, tuple):
+        if node[0] == "module" and node[2].source is not None:
+            return ("module", node[1], shared_module(node[2].source, lambda: node[2]))
+        return node
+    if node.data == 'service':
+        return ('service',) + collect_service(node)
+    elif node.data == 'application':
+        return ('application',) + collect_app(node)
+    elif node.data == 'module':
+        return ('module',) + collect_shared_module(node)
+    else:
+        print("?-collect.py-execute",node.data)
+        exit()
+
 def execute(forest:dict, path):
     """从语法森林中提取并收集所有程序组件（service、application、module）。
     
@@ -430,6 +499,7 @@ def execute(forest:dict, path):
     Args:
         forest (dict): 语法森林字典，key为文件名标识，value为Lark语法树对象。
                        由parser_tree.execute()生成，包含入口文件及其所有include文件的语法树。
+                       使用融合解析（--parser fused）时code节点下已经是收集好的组件。
         path (str): 工程输入路径，用于写入日志文件。
     
     Returns:
@@ -460,26 +530,20 @@ def execute(forest:dict, path):
         # 遍历语法树的直接子节点，查找'code'节点（包含实际的程序组件）
         for code in tree.children:
             if code.data == 'code':
-                # 遍历code节点下的所有组件节点
+                # 遍历code节点下的所有组件节点，未知节点类型在collect_node中报错退出
                 for node in code.children:
+                    node_type, name, component = collect_node(node)
                     # 处理service组件：服务定义，描述应用调用关系
-                    if node.data == 'service':
-                        service_name,service = collect_service(node)
-                        if service_name not in services:
-                            services[service_name] = service
+                    if node_type == 'service':
+                        if name not in services:
+                            services[name] = component
                     # 处理application组件：应用定义，包含变量和指令
-                    elif node.data == 'application':
-                        app_name, app = collect_app(node)
-                        if app_name not in applications:
-                            applications[app_name] = app
+                    elif node_type == 'application':
+                        if name not in applications:
+                            applications[name] = component
                     # 处理module组件：模块定义，包含parser和control块
-                    elif node.data == 'module':
-                        module_name, module = collect_module(node)
-                        if module_name not in modules:
-                            modules[module_name] = module
-                    # 遇到未知节点类型，报错退出
-                    else:
-                        print("?-collect.py-execute",node.data)
-                        exit()
+                    elif node_type == 'module':
+                        if name not in modules:
+                            modules[name] = component
     return services, applications, modules
         
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""cse.py - 服务内公共子表达式的复用
+
+功能说明：
+    一个服务中串起来的多个app（以及同一个app中多次调起的module）经常对同样的key做同样的map取值、
+    对同一个头部字段做同样的赋值。generate展开时记录已经生成过的：
+    1. map取值：(map, key列表) -> 左值列表，再次遇到同样的取值并且左值完全相同时整条去掉；
+       左值不同时不复用：从前一次的左值赋值在表未命中时会改写左值，而原来的取值未命中时左值保持不变；
+    2. check条件：(map/set, key列表) -> 命中变量，再次遇到时直接用前一次的命中变量；
+    3. 简单赋值：(左值, 右值)，再次遇到时去掉。
+    记录下来的结果在它读写的名字被再次写入之后失效；在if分支、assert中记录的结果离开分支后失效。
+
+    复用跨越片段时要求值在节点之间保持不变：
+    - 同一个片段中任何结果都可以复用；
+    - 同一个app的不同片段不复用（head和tail片段会放到app经过的每个节点上，执行顺序和生成顺序不一致）；
+    - 前面的app中的结果只有全部是hdr或常量时才复用，表项中带 _Next（每个节点不同）的map不跨片段复用。
+    log不为None时记下每个操作，Generator用它记下module的展开（见expansion.py）。
+"""
+
+from lynette.lynette_lib import data_structure
+
+#在节点之间保持不变的数据类型（generate_data给出的类型）
+PERSISTENT = ("hdr", "int", "ip_data", "sys_data")
+
+
+def persistent(data:tuple):
+    """(名字, 类型) 在节点之间是不是保持不变，Next在每个节点上换成不同的端口。"""
+    name, data_type = data
+    return data_type in PERSISTENT and name != "Next"
+
+
+def portable(entry):
+    """表项在每个节点上是不是一样，外部表项文件不读取，按不一样处理。"""
+    if not isinstance(entry, data_structure.LYNETTE_ENTRY):
+        return False
+    return all(column.kind != "str" or "_Next" not in column.values for column in entry.columns)
+
+
+class Found():
+    """记录下来的一个结果。
+
+    Attributes:
+        frag (str): 生成它的片段
+        app (str): 生成它的app前缀
+        seq (int): 记录时的写入计数
+        names (list): 读写到的 (名字, 类型)，其中任何一个再被写入结果就失效
+        result (list): 结果 (名字, 类型) 列表
+        portable (bool): 能不能跨片段复用
+    """
+    __slots__ = ("frag", "app", "seq", "names", "result", "portable")
+
+    def __init__(self, frag:str, app:str, seq:int, names:list, result:list, portable:bool):
+        self.frag = frag
+        self.app = app
+        self.seq = seq
+        self.names = names
+        self.result = result
+        self.portable = portable
+
+
+class Available():
+    """generate展开一个服务时可以复用的结果。
+
+    Attributes:
+        app (str): 当前展开的app前缀
+        seq (int): 写入计数
+        written (dict): {名字: 最后一次写入时的seq}
+        found (dict): {key: Found}
+        marks (list): 还没离开的分支开始时的seq
+        counts (dict): 各类复用的次数，跨服务累计
+        log (list): 不为None时记下每个操作
+    """
+
+    def __init__(self):
+        self.counts = {"lookup": 0, "check": 0, "store": 0}
+        self.log = None
+        self.reset()
+
+    def reset(self):
+        """开始一个新的服务。"""
+        self.app = ""
+        self.seq = 0
+        self.written = {}
+        self.found = {}
+        self.marks = []
+
+    def wrote(self, name:str):
+        if self.log is not None:
+            self.log.append(("wrote", name))
+        self.seq = self.seq + 1
+        self.written[name] = self.seq
+
+    def clear(self):
+        """不知道改了什么（如头部压缩），全部失效。"""
+        if self.log is not None:
+            self.log.append(("clear",))
+        self.found = {}
+
+    def push(self):
+        """进入一个分支。"""
+        if self.log is not None:
+            self.log.append(("push",))
+        self.marks.append(self.seq)
+
+    def pop(self):
+        """离开分支，分支中记录的结果失效。"""
+        if self.log is not None:
+            self.log.append(("pop",))
+        mark = self.marks.pop()
+        self.found = {key: found for key, found in self.found.items() if found.seq <= mark}
+
+    def add(self, key:tuple, frag:str, reads:list, result:list, portable=True):
+        if self.log is not None:
+            self.log.append(("add", key, reads, result, portable))
+        self.seq = self.seq + 1
+        self.found[key] = Found(frag, self.app, self.seq, reads + result, result, portable)
+
+    def get(self, key:tuple, frag:str):
+        """在片段frag中能复用的结果，没有时返回None。"""
+        result = self.find(key, frag)
+        if self.log is not None:
+            self.log.append(("get", key, result is not None))
+        return result
+
+    def find(self, key:tuple, frag:str):
+        found = self.found.get(key)
+        if found is None:
+            return None
+        if any(self.written.get(name, 0) > found.seq for name, _ in found.names):
+            del self.found[key]
+            return None
+        if found.frag != frag:
+            if found.app == self.app or not found.portable:
+                return None
+            if not all(persistent(data) for data in found.names):
+                return None
+        return found.result
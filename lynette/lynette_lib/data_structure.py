@@ -1,4 +1,38 @@
+"""data_structure.py - 中间表示（IR）
+
+所有IR类都使用 __slots__，不再给每个实例分配 __dict__。
+指令按种类分成 LYNETTE_INS 的子类（LYNETTE_INS_ASSIGN、LYNETTE_INS_IF ...），每个子类只有自己用到的字段，
+collect 和 generate 按类型查表分派。
+不一定用得到的容器字段（列表、字典）用 LAZY 描述符声明，第一次访问时才创建空容器。
+容器字段的读写方式不变（ins.left.append(...)、ins.left = [...]）。
+"""
+
+
+class LAZY():
+    #惰性容器字段：值存放在 "_" + 字段名 的slot中，第一次访问时用factory创建
+    def __init__(self, factory=list):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.factory()
+            setattr(obj, self.slot, value)
+            return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+
 class LYNETTE_PIPELINE():
+    __slots__ = ("name", "modules", "parser", "deparser")
+
     def __init__(self):
         self.name = '666'
         self.modules = []
@@ -9,90 +43,226 @@ class LYNETTE_PIPELINE():
         print('name:',self.name)
 
 class LYNETTE_SERVICE():
+    __slots__ = ("name", "application")
+
     def __init__(self):
         self.name = '666'
         self.application = []
 
 class LYNETTE_APP():
+    __slots__ = ("name", "_var", "_tuple", "_mapl", "_setl", "_reg", "ins")
+    var = LAZY(dict) #变量
+    tuple = LAZY(dict)
+    mapl = LAZY(dict)
+    setl = LAZY(dict)
+    reg = LAZY(dict)
+
     def __init__(self):
         self.name = '666'
-        self.var = {} #变量
-        self.tuple = {}
-        self.mapl = {}
-        self.setl = {} 
-        self.reg = {}
         self.ins = []
 
 class LYNETTE_MODULE():
+    __slots__ = ("name", "call_type", "call_par", "call_par_type",
+                 "_var", "_tuple", "_mapl", "_setl", "_reg", "ins", "_func", "source")
+    var = LAZY(dict) #变量
+    tuple = LAZY(dict)
+    mapl = LAZY(dict)
+    setl = LAZY(dict)
+    reg = LAZY(dict)
+    func = LAZY(dict)
+
     def __init__(self):
         self.name = '666'
         self.call_type = []
         self.call_par = []
         self.call_par_type = []
-        self.var = {} #变量
-        self.tuple = {}
-        self.mapl = {}
-        self.setl = {} 
-        self.reg = {}
         self.ins = []
-        self.func = {}
+        self.source = None #源码片段的哈希，相同的模块在用户之间共享同一个对象，不要修改
+
+class LYNETTE_COLUMN():
+    #表项的一列，按列中的值选择存储方式，column[r] 和 texts() 给出和源码中一样的文本
+    #  int : 十进制整数，values 为 array('Q')
+    #  ip  : IPv4，values 为 array('I')，每个值32位
+    #  ips : IPv6，values/low 为两个 array('Q')，分别是高64位和低64位，每组按16进制解释
+    #  str : 其它（名字、sys_data、0x..、有前导0的数等），values 为字符串列表
+    __slots__ = ("kind", "values", "low")
+
+    def __init__(self, kind='str', values=None, low=None):
+        self.kind = kind
+        self.values = [] if values is None else values
+        self.low = low
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, row):
+        return self.texts(row, row + 1)[0]
+
+    def texts(self, start=0, stop=None):
+        """第 start 到 stop 行的文本列表。"""
+        values = self.values[start:stop]
+        if self.kind == 'str':
+            return list(values)
+        if self.kind == 'int':
+            return list(map(str, values))
+        if self.kind == 'ip':
+            return ["%d.%d.%d.%d" % (v >> 24, (v >> 16) & 255, (v >> 8) & 255, v & 255) for v in values]
+        return ["%x:%x:%x:%x:%x:%x:%x:%x" % (h >> 48, (h >> 32) & 65535, (h >> 16) & 65535, h & 65535,
+                                             l >> 48, (l >> 32) & 65535, (l >> 16) & 65535, l & 65535)
+                for h, l in zip(values, self.low[start:stop])]
+
+class LYNETTE_ENTRY():
+    #列式表项：columns[i][r] 是第r条表项的第i个值，每一列是一个 LYNETTE_COLUMN
+    #保留了 len(entry)、for e in entry、entry[e][i] 的按行访问方式
+    __slots__ = ("rows", "columns")
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = []
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(range(self.rows))
+
+    def __getitem__(self, row):
+        if row < 0 or row >= self.rows:
+            raise IndexError(row)
+        return [column[row] for column in self.columns]
+
+    def __repr__(self):
+        return repr({r: self[r] for r in range(self.rows)})
+
+class LYNETTE_ENTRY_FILE():
+    #外部表项文件，只记录路径和格式，生成时由entry_scanner.iter_rows流式读取
+    __slots__ = ("path", "format")
+
+    def __init__(self, path, file_format):
+        self.path = path
+        self.format = file_format
+
+    def __repr__(self):
+        return self.format + ":" + self.path
 
 class LYNETTE_MAP():
+    __slots__ = ("name", "key", "value", "size", "entry")
+
     def __init__(self):
         self.name = '666'
         self.key = []
         self.value = []
         self.size = 50
-        self.entry = {}
+        self.entry = LYNETTE_ENTRY()
 
 class LYNETTE_SET():
+    __slots__ = ("name", "key", "size", "entry")
+
     def __init__(self):
         self.name = '666'
         self.key = []
         self.size = 50
-        self.entry = {}
+        self.entry = LYNETTE_ENTRY()
 
 class LYNETTE_INS():
+    #指令基类，每种指令一个子类，只带自己用到的字段
+    #type 是子类上的类属性（指令种类名），不能再给实例赋值
+    __slots__ = ()
+    type = ''
+
+class LYNETTE_INS_ASSIGN(LYNETTE_INS):
+    #a, b = expression
+    __slots__ = ("left", "right1")
+    type = "ins_assign"
+
     def __init__(self):
-        self.type = ''
+        self.left = []
+        self.right1 = ''
+
+class LYNETTE_INS_CUL(LYNETTE_INS):
+    #a = b op c
+    __slots__ = ("left", "right1", "right2", "op")
+    type = "ins_cul"
 
+    def __init__(self):
         self.left = []
         self.right1 = ''
         self.right2 = ''
         self.op = ''
 
+class LYNETTE_INS_CALL(LYNETTE_INS):
+    #Module.apply(...)
+    __slots__ = ("call_name", "_call_par")
+    type = "ins_call"
+    call_par = LAZY()
+
+    def __init__(self):
         self.call_name = ''
-        self.call_par = []
-        self.call_par_type = []
 
+class LYNETTE_FUNC_CALL(LYNETTE_INS_CALL):
+    #switch中的 func(...)
+    __slots__ = ()
+    type = "func_call"
+
+class LYNETTE_INS_IF(LYNETTE_INS):
+    #condition[i] 对应 condition_block[i]；else if 链在 else_ins 中，else 块在 default_bolck 中
+    __slots__ = ("condition", "condition_block", "else_ins_t", "else_ins", "default", "default_bolck")
+    type = "if"
+
+    def __init__(self):
         self.condition = []
         self.condition_block = []
         self.else_ins_t = 0
-        self.else_ins : LYNETTE_INS
+        self.else_ins : LYNETTE_INS_IF
         self.default = 0
         self.default_bolck : LYNETTE_BLOCK
 
+class LYNETTE_INS_SWITCH(LYNETTE_INS):
+    #case[i] 对应 func[i]
+    __slots__ = ("key", "case", "func")
+    type = "switch"
+
+    def __init__(self):
         self.key = []
         self.case = []
         self.func = []
 
+class LYNETTE_INS_PRIMITIVE(LYNETTE_INS):
+    #drop/nop/return/addHeader/...，没有参数的原语不创建primitive_par
+    __slots__ = ("primitive_type", "_primitive_par")
+    type = "primitive"
+    primitive_par = LAZY()
+
+    def __init__(self):
         self.primitive_type = ''
-        self.primitive_par = []
+
+class LYNETTE_INS_ASSERT(LYNETTE_INS):
+    __slots__ = ("condition",)
+    type = "assert"
+
+    def __init__(self):
+        self.condition = []
 
 class LYNETTE_FRAG_RELATION():
+    __slots__ = ("name", "input", "output", "varfile", "module", "table_num")
+
     def __init__(self):
         self.name = ''
-        self.input = []
-        self.output = []
+        self.input = [] #读取的标识符，symbols中的ID
+        self.output = [] #写入的标识符，symbols中的ID
         self.varfile = []
         self.module = {}
         self.table_num = 0
 
 class LYNETTE_BLOCK():
+    __slots__ = ("ins",)
+
     def __init__(self):
         self.ins = []
 
 class LYNETTE_CONDITION():
+    __slots__ = ("no", "type", "left", "right")
+
     def __init__(self):
         self.no = 0
         self.type = ''
@@ -100,12 +270,16 @@ class LYNETTE_CONDITION():
         self.right = []
 
 class LYNETTE_REG():
+    __slots__ = ("name", "type", "size")
+
     def __init__(self):
         self.name = ''
         self.type = ''
         self.size = 50
 
 class LYNETTE_PARSER_NODE():
+    __slots__ = ("name", "exact", "select", "protocol", "rely", "next", "ins")
+
     def __init__(self):
         self.name = ''
         self.exact = ''
@@ -116,6 +290,8 @@ class LYNETTE_PARSER_NODE():
         self.ins = [] #注意在node中用的ins和前面是完全不一样的东西，是个很原始的子树
 
 class LYNETTE_TABLE():
+    __slots__ = ("name", "keys")
+
     def __init__(self):
         self.name = ''
         self.keys = []
@@ -0,0 +1,427 @@
+"""dce.py - 死代码消除
+
+功能说明：
+    常量折叠之后、generate之前的一遍IR变换，删掉展开后不会产生任何效果的指令：
+    1. 条件是常量的if：只保留会走到的分支，分支中的指令直接放到if的位置；所有分支都为空的if整个删掉；
+    2. 条件是常量的assert：恒真时删掉assert，恒假时连同后面的指令一起删掉（它们永远不会执行）；
+    3. 赋值给局部变量、而这个变量在整个组件中没有被读取的赋值和计算指令；
+    4. 调用没有副作用的module、而它的out/inout参数对应的变量都没有被读取时，删掉这次调用；
+    5. 删完之后不再被引用的局部变量，从var中去掉，不再生成变量定义。
+
+    局部变量指application/module中定义的var（不包括module参数），读写hdr、meta、gmeta、pkt的指令都保留。
+    活跃性是整个组件范围内不分先后的：变量只要在任何地方被读取，对它的赋值就都保留；
+    删掉一条赋值可能让别的变量也不再被读取，所以反复删到没有变化为止。
+
+    没有副作用的module：control中只给局部变量或out/inout参数赋值，只调用没有副作用的module，
+    没有原语、switch，也没有写hdr/meta。map取值和set查询本身只是查表，可以删。
+
+    和常量折叠一样不修改传入的IR（模块在用户之间共享），有变化的组件复制一份再替换指令。
+"""
+
+import copy
+
+from lark import Tree
+
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import defines
+from lynette.lynette_lib import fold
+
+#比较条件的类型 -> 比较函数
+COMPARE = {
+    "compare_e": lambda a, b: a == b,
+    "compare_ne": lambda a, b: a != b,
+    "compare_b": lambda a, b: a > b,
+    "compare_be": lambda a, b: a >= b,
+    "compare_s": lambda a, b: a < b,
+    "compare_se": lambda a, b: a <= b,
+}
+
+
+class Report():
+    """删掉的指令、表和变量的数量。"""
+
+    def __init__(self):
+        self.ins = 0
+        self.tables = 0
+        self.vars = 0
+
+
+def names(tree, found:set):
+    """收集语法树中出现的局部名字（name节点）。"""
+    if not isinstance(tree, Tree):
+        return
+    if tree.data == "name":
+        found.add(tree.children[0].value)
+        return
+    for child in tree.children:
+        names(child, found)
+
+
+def local_name(data):
+    """data节点是一个局部名字时返回这个名字，否则返回None。"""
+    if isinstance(data, Tree) and data.data == "data" and data.children[0].data == "name":
+        return data.children[0].children[0].value
+    return None
+
+
+def count_ins(all_ins:list):
+    """递归统计指令数（包括if分支中的指令）。"""
+    n = 0
+    for ins in all_ins:
+        n = n + 1
+        if type(ins) is data_structure.LYNETTE_INS_IF:
+            for block in ins.condition_block:
+                n = n + count_ins(block.ins)
+            if ins.default == 1:
+                n = n + count_ins(ins.default_bolck.ins)
+            if ins.else_ins_t == 1:
+                n = n + count_ins([ins.else_ins]) - 1
+    return n
+
+
+class Eliminator():
+    """对一次编译中的所有application和module做死代码消除。
+
+    Attributes:
+        modules (dict): {模块名: LYNETTE_MODULE}，折叠之后的模块
+        consts (dict): {常量名: (数值, 位宽)}，用于判断条件是不是常量
+        done (dict): {模块名: 消除之后的LYNETTE_MODULE}
+        pure (dict): {模块名: 是否没有副作用}
+        report (Report): 删掉的数量
+    """
+
+    def __init__(self, modules:dict, consts:dict):
+        self.modules = modules
+        self.consts = consts
+        self.done = {}
+        self.pure = {}
+        self.report = Report()
+
+    def module(self, name:str):
+        """消除之后的module，按调用关系先处理被调用的module。"""
+        if name in self.done:
+            return self.done[name]
+        module = self.modules[name]
+        #递归调用时先当作有副作用
+        self.pure[name] = False
+        self.done[name] = module
+        module_t = self.component(module)
+        self.done[name] = module_t
+        outputs = set(p for p, t in zip(module.call_par, module.call_type) if t != "in")
+        self.pure[name] = self.is_pure(module_t.ins, set(module_t.var), outputs)
+        return module_t
+
+    def is_pure(self, all_ins:list, local:set, outputs:set):
+        """指令序列是否只写局部变量和out/inout参数。"""
+        for ins in all_ins:
+            if type(ins) in (data_structure.LYNETTE_INS_ASSIGN, data_structure.LYNETTE_INS_CUL):
+                if any(local_name(left) not in local | outputs for left in ins.left):
+                    return False
+            elif type(ins) is data_structure.LYNETTE_INS_IF:
+                while True:
+                    for block in ins.condition_block:
+                        if not self.is_pure(block.ins, local, outputs):
+                            return False
+                    if ins.default == 1 and not self.is_pure(ins.default_bolck.ins, local, outputs):
+                        return False
+                    if ins.else_ins_t != 1:
+                        break
+                    ins = ins.else_ins
+            elif type(ins) is data_structure.LYNETTE_INS_CALL:
+                if not self.call_pure(ins):
+                    return False
+                if any(local_name(data) not in local | outputs for data in self.call_outputs(ins)):
+                    return False
+            elif type(ins) is not data_structure.LYNETTE_INS_ASSERT:
+                return False
+        return True
+
+    def call_pure(self, ins):
+        if ins.call_name not in self.modules:
+            return False
+        module = self.modules[ins.call_name]
+        if len(module.call_par) != len(ins.call_par):
+            return False
+        self.module(ins.call_name)
+        return self.pure[ins.call_name]
+
+    def call_outputs(self, ins):
+        """调用中传给out/inout参数的实参。"""
+        module = self.modules.get(ins.call_name)
+        if module is None:
+            return []
+        return [data for data, t in zip(ins.call_par, module.call_type) if t != "in"]
+
+    def reads(self, all_ins:list, found:set):
+        """收集指令序列中被读取的局部名字。"""
+        for ins in all_ins:
+            if type(ins) is data_structure.LYNETTE_INS_ASSIGN:
+                names(ins.right1, found)
+                for left in ins.left:
+                    if local_name(left) is None:
+                        names(left, found)
+            elif type(ins) is data_structure.LYNETTE_INS_CUL:
+                names(ins.right1, found)
+                names(ins.right2, found)
+            elif type(ins) is data_structure.LYNETTE_INS_IF:
+                while True:
+                    for condition in ins.condition:
+                        self.condition_reads(condition, found)
+                    for block in ins.condition_block:
+                        self.reads(block.ins, found)
+                    if ins.default == 1:
+                        self.reads(ins.default_bolck.ins, found)
+                    if ins.else_ins_t != 1:
+                        break
+                    ins = ins.else_ins
+            elif type(ins) is data_structure.LYNETTE_INS_ASSERT:
+                for condition in ins.condition:
+                    self.condition_reads(condition, found)
+            elif type(ins) is data_structure.LYNETTE_INS_CALL:
+                module = self.modules.get(ins.call_name)
+                for i in range(len(ins.call_par)):
+                    #out参数只写不读
+                    if module is None or i >= len(module.call_type) or module.call_type[i] != "out":
+                        names(ins.call_par[i], found)
+            elif type(ins) is data_structure.LYNETTE_INS_SWITCH:
+                for data in ins.key + ins.case:
+                    names(data, found)
+                for func in ins.func:
+                    for data in func.call_par:
+                        names(data, found)
+            elif type(ins) is data_structure.LYNETTE_INS_PRIMITIVE:
+                for data in ins.primitive_par:
+                    names(data, found)
+
+    def condition_reads(self, condition, found:set):
+        for data in condition.left + condition.right:
+            names(data, found)
+
+    def writes(self, all_ins:list, found:set):
+        """收集指令序列中被赋值的局部名字。"""
+        for ins in all_ins:
+            if type(ins) in (data_structure.LYNETTE_INS_ASSIGN, data_structure.LYNETTE_INS_CUL):
+                for left in ins.left:
+                    if local_name(left) is not None:
+                        found.add(local_name(left))
+            elif type(ins) is data_structure.LYNETTE_INS_CALL:
+                for data in ins.call_par:
+                    names(data, found)
+            elif type(ins) is data_structure.LYNETTE_INS_IF:
+                while True:
+                    for block in ins.condition_block:
+                        self.writes(block.ins, found)
+                    if ins.default == 1:
+                        self.writes(ins.default_bolck.ins, found)
+                    if ins.else_ins_t != 1:
+                        break
+                    ins = ins.else_ins
+
+    def constant(self, condition, folder):
+        """条件是常量时返回True/False，否则返回None。"""
+        if condition.type not in COMPARE:
+            return None
+        left = folder.value(condition.left[0])
+        right = folder.value(condition.right[0])
+        if left is None or right is None:
+            return None
+        return COMPARE[condition.type](left[0], right[0])
+
+    def tables(self, all_ins:list, mapl:dict):
+        """指令序列展开后一定会生成的表：map取值和set/map查询。"""
+        n = 0
+        for ins in all_ins:
+            if type(ins) is data_structure.LYNETTE_INS_ASSIGN:
+                right = fold.operand(ins.right1)
+                if right is not None and right.children[0].data == "array" \
+                        and right.children[0].children[0].children[0].children[0].value in mapl:
+                    n = n + 1
+            elif type(ins) in (data_structure.LYNETTE_INS_IF, data_structure.LYNETTE_INS_ASSERT):
+                while True:
+                    n = n + sum(1 for condition in ins.condition if condition.type == "check")
+                    if type(ins) is data_structure.LYNETTE_INS_ASSERT:
+                        break
+                    for block in ins.condition_block:
+                        n = n + self.tables(block.ins, mapl)
+                    if ins.default == 1:
+                        n = n + self.tables(ins.default_bolck.ins, mapl)
+                    if ins.else_ins_t != 1:
+                        break
+                    ins = ins.else_ins
+            elif type(ins) is data_structure.LYNETTE_INS_CALL and ins.call_name in self.done:
+                module = self.done[ins.call_name]
+                n = n + self.tables(module.ins, module.mapl)
+        return n
+
+    def dead(self, ins, local:set, live:set):
+        """指令是否只写不被读取的局部变量。"""
+        if type(ins) in (data_structure.LYNETTE_INS_ASSIGN, data_structure.LYNETTE_INS_CUL):
+            targets = ins.left
+        elif type(ins) is data_structure.LYNETTE_INS_CALL and self.call_pure(ins):
+            targets = self.call_outputs(ins)
+        else:
+            return False
+        for data in targets:
+            name = local_name(data)
+            if name is None or name not in local or name in live:
+                return False
+        return True
+
+    def sweep(self, all_ins:list, local:set, live:set, folder):
+        """删掉指令序列中的死代码，没有变化时返回原列表。"""
+        result = []
+        changed = False
+        for ins in all_ins:
+            if self.dead(ins, local, live):
+                changed = True
+                continue
+            if type(ins) is data_structure.LYNETTE_INS_ASSERT:
+                value = self.constant(ins.condition[0], folder)
+                if value is True:
+                    changed = True
+                    continue
+                if value is False:
+                    #后面的指令都不会执行
+                    return result
+            if type(ins) is data_structure.LYNETTE_INS_IF:
+                ins_t = self.sweep_if(ins, local, live, folder)
+                if ins_t is not ins:
+                    changed = True
+                    if type(ins_t) is data_structure.LYNETTE_BLOCK:
+                        #条件确定，分支中的指令放到if的位置
+                        result.extend(ins_t.ins)
+                        continue
+                ins = ins_t
+            result.append(ins)
+        return result if changed else all_ins
+
+    def sweep_if(self, ins, local:set, live:set, folder):
+        """处理一个if（含else if链），返回新的if、条件确定时留下的分支（LYNETTE_BLOCK），或原对象。"""
+        value = self.constant(ins.condition[0], folder)
+        if value is True:
+            return self.sweep_block(ins.condition_block[0], local, live, folder)
+        if value is False:
+            if ins.else_ins_t == 1:
+                return self.sweep_if(ins.else_ins, local, live, folder)
+            if ins.default == 1:
+                return self.sweep_block(ins.default_bolck, local, live, folder)
+            return data_structure.LYNETTE_BLOCK()
+
+        blocks = [self.sweep_block(block, local, live, folder) for block in ins.condition_block]
+        else_ins = None
+        default_bolck = None
+        if ins.else_ins_t == 1:
+            else_ins = self.sweep_if(ins.else_ins, local, live, folder)
+            if type(else_ins) is data_structure.LYNETTE_BLOCK:
+                #后面的else if条件确定了，剩下的分支作为else
+                default_bolck = else_ins
+                else_ins = None
+        elif ins.default == 1:
+            default_bolck = self.sweep_block(ins.default_bolck, local, live, folder)
+        if default_bolck is not None and len(default_bolck.ins) == 0:
+            default_bolck = None
+        if all(len(block.ins) == 0 for block in blocks) and else_ins is None and default_bolck is None:
+            #所有分支都是空的，整个if都不需要了
+            return data_structure.LYNETTE_BLOCK()
+        if all(a is b for a, b in zip(blocks, ins.condition_block)) \
+                and else_ins is (ins.else_ins if ins.else_ins_t == 1 else None) \
+                and default_bolck is (ins.default_bolck if ins.default == 1 else None):
+            return ins
+        ins_t = copy.copy(ins)
+        ins_t.condition_block = blocks
+        ins_t.else_ins_t = 0 if else_ins is None else 1
+        if else_ins is not None:
+            ins_t.else_ins = else_ins
+        ins_t.default = 0 if default_bolck is None else 1
+        if default_bolck is not None:
+            ins_t.default_bolck = default_bolck
+        return ins_t
+
+    def sweep_block(self, block, local:set, live:set, folder):
+        all_ins = self.sweep(block.ins, local, live, folder)
+        if all_ins is block.ins:
+            return block
+        block_t = data_structure.LYNETTE_BLOCK()
+        block_t.ins = all_ins
+        return block_t
+
+    def component(self, component):
+        """消除一个application或module中的死代码，没有变化时返回原对象。"""
+        is_module = isinstance(component, data_structure.LYNETTE_MODULE)
+        local = set(component.var) - set(component.call_par) if is_module else set(component.var)
+        folder = fold.Folder(self.consts, fold.scope_names(component))
+        all_ins = component.ins
+        func = dict(component.func) if is_module else {}
+        while True:
+            live = set()
+            self.reads(all_ins, live)
+            for name in func:
+                self.reads(func[name].ins, live)
+            for data in component.tuple.values():
+                for tree in data:
+                    names(tree, live)
+            all_ins_t = self.sweep(all_ins, local, live, folder)
+            func_t = {name: self.sweep_block(func[name], local, live, folder) for name in func}
+            if all_ins_t is all_ins and all(func_t[name] is func[name] for name in func):
+                break
+            all_ins = all_ins_t
+            func = func_t
+
+        blocks = [component.ins] + [component.func[name].ins for name in func]
+        blocks_t = [all_ins] + [func[name].ins for name in func]
+        self.report.ins = self.report.ins + sum(count_ins(b) for b in blocks) - sum(count_ins(b) for b in blocks_t)
+        self.report.tables = self.report.tables + sum(self.tables(b, component.mapl) for b in blocks) \
+                             - sum(self.tables(b, component.mapl) for b in blocks_t)
+
+        #不再被引用的局部变量
+        used = set(live)
+        self.writes(all_ins, used)
+        for name in func:
+            self.writes(func[name].ins, used)
+        var = {name: component.var[name] for name in component.var if name in used or name not in local}
+        self.report.vars = self.report.vars + len(component.var) - len(var)
+
+        if all_ins is component.ins and len(var) == len(component.var) \
+                and all(func[name] is component.func[name] for name in func):
+            return component
+        component_t = copy.copy(component)
+        component_t.ins = all_ins
+        component_t.var = var
+        if is_module:
+            component_t.func = func
+            component_t.source = None
+        return component_t
+
+
+def execute(applications:dict, modules:dict, path, define_table=None):
+    """死代码消除，在常量折叠之后、generate之前执行。
+
+    Args:
+        applications (dict): {应用名: LYNETTE_APP}
+        modules (dict): {模块名: LYNETTE_MODULE}，可以是用户之间共享的对象，这里不会修改
+        path (str): 工程输入路径，写日志。
+        define_table (DefineTable, 可选): define.pne的解析结果，没有时从path读取
+
+    Returns:
+        tuple: (applications, modules)，新的字典，没有变化的组件仍是原来的对象。
+    """
+    print('dce...')
+    with open(path + "//log_out//log.txt","a") as file:
+        file.write('dce...\n')
+    if define_table is None:
+        define_table = defines.load(path)
+    eliminator = Eliminator(modules, define_table.values)
+    modules_t = {}
+    for name in modules:
+        modules_t[name] = eliminator.module(name)
+    applications_t = {}
+    for name in applications:
+        applications_t[name] = eliminator.component(applications[name])
+
+    report = eliminator.report
+    message = 'dce: ' + str(report.ins) + ' instructions, ' + str(report.tables) + ' tables, ' \
+              + str(report.vars) + ' variables removed'
+    print(message)
+    with open(path + "//log_out//log.txt","a") as file:
+        file.write(message + '\n')
+    return applications_t, modules_t
@@ -0,0 +1,221 @@
+"""dedup.py - 同一节点上相同表的合并
+
+功能说明：
+    不同服务调起同一个module时，generate按前缀为每个服务各生成一份table和action（prefix_map名），
+    放到同一个节点上就会重复占用节点的表数量（path.json中的tables）。这里在aggregate中按节点合并：
+    1. 结构相同的表：key、default_action等表体一样，对应的action体也一样（表名和action名不算在内）；
+    2. 合并后只保留第一张表和它的action，其余的表在control中改为调用第一张表；
+    3. 各表的表项完全相同时只保留一份；不同时给合并后的表加一个服务区分key（<表名>_service），
+       每个调用点先给它赋上自己的编号，各自的表项也带上这个编号。
+    表项可能有几百万条，不放进内存：比较时用与顺序无关的指纹（fingerprint），
+    改名和加服务编号包装在逐条读取表项的函数外面，输出时逐条执行。
+
+    比较在节点的最终文本上进行（Next已经换成了实际端口），所以不同服务的下一跳不同时不会合并。
+    合并后同一张表会在多个位置apply，只有允许一张表多次apply的target才能使用，
+    因此默认不开启，--share-tables 时才在aggregate中执行。
+"""
+
+import hashlib
+import json
+import re
+
+TABLE = re.compile(r"^table\s+(\w+)\s*\{", re.M)
+ACTION = re.compile(r"^action\s+(\w+)\s*\(", re.M)
+ACTIONS = re.compile(r"actions\s*=\s*\{([^}]*)\}")
+KEY = re.compile(r"key\s*=\s*\{\n")
+
+#服务区分key的位宽，一组中最多合并这么多张表
+SERVICE_BITS = 8
+
+
+def blocks(text:str, pattern):
+    """把片段文本切成顶层的块，返回 {名字: 块文本}，块从匹配处到第一个顶格的 } 为止。"""
+    found = {}
+    for match in pattern.finditer(text):
+        end = text.find("\n}", match.start())
+        end = len(text) if end == -1 else end + 2
+        if end < len(text) and text[end] == "\n":
+            end = end + 1
+        found[match.group(1)] = text[match.start():end]
+    return found
+
+
+def rename(text:str, names:dict):
+    """按整词替换名字。"""
+    if not names:
+        return text
+    pattern = re.compile(r"\b(" + "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True)) + r")\b")
+    return pattern.sub(lambda m: names[m.group(1)], text)
+
+
+class Table():
+    """片段中的一张表。
+
+    Attributes:
+        name (str): 表名
+        frag (str): 所在片段
+        actions (list): 表用到的action名，按actions块中的顺序
+        signature (str): 表和action去掉名字之后的文本，相同即结构相同
+    """
+
+    def __init__(self, name:str, frag:str, block:str, action_blocks:dict):
+        self.name = name
+        self.frag = frag
+        match = ACTIONS.search(block)
+        self.actions = [a.strip() for a in match.group(1).split(";") if a.strip()] if match else []
+        names = {name: "@T"}
+        for i in range(len(self.actions)):
+            names[self.actions[i]] = "@" + str(i)
+        parts = [rename(block, names)]
+        for action in self.actions:
+            parts.append(rename(action_blocks.get(action, action), names))
+        self.signature = "".join(parts)
+
+
+def tables(frag:str, action_text:str, table_text:str):
+    """片段中的所有表。"""
+    action_blocks = blocks(action_text, ACTION)
+    return [Table(name, frag, block, action_blocks) for name, block in blocks(table_text, TABLE).items()]
+
+
+class Budget():
+    """placement时按节点记录已经放下的表，结构相同的表只占一份表数量。
+    和share一样，一组最多合并 1 << SERVICE_BITS 张表，超出的表各自占用表数量。
+
+    Attributes:
+        load (function): (片段, 节点) -> 片段在这个节点上的表（Table列表）
+        seen (dict): {节点: {已经放下的表的signature: 放下的张数}}
+    """
+
+    def __init__(self, load):
+        self.load = load
+        self.seen = {}
+
+    def cost(self, node:str, frag:str, table_num:int):
+        """片段放到节点上要占用的表数量。"""
+        seen = self.seen.get(node, {})
+        return table_num - sum(1 for table in self.load(frag, node) if 0 < seen.get(table.signature, 0) < 1 << SERVICE_BITS)
+
+    def take(self, node:str, frag:str):
+        seen = self.seen.setdefault(node, {})
+        for table in self.load(frag, node):
+            seen[table.signature] = seen.get(table.signature, 0) + 1
+
+
+def fingerprints(frag_tables:dict, entries:dict):
+    """各表的表项去掉表名、action名后的多重集合的指纹，用于比较两张表的表项是否相同。
+
+    指纹是 (表项条数, 各条表项sha256之和)，与表项顺序无关，每个片段的表项只逐条读一遍。
+
+    Args:
+        frag_tables (dict): {片段: [Table]}，要计算指纹的表
+        entries (dict): {片段: 逐条读取表项的函数}
+
+    Returns:
+        dict: {(片段, 表名): 指纹}
+    """
+    found = {}
+    for frag, frag_table_list in frag_tables.items():
+        action_index = {}
+        for table in frag_table_list:
+            action_index[table.name] = {a: i for i, a in enumerate(table.actions)}
+            found[(frag, table.name)] = (0, 0)
+        for e in entries[frag]():
+            if e["table"] not in action_index:
+                continue
+            row = json.dumps([e["match"], e["action_params"], action_index[e["table"]].get(e["action_name"])], sort_keys=True)
+            count, total = found[(frag, e["table"])]
+            found[(frag, e["table"])] = (count + 1, (total + int.from_bytes(hashlib.sha256(row.encode("utf-8")).digest(), "big")) % (1 << 256))
+    return found
+
+
+def share(frags:list, texts:dict, entries:dict):
+    """合并一个节点上结构相同的表，直接修改texts和entries。
+
+    Args:
+        frags (list): 节点上的片段，按输出顺序
+        texts (dict): {片段: {"tem"/"action"/"table"/"control": 文本}}，action和control中的Next已经替换
+        entries (dict): {片段: 逐条读取表项的函数}，合并时换成改名之后的函数
+
+    Returns:
+        int: 合并掉的表数
+    """
+    groups = {}
+    for frag in frags:
+        for table in tables(frag, texts[frag]["action"], texts[frag]["table"]):
+            groups.setdefault(table.signature, []).append(table)
+
+    #同一张表出现两次（同一个片段放了两次）不处理
+    groups = [group[:1 << SERVICE_BITS] for group in groups.values()
+              if len(group) >= 2 and len(set(t.name for t in group)) == len(group)]
+    frag_tables = {}
+    for group in groups:
+        for table in group:
+            frag_tables.setdefault(table.frag, []).append(table)
+    found = fingerprints(frag_tables, entries)
+
+    merged = 0
+    for group in groups:
+        merged = merged + merge(group, texts, entries, found)
+    return merged
+
+
+def rewrite(rows, table:Table, first:Table, index:int, same:bool, service:str):
+    """合并后一个片段的表项：table的表项改到第一张表上，表项相同时只保留第一张表的，不同时带上服务编号。
+
+    Args:
+        rows (function): 合并前逐条读取片段表项的函数
+        index (int): table在组中的编号
+
+    Returns:
+        function: 合并后逐条读取片段表项的函数
+    """
+    def entries():
+        for e in rows():
+            if e["table"] != table.name:
+                yield e
+            elif index == 0 or not same:
+                e["table"] = first.name
+                if e["action_name"] in table.actions:
+                    e["action_name"] = first.actions[table.actions.index(e["action_name"])]
+                if not same:
+                    e["match"] = dict([(service, [str(index)])] + list(e["match"].items()))
+                yield e
+    return entries
+
+
+def merge(group:list, texts:dict, entries:dict, found:dict):
+    """把group中的表合并到第一张表上，返回合并掉的表数，found为各表表项的指纹（见fingerprints）。"""
+    first = group[0]
+    same = all(found[(table.frag, table.name)] == found[(first.frag, first.name)] for table in group)
+    service = first.name + "_service"
+
+    if not same:
+        table_text = texts[first.frag]["table"]
+        block = blocks(table_text, TABLE)[first.name]
+        if KEY.search(block) is None:
+            return 0
+        block_t = KEY.sub(lambda m: m.group(0) + "        " + service + " : exact;\n", block, count=1)
+        texts[first.frag]["table"] = table_text.replace(block, block_t)
+        texts[first.frag]["tem"] = texts[first.frag]["tem"] + "bit<" + str(SERVICE_BITS) + "> " + service + ";\n"
+
+    for i in range(len(group)):
+        table = group[i]
+        apply = first.name + ".apply();"
+        if not same:
+            apply = service + " = " + str(i) + "; " + apply
+        texts[table.frag]["control"] = re.sub(r"\b" + re.escape(table.name) + r"\.apply\(\);",
+                                              lambda m: apply, texts[table.frag]["control"])
+        if i == 0:
+            continue
+        #去掉重复的表和action
+        texts[table.frag]["table"] = texts[table.frag]["table"].replace(blocks(texts[table.frag]["table"], TABLE)[table.name], "")
+        action_blocks = blocks(texts[table.frag]["action"], ACTION)
+        for action in table.actions:
+            if action in action_blocks:
+                texts[table.frag]["action"] = texts[table.frag]["action"].replace(action_blocks[action], "")
+
+    #表项改到第一张表上，不同时带上服务编号
+    for i in range(len(group)):
+        entries[group[i].frag] = rewrite(entries[group[i].frag], group[i], first, i, same, service)
+    return len(group) - 1
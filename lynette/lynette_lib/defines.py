@@ -0,0 +1,102 @@
+"""defines.py - define.pne 中的类型和常量
+
+功能说明：
+    include/define.pne 中的 type/const 定义原来在一次编译中被解析多次：generate 和 aggregate 各有一个
+    construct_type_dict_global，结果放在 Generator 的实例变量和 aggregate 的模块全局变量中，
+    常量折叠和死代码消除又各读一遍常量。这里解析一次得到不可修改的 DefineTable：
+    1. 按文件内容哈希在进程内缓存，文件没变时不再解析；
+    2. runner 在编译开始时 load，传给 fold、dce、generate 和 aggregate；
+    3. 不再有模块级的可变状态，同一个进程中可以同时进行多个编译。
+"""
+
+import os
+import types
+
+from lynette.lynette_lib import cache
+from lynette.lynette_lib.grammar import registry
+
+#进程内缓存 {define.pne内容哈希: DefineTable}
+_tables = cache.Memo()
+
+
+class DefineTable():
+    """define.pne 的解析结果，建立后不能修改。
+
+    Attributes:
+        digest (str): define.pne 的内容哈希
+        types (Mapping): {类型名: 类型}，有定义时另加 bool -> bit<1>
+        consts (Mapping): {常量名: 常量值的文本}，aggregate 代入 parser 中的常量
+        values (Mapping): {常量名: (数值, 位宽)}，常量折叠和死代码消除用
+    """
+    __slots__ = ("digest", "types", "consts", "values")
+
+    def __init__(self, digest:str, types_t:dict, consts:dict, values:dict):
+        object.__setattr__(self, "digest", digest)
+        object.__setattr__(self, "types", types.MappingProxyType(dict(types_t)))
+        object.__setattr__(self, "consts", types.MappingProxyType(dict(consts)))
+        object.__setattr__(self, "values", types.MappingProxyType(dict(values)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DefineTable is immutable")
+
+    def __reduce__(self):
+        #MappingProxyType 不能pickle，进程池传递时按普通dict重建
+        return (DefineTable, (self.digest, dict(self.types), dict(self.consts), dict(self.values)))
+
+
+def load(input_path:str):
+    """读取 input_path/include/define.pne，同样的内容只解析一次。
+
+    Args:
+        input_path (str): 工程输入路径。
+
+    Returns:
+        DefineTable: 没有define.pne时为空表。
+    """
+    file_name = input_path + "//include//define.pne"
+    code = ""
+    if os.path.isfile(file_name):
+        with open(file_name, "r") as file:
+            code = file.read()
+    digest = cache.digest(code)
+    if digest not in _tables:
+        _tables[digest] = parse(code, digest)
+    return _tables[digest]
+
+
+def parse(code:str, digest:str):
+    """解析define.pne的内容。"""
+    types_t = {}
+    consts = {}
+    values = {}
+    if code.strip() == "":
+        return DefineTable(digest, types_t, consts, values)
+    tree = registry.get_parser("grammar_define").parse(code)
+    for define_t in tree.children:
+        if define_t.data == "type_define":
+            types_t[define_t.children[1].value] = define_t.children[0].value
+        elif define_t.data == "const_define":
+            name = define_t.children[1].children[0].children[0].value
+            value = define_t.children[2].children[0]
+            consts[name] = value.children[0].value
+            width = int(define_t.children[0].value[4:-1])
+            if value.data == "int":
+                values[name] = (int(value.children[0].value) % (1 << width), width)
+            elif value.data == "ox_num":
+                number = _hex(value.children[0].value)
+                if number is not None:
+                    values[name] = (number % (1 << width), width)
+            elif value.children[0].value in values:
+                values[name] = (values[value.children[0].value][0] % (1 << width), width)
+        else:
+            print("error-defines what define", define_t.data)
+            exit()
+        types_t['bool'] = 'bit<1>'
+    return DefineTable(digest, types_t, consts, values)
+
+
+def _hex(text:str):
+    try:
+        return int(text, 16)
+    except ValueError:
+        return None
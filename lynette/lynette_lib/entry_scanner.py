@@ -0,0 +1,289 @@
+"""entry_scanner.py - map/set表项的批量扫描
+
+功能说明：
+    转发表的表项动辄上万条，如果每个值都走通用语法（single_entry -> data -> int/name...），
+    解析会占据大部分编译时间。语法中把 entry 整块作为一个 ENTRY_BLOCK 终结符捕获，
+    这里再一次性扫描整块文本：
+    1. 用一个正则取出所有 (...) 行；
+    2. 所有行拼接后按逗号切分成一维列表，再按列切片得到每一列；
+    3. 每一列整体做合法性检查和取值。
+    结果是列式的 LYNETTE_ENTRY，Generator 直接按列读取。
+
+列的存储：
+    每一列先整体用正则判断能不能按定长整数存储（见 _column）：
+    - 全是十进制整数（无前导0，不超过64位）: array('Q')；
+    - 全是IPv4: array('I')；
+    - 全是IPv6（每组1-4位，无前导0）: 高64位、低64位两个 array('Q')；
+    - 其它: 字符串列表，逐个检查取值。
+    数值只在这里解析一次，生成时按块转回文本，和源码中的写法完全一致。
+
+取值规则与原来 collect 中 entry_data.children[0].children[0].value 保持一致：
+    - INT、OX_NUM、IP、IPS、SYS_DATA、NAME 取原文；
+    - name_field（a.b 或 a.b.c）只取第一个NAME。
+
+外部表项文件：
+    service.json 中可以用 entry_files 把 map/set 绑定到外部文件，这类表项用
+    LYNETTE_ENTRY_FILE 表示，生成时由 iter_rows 逐行读取、校验后直接写出，
+    任何时候内存中只有一行。按扩展名区分格式：
+    - .csv   : 每行一条表项，逗号分隔；空行和 # 开头的行跳过；取值规则同上；
+    - .jsonl : 每行一个json数组，元素为字符串或整数；
+    - .bin   : 头部为 b"LYNE"、1字节版本号(1)、1字节列数N、N字节每列的字节宽度，
+               之后是定长记录，每列为大端无符号整数，输出为十进制字符串。
+"""
+
+import csv
+import json
+import os
+import re
+from array import array
+
+from lynette.lynette_lib import data_structure
+
+#一行表项：( ... );
+_ROW = re.compile(r"\(([^(){};]*)\)\s*;")
+#整块去掉所有行之后只能剩下 { } 和空白
+_REST = re.compile(r"\A\{\s*\}\Z")
+
+_NAME = r"[A-Za-z](?:_?[A-Za-z0-9])*"
+_INT = r"[0-9]+"
+#和语法中data能直接取出token的写法一一对应
+_VALUE = re.compile(
+    r"\A(?:"
+    r"(?P<ip>" + _INT + r"\." + _INT + r"\." + _INT + r"\." + _INT + r")"
+    r"|(?P<ips>" + _INT + r"(?::" + _INT + r"){7})"
+    r"|(?P<ox>0x[0-9A-Z]+)"
+    r"|(?P<int>" + _INT + r")"
+    r"|(?P<sys>_[A-Za-z0-9]*)"
+    r"|(?P<field>" + _NAME + r")\s*\.\s*" + _NAME + r"(?:\s*\.\s*" + _NAME + r")?"
+    r"|(?P<name>" + _NAME + r")"
+    r")\Z")
+
+
+def _value(text:str, where=""):
+    match = _VALUE.match(text)
+    if match is None:
+        print("error-entry_scanner what entry value", text, where)
+        exit()
+    if match.group("field") is not None:
+        return match.group("field")
+    return text
+
+
+#整列都是某种定长值时，用逗号拼起来整体匹配一次
+_DEC = r"(?:[1-9][0-9]{0,18}|0)"
+_OCTET = r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+_IP4 = _OCTET + r"\." + _OCTET + r"\." + _OCTET + r"\." + _OCTET
+_GROUP = r"(?:[1-9][0-9]{0,3}|0)"
+_IP6 = _GROUP + r"(?::" + _GROUP + r"){7}"
+_INT_COLUMN = re.compile(r"\A" + _DEC + r"(?:," + _DEC + r")*\Z")
+_IP4_COLUMN = re.compile(r"\A" + _IP4 + r"(?:," + _IP4 + r")*\Z")
+_IP6_COLUMN = re.compile(r"\A" + _IP6 + r"(?:," + _IP6 + r")*\Z")
+#生成时每次转换成文本的行数
+CHUNK = 4096
+
+
+def _column(values:list):
+    """把一列文本转成 LYNETTE_COLUMN，能定长存储的整列解析一次。"""
+    joined = ",".join(values)
+    if _INT_COLUMN.match(joined):
+        return data_structure.LYNETTE_COLUMN("int", array("Q", map(int, values)))
+    if _IP4_COLUMN.match(joined):
+        n = list(map(int, joined.replace(",", ".").split(".")))
+        return data_structure.LYNETTE_COLUMN("ip", array("I", [
+            (a << 24) | (b << 16) | (c << 8) | d for a, b, c, d in zip(n[0::4], n[1::4], n[2::4], n[3::4])]))
+    if _IP6_COLUMN.match(joined):
+        n = [int(g, 16) for g in joined.replace(",", ":").split(":")]
+        high = [(a << 48) | (b << 32) | (c << 16) | d for a, b, c, d in zip(n[0::8], n[1::8], n[2::8], n[3::8])]
+        low = [(a << 48) | (b << 32) | (c << 16) | d for a, b, c, d in zip(n[4::8], n[5::8], n[6::8], n[7::8])]
+        return data_structure.LYNETTE_COLUMN("ips", array("Q", high), array("Q", low))
+    return data_structure.LYNETTE_COLUMN("str", [_value(v) for v in values])
+
+
+def scan(raw:str):
+    """扫描一个entry块，返回列式表项。
+
+    Args:
+        raw (str): ENTRY_BLOCK的原文，形如 { (1, 2); (3, 4); }。
+
+    Returns:
+        LYNETTE_ENTRY: 列式表项，columns[i] 是第i列的 LYNETTE_COLUMN。
+    """
+    rows = _ROW.findall(raw)
+    if not _REST.match(_ROW.sub("", raw)):
+        print("error-entry_scanner what entry block", raw)
+        exit()
+    entry = data_structure.LYNETTE_ENTRY()
+    if len(rows) == 0:
+        return entry
+    #(),空行没有值，宽度为0
+    flat = [v.strip() for v in ",".join(rows).split(",")] if rows[0].strip() != "" else []
+    width = len(flat) // len(rows)
+    if width * len(rows) != len(flat) or any((r.count(",") + 1 if r.strip() else 0) != width for r in rows):
+        print("error-entry_scanner entry width not same", raw)
+        exit()
+    entry.rows = len(rows)
+    entry.columns = [_column(flat[i::width]) for i in range(width)]
+    return entry
+
+
+#外部表项文件的格式，按扩展名区分
+ENTRY_FILE_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".bin": "bin"}
+_BIN_MAGIC = b"LYNE"
+_BIN_VERSION = 1
+#二进制文件每次读取的记录数
+_BIN_CHUNK = 4096
+
+
+def open_entry_file(path:str):
+    """绑定一个外部表项文件，此时只检查文件存在和格式，不读取内容。
+
+    Args:
+        path (str): 表项文件路径，扩展名为 .csv/.jsonl/.bin。
+
+    Returns:
+        LYNETTE_ENTRY_FILE: 外部表项。
+    """
+    file_format = ENTRY_FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        print("error-entry_scanner what entry file format", path)
+        exit()
+    if not os.path.isfile(path):
+        print("error-entry_scanner entry file not found", path)
+        exit()
+    return data_structure.LYNETTE_ENTRY_FILE(path, file_format)
+
+
+def iter_chunks(entry, size=CHUNK):
+    """按块产出表项，每块是最多size行的列表，每行是值（字符串）的序列。
+
+    LYNETTE_ENTRY 每次把各列的一段整体转成文本再按行拼起来，内存中只有一块的文本；
+    LYNETTE_ENTRY_FILE 逐行读取后攒成块。
+    """
+    if isinstance(entry, data_structure.LYNETTE_ENTRY):
+        for start in range(0, entry.rows, size):
+            stop = min(start + size, entry.rows)
+            if entry.columns:
+                yield list(zip(*[column.texts(start, stop) for column in entry.columns]))
+            else:
+                yield [()] * (stop - start)
+        return
+    chunk = []
+    for row in iter_rows(entry):
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_rows(entry):
+    """逐行产出表项，每行是值（字符串）的序列。
+
+    LYNETTE_ENTRY 按块把列转成行；LYNETTE_ENTRY_FILE 流式读取文件，
+    每一行都做合法性检查，并要求所有行的列数相同。
+    """
+    if isinstance(entry, data_structure.LYNETTE_ENTRY):
+        return (row for chunk in iter_chunks(entry) for row in chunk)
+    if entry.format == "csv":
+        rows = _iter_csv(entry.path)
+    elif entry.format == "jsonl":
+        rows = _iter_jsonl(entry.path)
+    else:
+        rows = _iter_bin(entry.path)
+    return _check_width(rows, entry.path)
+
+
+def has_rows(entry):
+    """是否至少有一条表项，外部文件只读到第一条为止。"""
+    for _ in iter_rows(entry):
+        return True
+    return False
+
+
+def width(entry):
+    """表项的列数，外部文件只读第一条；没有表项时返回0。"""
+    if isinstance(entry, data_structure.LYNETTE_ENTRY):
+        return len(entry.columns)
+    for row in iter_rows(entry):
+        return len(row)
+    return 0
+
+
+def _check_width(rows, path):
+    first = None
+    for line_no, row in rows:
+        if first is None:
+            first = len(row)
+        elif len(row) != first:
+            print("error-entry_scanner entry width not same", path, "line", line_no)
+            exit()
+        yield row
+
+
+def _iter_csv(path):
+    with open(path, "r", newline="") as file:
+        reader = csv.reader(file)
+        for row in reader:
+            if len(row) == 0 or row[0].lstrip().startswith("#"):
+                continue
+            where = path + ":" + str(reader.line_num)
+            yield where, [_value(v.strip(), where) for v in row]
+
+
+def _iter_jsonl(path):
+    with open(path, "r") as file:
+        line_no = 0
+        for line in file:
+            line_no = line_no + 1
+            if line.strip() == "":
+                continue
+            where = path + ":" + str(line_no)
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, list):
+                print("error-entry_scanner entry line is not a json array", where)
+                exit()
+            values = []
+            for v in row:
+                if isinstance(v, bool) or not isinstance(v, (int, str)):
+                    print("error-entry_scanner what entry value", v, where)
+                    exit()
+                if isinstance(v, int):
+                    if v < 0:
+                        print("error-entry_scanner what entry value", v, where)
+                        exit()
+                    values.append(str(v))
+                else:
+                    values.append(_value(v.strip(), where))
+            yield where, values
+
+
+def _iter_bin(path):
+    with open(path, "rb") as file:
+        header = file.read(6)
+        if len(header) != 6 or header[:4] != _BIN_MAGIC or header[4] != _BIN_VERSION:
+            print("error-entry_scanner what binary entry file", path)
+            exit()
+        widths = list(file.read(header[5]))
+        if header[5] == 0 or len(widths) != header[5] or 0 in widths:
+            print("error-entry_scanner what binary entry file", path)
+            exit()
+        offsets = []
+        record_size = 0
+        for w in widths:
+            offsets.append((record_size, record_size + w))
+            record_size = record_size + w
+        record_no = 0
+        while True:
+            chunk = file.read(record_size * _BIN_CHUNK)
+            if not chunk:
+                break
+            if len(chunk) % record_size != 0:
+                print("error-entry_scanner binary entry file truncated", path)
+                exit()
+            for base in range(0, len(chunk), record_size):
+                record_no = record_no + 1
+                yield record_no, [str(int.from_bytes(chunk[base + a:base + b], "big")) for a, b in offsets]
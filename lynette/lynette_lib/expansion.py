@@ -0,0 +1,168 @@
+"""expansion.py - module展开的记忆
+
+功能说明：
+    不同的app（服务）调起同一个module时，generate_module每次都要把module的指令序列完整展开一遍，
+    但生成的内容只有前缀和绑定的变量名不同。这里把一次展开记成事件序列：
+    - ("write", 片段文件名, 文本)         写片段（FragmentStore），打开片段时记一条空文本
+    - ("span", 片段文件名, 起点, 长度)     写表项片段，文本在表项片段的文件中，只记位置
+    - ("name", "table"/"action", 名字, 去重后的名字)  占用的表名/action名
+    - ("var", 前缀, 是否新的命名域)        generate_var
+    - ("wrote"/"add"/"get"/"push"/"pop"/"clear", ...)  可复用结果的操作（cse.Available）
+    以及片段关系（input/output/varfile/table_num/module）的增量。
+    同一个module、同样的缩进、同样形式的参数绑定再次展开时，按 旧前缀->新前缀、旧绑定变量->新绑定变量
+    改名后重放，不再逐条指令生成。
+
+    能不能记、能不能重放：
+    - 展开中的表名/action名、命名域在展开开始时都必须没出现过（展开之内重复出现加的 _1 之类的后缀可以重放），
+      重放时改名后的名字也必须没出现过；
+    - 展开中复用了展开之外的结果（见cse.py）时不记；
+    - 重放前先检查展开中每次查找可复用结果时，改名后的查找在当前位置都找不到展开之外的结果，
+      否则实际展开会做出不同的复用，重新展开。
+"""
+
+import re
+
+from lynette.lynette_lib import symbols
+
+def signature(module, level:int, bindings:list):
+    """展开的key和绑定的变量名。
+
+    Args:
+        module (LYNETTE_MODULE): 被调起的module
+        level (int): 缩进等级
+        bindings (list): 实参的 (名字, 类型)
+
+    Returns:
+        tuple: (key, 变量名列表)，变量类型的实参只按第几个不同的变量出现在key中，名字在改名时替换
+    """
+    names = []
+    shape = []
+    for name, data_type in bindings:
+        if data_type == "var":
+            if name not in names:
+                names.append(name)
+            shape.append(("var", names.index(name)))
+        else:
+            shape.append((data_type, name))
+    return (id(module), level, tuple(shape)), names
+
+
+def compact(events:list):
+    """把写片段的事件按片段合并。
+
+    片段只追加写，generate中也不读片段，写不同片段的先后和其他事件的先后都不影响结果，
+    合并后重放时每个片段整段改名、整段写入；表项片段相邻的位置合并成一段，重放时逐行复制。
+
+    Returns:
+        tuple: ({片段文件名: 文本}，按第一次写入的顺序, {表项片段文件名: [(起点, 长度)]}, 其他事件)
+    """
+    writes = {}
+    spans = {}
+    others = []
+    for event in events:
+        if event[0] == "write":
+            writes.setdefault(event[1], []).append(event[2])
+        elif event[0] == "span":
+            ranges = spans.setdefault(event[1], [])
+            if ranges and ranges[-1][0] + ranges[-1][1] == event[2]:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + event[3])
+            elif event[3] > 0 or not ranges:
+                ranges.append((event[2], event[3]))
+        else:
+            others.append(event)
+    return {name: "".join(texts) for name, texts in writes.items()}, spans, others
+
+
+class Expansion():
+    """一次记下来的module展开。
+
+    Attributes:
+        prefix (str): 展开时module的前缀
+        frag (str): 展开时写的片段
+        names (list): 展开时绑定的变量名
+        writes (dict): 写的片段，{片段文件名: 文本}
+        spans (dict): 写的表项片段，{片段文件名: [(起点, 长度)]}
+        events (list): 写片段之外的事件序列
+        input (list): 片段input的增量（符号ID）
+        output (list): 片段output的增量（符号ID）
+        varfile (list): 片段varfile的增量
+        table_num (int): 片段table_num的增量
+        modules (list): 片段module的增量
+        counts (dict): 展开中各类复用的次数
+    """
+
+    def __init__(self, prefix:str, frag:str, names:list, events:list):
+        self.prefix = prefix
+        self.frag = frag
+        self.names = names
+        self.writes, self.spans, self.events = compact(events)
+        self.input = []
+        self.output = []
+        self.varfile = []
+        self.table_num = 0
+        self.modules = []
+        self.counts = {}
+
+    def cacheable(self):
+        """名字在展开开始时都没出现过，并且没有复用展开之外的结果。"""
+        seen = set()
+        added = set()
+        cleared = False
+        for event in self.events:
+            if event[0] == "name":
+                if event[2] != event[3] and (event[1], event[2]) not in seen:
+                    return False
+                seen.add((event[1], event[2]))
+            elif event[0] == "var":
+                if not event[2] and ("var", event[1]) not in seen:
+                    return False
+                seen.add(("var", event[1]))
+            elif event[0] == "add":
+                added.add(event[1])
+            elif event[0] == "clear":
+                cleared = True
+            elif event[0] == "get" and event[2] and not cleared and event[1] not in added:
+                return False
+        return True
+
+
+class Renamer():
+    """重放时的改名：绑定的变量名按表替换，以旧前缀开头的名字换成新前缀，写的片段换成新片段。"""
+
+    def __init__(self, expansion:Expansion, prefix:str, names:list, frag:str):
+        self.old_prefix = expansion.prefix
+        self.prefix = prefix
+        self.old_frag = expansion.frag
+        self.frag = frag
+        self.names = dict(zip(expansion.names, names))
+        alternatives = [re.escape(n) for n in sorted(self.names, key=len, reverse=True)]
+        alternatives.append(re.escape(self.old_prefix) + r"(?:_[A-Za-z0-9_]*)?")
+        self.pattern = re.compile(r"(?<![A-Za-z0-9_])(?:" + "|".join(alternatives) + r")(?![A-Za-z0-9_])")
+
+    def _sub(self, match):
+        name = match.group(0)
+        if name in self.names:
+            return self.names[name]
+        return self.prefix + name[len(self.old_prefix):]
+
+    def text(self, text:str):
+        if self.prefix == self.old_prefix and not self.names:
+            return text
+        return self.pattern.sub(self._sub, text)
+
+    def stream(self, name:str):
+        """片段文件名，展开所在片段的文件换成新片段的。"""
+        if name.startswith(self.old_frag + "_"):
+            return self.frag + name[len(self.old_frag):]
+        return self.text(name)
+
+    def key(self, key:tuple):
+        """可复用结果的key，其中的字符串都是名字，整数是map/set的id。"""
+        return tuple(self.text(k) if isinstance(k, str) else self.key(k) if isinstance(k, tuple) else k
+                     for k in key)
+
+    def datas(self, datas:list):
+        return [(self.text(name), data_type) for name, data_type in datas]
+
+    def symbol(self, sid:int):
+        return symbols.intern(self.text(symbols.text(sid)))
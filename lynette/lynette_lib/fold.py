@@ -0,0 +1,359 @@
+"""fold.py - 常量折叠
+
+功能说明：
+    collect 之后、generate 之前的一遍IR变换：
+    1. 把 include/define.pne 中 const 定义的常量替换成数值；
+    2. 赋值语句右边的表达式（expression/term/factor/bitwise_expr）中，操作数全是常量的部分直接算出结果，
+       整个右边都是常量时右边只剩一个整数；
+    3. 两个操作数都是常量的 ins_cul（a = b op c）改写成普通赋值。
+    折叠后生成的P4 action中不再有这些运算，数据平面少了对应的ALU操作。
+
+数值语义（和P4一致）：
+    - 整数字面量（十进制、0x十六进制）是无限精度的int；
+    - define.pne 中的常量带位宽 bit<W>，参与运算的结果按 2^W 取模；
+    - 位宽不同的两个常量运算、除数不是正数、负数参与除法/取模/位运算、对没有位宽的数取反（~）、
+      逻辑非（!）、移位超过 MAX_SHIFT 位都不折叠，原样交给P4编译器处理；
+    - 结果为负数的部分也不折叠（整数字面量不能是负数）。
+    - 局部变量、模块参数以及tuple/map/set/reg的名字会遮住同名的常量；map/寄存器的下标不折叠。
+
+共享的IR：
+    模块IR在用户之间共享（见 collect.collect_shared_module），这里不修改原对象：
+    没有可折叠指令的组件原样返回；有的复制一份再替换指令，改动路径以外的部分仍然共享。
+    模块的折叠结果按（模块源码片段哈希，define.pne哈希）在进程内记忆，多个用户拿到的仍是同一个对象。
+"""
+
+import copy
+
+from lark import Tree, Token
+
+from lynette.lynette_lib import cache
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import defines
+
+#移位位数的上限，超过时不折叠，避免算出巨大的整数
+MAX_SHIFT = 1024
+
+#bitwise_expr 中运算符的优先级（和P4相同），数值越大越先算
+BITWISE_PRIORITY = {"<<": 4, ">>": 4, "&": 3, "^": 2, "|": 1}
+
+#进程内记忆的模块折叠结果 {(模块源码片段哈希, define.pne哈希): LYNETTE_MODULE}
+_folded = cache.Memo()
+
+
+def _hex(text:str):
+    try:
+        return int(text, 16)
+    except ValueError:
+        return None
+
+
+def operand(tree):
+    """赋值右边只有一个操作数时返回这个data节点（expression -> term -> factor -> data），否则返回None。"""
+    while isinstance(tree, Tree):
+        if tree.data == "data":
+            return tree
+        if tree.data not in ("expression", "term", "factor") or len(tree.children) != 1:
+            return None
+        tree = tree.children[0]
+    return None
+
+
+def literal(value:int, rule:str = "data"):
+    """数值对应的语法树，rule为替换位置上原来的规则名，外面补齐相应的包装。"""
+    tree = Tree("data", [Tree("int", [Token("INT", str(value))])])
+    for wrap in ("factor", "term", "expression"):
+        if rule == "data":
+            break
+        tree = Tree(wrap, [tree])
+        if rule == wrap:
+            break
+    return tree
+
+
+class Folder():
+    """在一个作用域（application或module）中折叠指令。
+
+    Attributes:
+        consts (dict): {常量名: (数值, 位宽)}
+        names (set): 作用域中会遮住常量的名字
+        count (int): 折叠掉的运算数
+    """
+
+    def __init__(self, consts:dict, names:set):
+        self.consts = consts
+        self.names = names
+        self.count = 0
+
+    def value(self, tree):
+        """计算一棵表达式子树的值，返回 (数值, 位宽)，位宽为None表示无限精度；不是常量时返回None。"""
+        if not isinstance(tree, Tree):
+            return None
+        if tree.data == "data":
+            child = tree.children[0]
+            if child.data == "int":
+                return int(child.children[0].value), None
+            if child.data == "ox_num":
+                number = _hex(child.children[0].value)
+                return None if number is None else (number, None)
+            if child.data == "name":
+                name = child.children[0].value
+                if name in self.names:
+                    return None
+                return self.consts.get(name)
+            if child.data == "expression":
+                return self.value(child)
+            return None
+        if tree.data == "factor":
+            if len(tree.children) == 1:
+                return self.value(tree.children[0])
+            return _unary(tree.children[0].children[0].value, self.value(tree.children[1]))
+        if tree.data in ("expression", "term"):
+            result = self.value(tree.children[0])
+            for i in range(1, len(tree.children), 2):
+                if result is None:
+                    return None
+                result = _binary(tree.children[i].value, result, self.value(tree.children[i + 1]))
+            return result
+        if tree.data == "bitwise_expr":
+            values = [self.value(tree.children[i]) for i in range(0, len(tree.children), 2)]
+            if any(v is None for v in values):
+                return None
+            ops = [tree.children[i].value for i in range(1, len(tree.children), 2)]
+            return _bitwise(values, ops)
+        return None
+
+    def fold(self, tree):
+        """折叠一棵表达式子树：整棵是常量时换成数值，否则折叠其中常量的部分。没有变化时返回原对象。"""
+        if not isinstance(tree, Tree) or tree.data not in ("data", "factor", "term", "expression", "bitwise_expr"):
+            return tree
+        #只包着一个整数的子树（如 a + 1 中的 1）已经是结果，不重建，否则没有可折叠指令的组件也会被复制
+        data = operand(tree)
+        if data is not None and data.children[0].data in ("int", "array"):
+            return tree
+        result = self.value(tree)
+        if result is not None and result[0] >= 0:
+            self.count = self.count + _operations(tree)
+            if tree.data == "bitwise_expr":
+                return literal(result[0])
+            return literal(result[0], tree.data)
+        children = [self.fold(child) for child in tree.children]
+        if all(a is b for a, b in zip(children, tree.children)):
+            return tree
+        return Tree(tree.data, children)
+
+    def fold_ins(self, ins):
+        """折叠一条指令，没有变化时返回原对象。"""
+        if type(ins) is data_structure.LYNETTE_INS_ASSIGN:
+            right1 = self.fold(ins.right1)
+            if right1 is ins.right1:
+                return ins
+            ins_t = data_structure.LYNETTE_INS_ASSIGN()
+            ins_t.left = ins.left
+            #只剩一个操作数时直接存data节点
+            ins_t.right1 = operand(right1) or right1
+            return ins_t
+        if type(ins) is data_structure.LYNETTE_INS_CUL:
+            value = _binary(ins.op, self.value(ins.right1), self.value(ins.right2))
+            if value is not None and value[0] >= 0:
+                self.count = self.count + 1
+                ins_t = data_structure.LYNETTE_INS_ASSIGN()
+                ins_t.left = ins.left
+                ins_t.right1 = literal(value[0])
+                return ins_t
+            right1 = self.fold(ins.right1)
+            right2 = self.fold(ins.right2)
+            if right1 is ins.right1 and right2 is ins.right2:
+                return ins
+            ins_t = copy.copy(ins)
+            ins_t.right1 = right1
+            ins_t.right2 = right2
+            return ins_t
+        if type(ins) is data_structure.LYNETTE_INS_IF:
+            blocks = [self.fold_block(block) for block in ins.condition_block]
+            else_ins = self.fold_ins(ins.else_ins) if ins.else_ins_t == 1 else None
+            default_bolck = self.fold_block(ins.default_bolck) if ins.default == 1 else None
+            if all(a is b for a, b in zip(blocks, ins.condition_block)) \
+                    and (else_ins is None or else_ins is ins.else_ins) \
+                    and (default_bolck is None or default_bolck is ins.default_bolck):
+                return ins
+            ins_t = copy.copy(ins)
+            ins_t.condition_block = blocks
+            if else_ins is not None:
+                ins_t.else_ins = else_ins
+            if default_bolck is not None:
+                ins_t.default_bolck = default_bolck
+            return ins_t
+        return ins
+
+    def fold_all(self, all_ins:list):
+        """折叠指令序列，没有变化时返回原列表。"""
+        folded = [self.fold_ins(ins) for ins in all_ins]
+        if all(a is b for a, b in zip(folded, all_ins)):
+            return all_ins
+        return folded
+
+    def fold_block(self, block):
+        all_ins = self.fold_all(block.ins)
+        if all_ins is block.ins:
+            return block
+        block_t = data_structure.LYNETTE_BLOCK()
+        block_t.ins = all_ins
+        return block_t
+
+
+def _operations(tree):
+    """表达式子树中运算符的个数。"""
+    if tree.data == "data":
+        return _operations(tree.children[0]) if tree.children[0].data == "expression" else 0
+    n = 0
+    for child in tree.children:
+        if isinstance(child, Token) or child.data == "unary_op":
+            n = n + 1
+        else:
+            n = n + _operations(child)
+    return n
+
+
+def _unary(op:str, operand_v):
+    if operand_v is None:
+        return None
+    value, width = operand_v
+    if op == "+":
+        return operand_v
+    if op == "-":
+        return (-value % (1 << width), width) if width is not None else (-value, None)
+    if op == "~" and width is not None:
+        return ~value % (1 << width), width
+    return None
+
+
+def _binary(op:str, left, right):
+    if left is None or right is None:
+        return None
+    (a, width_a), (b, width_b) = left, right
+    if width_a is not None and width_b is not None and width_a != width_b:
+        return None
+    width = width_a if width_a is not None else width_b
+    if op in ("/", "%", "&", "|", "^", "<<", ">>") and (a < 0 or b < 0):
+        return None
+    if op == "+":
+        value = a + b
+    elif op == "-":
+        value = a - b
+    elif op == "*":
+        value = a * b
+    elif op == "/" and b > 0:
+        value = a // b
+    elif op == "%" and b > 0:
+        value = a % b
+    elif op == "&":
+        value = a & b
+    elif op == "|":
+        value = a | b
+    elif op == "^":
+        value = a ^ b
+    elif op == "<<" and b <= MAX_SHIFT:
+        value = a << b
+    elif op == ">>":
+        value = a >> b
+    else:
+        return None
+    if width is not None:
+        value = value % (1 << width)
+    return value, width
+
+
+def _bitwise(values:list, ops:list):
+    """按P4的优先级计算 v0 op0 v1 op1 v2 ...，同一优先级左结合。"""
+    values = list(values)
+    ops = list(ops)
+    for priority in sorted(set(BITWISE_PRIORITY.values()), reverse=True):
+        i = 0
+        while i < len(ops):
+            if BITWISE_PRIORITY[ops[i]] == priority:
+                value = _binary(ops[i], values[i], values[i + 1])
+                if value is None:
+                    return None
+                values[i:i + 2] = [value]
+                ops.pop(i)
+            else:
+                i = i + 1
+    return values[0]
+
+
+def scope_names(component):
+    """作用域中会遮住常量的名字：变量、模块参数、tuple/map/set/reg。"""
+    names = set(component.var) | set(component.tuple) | set(component.mapl) | set(component.setl) | set(component.reg)
+    if isinstance(component, data_structure.LYNETTE_MODULE):
+        names.update(component.call_par)
+    return names
+
+
+def fold_app(app, consts:dict):
+    """折叠一个application，返回 (折叠后的对象, 折叠掉的运算数)。"""
+    folder = Folder(consts, scope_names(app))
+    all_ins = folder.fold_all(app.ins)
+    if all_ins is app.ins:
+        return app, 0
+    app_t = copy.copy(app)
+    app_t.ins = all_ins
+    return app_t, folder.count
+
+
+def fold_module(module, consts:dict):
+    """折叠一个module（control和func），返回 (折叠后的对象, 折叠掉的运算数)。"""
+    folder = Folder(consts, scope_names(module))
+    all_ins = folder.fold_all(module.ins)
+    func = {}
+    for name in module.func:
+        func[name] = folder.fold_block(module.func[name])
+    if all_ins is module.ins and all(func[name] is module.func[name] for name in func):
+        return module, 0
+    module_t = copy.copy(module)
+    module_t.ins = all_ins
+    module_t.func = func
+    module_t.source = None
+    return module_t, folder.count
+
+
+def execute(applications:dict, modules:dict, path, define_table=None):
+    """常量折叠，在collect之后、generate之前执行。
+
+    Args:
+        applications (dict): {应用名: LYNETTE_APP}
+        modules (dict): {模块名: LYNETTE_MODULE}，可以是用户之间共享的对象，这里不会修改
+        path (str): 工程输入路径，写日志。
+        define_table (DefineTable, 可选): define.pne的解析结果，没有时从path读取
+
+    Returns:
+        tuple: (applications, modules)，新的字典，没有变化的组件仍是原来的对象。
+    """
+    print('fold...')
+    with open(path + "//log_out//log.txt","a") as file:
+        file.write('fold...\n')
+    if define_table is None:
+        define_table = defines.load(path)
+    consts = define_table.values
+    consts_key = define_table.digest
+    count = 0
+
+    applications_t = {}
+    for name in applications:
+        applications_t[name], n = fold_app(applications[name], consts)
+        count = count + n
+
+    modules_t = {}
+    for name in modules:
+        module = modules[name]
+        key = (module.source, consts_key)
+        if module.source is not None and key in _folded:
+            modules_t[name] = _folded[key]
+            continue
+        modules_t[name], n = fold_module(module, consts)
+        count = count + n
+        if module.source is not None:
+            _folded[key] = modules_t[name]
+
+    with open(path + "//log_out//log.txt","a") as file:
+        file.write('fold: ' + str(count) + ' operations\n')
+    return applications_t, modules_t
@@ -0,0 +1,229 @@
+"""fragments.py - 内存中的代码片段
+
+功能说明：
+    generate按指令逐个token地往 component/ 下的片段文件（prefix_N_control/action/table/reg/tem/entry.pne、
+    prefix_var.pne）追加内容，一个中等规模的程序要打开关闭几万次文件。FragmentStore把这些片段按文件名
+    保存在内存中：
+    1. Generator 通过 open(路径) 拿到一个只能追加写的流，用法和 open(路径, 'a') 一样；
+    2. aggregate 通过 read(文件名) 读取整个片段，通过 lines(文件名) 逐行读取；
+    3. 同一次运行中所有用户共用一个FragmentStore（LynetteRunner.fragments），watch模式按文件名删除片段；
+    4. log不为None时每次打开和写入还会记一条事件，Generator用它记下module的展开（见expansion.py）。
+    片段只在调试时需要落盘：--dump-fragments 时在aggregate之前用 flush 写到 component/ 下。
+
+表项片段：
+    表项片段（*_entry.pne）可能来自几百万行的外部表项文件，不放在内存中，而是写到临时目录下的文件里，
+    aggregate 逐行读取。记录展开时只记下写入的位置 ("span", 文件名, 起点, 长度)，重放时用 copy 逐行改名复制；
+    进程池中的Generator把表项片段写到同一个临时目录，只把文件路径传回主进程，由 adopt 接管。
+"""
+
+import os
+import shutil
+import tempfile
+
+#写到文件中的片段
+ENTRY_SUFFIX = "_entry.pne"
+
+
+def is_file_stream(name:str):
+    """这个片段是否写到文件中。"""
+    return name.endswith(ENTRY_SUFFIX)
+
+
+class Stream():
+    """片段的一个追加写流，支持with语句。"""
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks:list):
+        self.chunks = chunks
+
+    def write(self, text:str):
+        self.chunks.append(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class LoggedStream(Stream):
+    """打开和写入时同时记到log中的流。"""
+    __slots__ = ("name", "log")
+
+    def __init__(self, chunks:list, name:str, log:list):
+        Stream.__init__(self, chunks)
+        self.name = name
+        self.log = log
+        self.log.append(("write", name, ""))
+
+    def write(self, text:str):
+        self.chunks.append(text)
+        self.log.append(("write", self.name, text))
+
+
+class FileStream():
+    """写到文件中的片段的追加写流，record为 [文件路径, 已写的字节数]，log不为None时记下写入的位置。"""
+    __slots__ = ("record", "file", "name", "log")
+
+    def __init__(self, record:list, name:str, log:list):
+        self.record = record
+        self.file = open(record[0], "ab")
+        self.name = name
+        self.log = log
+        if log is not None:
+            log.append(("span", name, record[1], 0))
+
+    def write(self, text:str):
+        data = text.encode("utf-8")
+        self.file.write(data)
+        if self.log is not None:
+            self.log.append(("span", self.name, self.record[1], len(data)))
+        self.record[1] = self.record[1] + len(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class FragmentStore():
+    """按文件名保存的代码片段。
+
+    Attributes:
+        streams (dict): {文件名: 写入的文本块列表}，读取时拼接成一块
+        files (dict): {文件名: [文件路径, 已写的字节数]}，写到文件中的表项片段
+        directory (str): 表项片段所在的目录，第一次写表项片段时建立
+        log (list): 不为None时记下每次写入
+    """
+
+    def __init__(self, directory:str=None):
+        """
+        Args:
+            directory (str): 表项片段写到哪个目录，默认新建一个临时目录，由这个FragmentStore负责删除。
+        """
+        self.streams = {}
+        self.files = {}
+        self.directory = directory
+        self.owns_directory = False
+        self.log = None
+
+    def __del__(self):
+        if self.owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def spill_directory(self):
+        """表项片段所在的目录，进程池中的Generator也写到这里。"""
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="lynette_entry_")
+            self.owns_directory = True
+        return self.directory
+
+    def open(self, path:str, mode="a"):
+        """打开片段，path只取文件名；mode为'a'追加，'w'清空后写。"""
+        name = os.path.basename(path)
+        if mode != "a" and mode != "w":
+            print("error-fragments what mode", mode)
+            exit()
+        if is_file_stream(name):
+            if mode == "w" or name not in self.files:
+                self.remove(name)
+                fd, file_path = tempfile.mkstemp(dir=self.spill_directory(), suffix=ENTRY_SUFFIX)
+                os.close(fd)
+                self.files[name] = [file_path, 0]
+            return FileStream(self.files[name], name, self.log)
+        if mode == "w" or name not in self.streams:
+            self.streams[name] = []
+        if self.log is not None:
+            return LoggedStream(self.streams[name], name, self.log)
+        return Stream(self.streams[name])
+
+    def read(self, name:str):
+        """片段的全部文本。"""
+        if name in self.files:
+            with open(self.files[name][0], "rb") as file:
+                return file.read().decode("utf-8")
+        if name not in self.streams:
+            print("error-fragments no fragment", name)
+            exit()
+        chunks = self.streams[name]
+        text = "".join(chunks)
+        chunks[:] = [text]
+        return text
+
+    def lines(self, name:str):
+        """逐行读取片段，表项片段从文件中边读边产出。"""
+        if name not in self.files:
+            yield from self.read(name).splitlines(keepends=True)
+            return
+        with open(self.files[name][0], "r", encoding="utf-8", newline="") as file:
+            yield from file
+
+    def copy(self, source:str, spans:list, stream, convert):
+        """把表项片段source中的若干段逐行转换后写到stream，用于重放记下的展开。
+
+        Args:
+            source (str): 记录时写的表项片段
+            spans (list): [(起点, 长度)]，字节位置
+            stream (FileStream): 写到哪里
+            convert (function): 每一行的转换
+        """
+        with open(self.files[source][0], "rb") as file:
+            for start, length in spans:
+                file.seek(start)
+                left = length
+                while left > 0:
+                    line = file.readline(left)
+                    left = left - len(line)
+                    stream.write(convert(line.decode("utf-8")))
+
+    def adopt(self, name:str, file_path:str, size:int):
+        """接管进程池中写好的表项片段文件。"""
+        self.remove(name)
+        self.files[name] = [file_path, size]
+
+    def detach(self):
+        """交出所有表项片段文件，返回 {文件名: (文件路径, 字节数)}，之后这里不再删除它们。"""
+        files = {name: tuple(record) for name, record in self.files.items()}
+        self.files = {}
+        return files
+
+    def __contains__(self, name:str):
+        return name in self.streams or name in self.files
+
+    def sizes(self):
+        """{文件名: 长度}，用来找出一次generate新写的片段，表项片段为字节数。"""
+        sizes = {name: sum(len(chunk) for chunk in chunks) for name, chunks in self.streams.items()}
+        sizes.update((name, record[1]) for name, record in self.files.items())
+        return sizes
+
+    def remove(self, name:str):
+        self.streams.pop(name, None)
+        record = self.files.pop(name, None)
+        if record is not None:
+            discard(record[0])
+
+    def clear(self):
+        self.streams = {}
+        for name in list(self.files):
+            self.remove(name)
+
+    def flush(self, path:str):
+        """把所有片段写到path目录下，只用于调试。"""
+        for name in self.streams:
+            with open(os.path.join(path, name), "w") as file:
+                file.write(self.read(name))
+        for name in self.files:
+            shutil.copyfile(self.files[name][0], os.path.join(path, name))
+
+
+def discard(file_path:str):
+    """删除一个不再需要的表项片段文件。"""
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
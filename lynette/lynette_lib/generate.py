@@ -1,25 +1,73 @@
-from lark import Lark, Tree, Token
+from lark import Tree, Token
 import os,json
+from concurrent.futures import ProcessPoolExecutor
+from lynette.lynette_lib import cse
 from lynette.lynette_lib import data_structure
-from lynette.lynette_lib.grammar.grammar_define import grammar_define
+from lynette.lynette_lib import defines
+from lynette.lynette_lib import entry_scanner
+from lynette.lynette_lib import expansion
+from lynette.lynette_lib import fragments
+from lynette.lynette_lib import fold
+from lynette.lynette_lib import operands
+from lynette.lynette_lib import symbols
 
 class Generator():
     def __init__(self, **args):
+        self.sys_path = args["sys_path"]
         self.component_dir = args["sys_path"] + '//component//'
 
         self.type_dict = {}
         self.entry_v1mod = 'no'
         self.tables = {}
-        self.const_dict = {}
         self.var_dict = {}
         self.reg_dict = {}
         self.frag_relation_dict = {}
         self.table_name = {}
         self.action_name = {}
         self.sys_data_dict_global = {'_FALSE':"0",'_TRUE':"1", '_Next':'Next'}
+        #按IR节点记下的操作数解析结果，{id(data节点): Operand}
+        self.operands = {}
         self.compare_type = {"compare_b":" > ","compare_be":" >= ","compare_e":" == ","compare_s":" < ","compare_se":" <= ","compare_ne":" != "}
         self.table_id = 0
         self.action_id = 0
+        #define.pne的解析结果，没有传入时在execute中读取
+        self.define_table = args.get("define_table")
+        #{map/set名: 外部表项文件路径}，来自service.json的entry_files
+        self.entry_files = args.get("entry_files", {})
+        #{map/set名: 打开的外部表项文件}，模块IR在用户之间共享，不能直接改table.entry
+        self.table_entries = {}
+        #服务内可以复用的map取值、check和赋值
+        self.available = cse.Available()
+        #片段写在内存中，同一次运行的所有用户共用一个，aggregate从这里读取
+        self.fragments = args.get("fragments")
+        if self.fragments is None:
+            self.fragments = fragments.FragmentStore()
+        #module展开的记忆，{(module, 缩进, 参数绑定形式): Expansion}，只出现过一次的为None，见expansion.py
+        self.expansions = {}
+        #正在记录的展开层数和事件序列
+        self.recording = 0
+        self.events = None
+        #并行生成的进程数，1表示串行
+        self.jobs = args.get("jobs", 1)
+
+    #记录片段写了哪个变量/头部字段，之前依赖它的可复用结果随之失效
+    def generate_output(self, file_write_o:str, data_name:str):
+        self.frag_relation_dict[file_write_o].output.append(symbols.intern(data_name))
+        self.available.wrote(data_name)
+
+    #表名/action名去重，第一次出现的名字原样使用，之后依次加上_1、_2...
+    #参数：table或action，名字
+    def generate_name(self, kind:str, name:str):
+        names = self.table_name if kind == "table" else self.action_name
+        final = name
+        if name not in names:
+            names[name] = 0
+        else:
+            names[name] = names[name] + 1
+            final = name + "_" + str(names[name])
+        if self.events is not None:
+            self.events.append(("name", kind, name, final))
+        return final
 
     #这个东西是用来第一次进app或者进module的时候，把里面的变量生成一遍,并记录对应关系
     #生成的时候会覆盖掉原来已有的映射
@@ -27,26 +75,79 @@ class Generator():
     #但是在实际聚合的时候，其实是个树形聚合
     #参数：要生成的变量列表，要用来记录的表，前缀
     def generate_var(self, var_to_generate:dict, var_list:dict, prefix:str):
-        #把数据类型洗一遍
-        for var_name_i in var_to_generate:
-            if var_to_generate[var_name_i] in self.type_dict:
-                var_to_generate[var_name_i] = self.type_dict[var_to_generate[var_name_i]]
         #开始生成
         #看看这是不是个新的命名域，有可能不是新的
+        if self.events is not None:
+            self.events.append(("var", prefix, prefix not in self.var_dict))
         if prefix not in self.var_dict:
             self.var_dict[prefix] = {}
         else:
             return
-        with open(self.component_dir + "//" + prefix + '_var.pne','a') as file:
+        with self.fragments.open(self.component_dir + "//" + prefix + '_var.pne') as file:
             for var_name_i in var_to_generate:
-                var_name = prefix + "_" + var_name_i
-                file.write(var_to_generate[var_name_i])
+                var_name = symbols.text(symbols.join(prefix, var_name_i))
+                #把数据类型洗一遍，var_to_generate是共享的IR，不能原地改
+                var_type = var_to_generate[var_name_i]
+                file.write(self.type_dict.get(var_type, var_type))
                 file.write(" ")
                 file.write(var_name)
                 file.write(";\n")
                 #要记录一下程序里面的名字和生成出来的名字的对应关系
                 var_list[var_name_i] = var_name
 
+    #把表项写成entry片段，每条表项一行json
+    #前len(keys)列是match，剩下的列依次是action的value_0、value_1...
+    #每行的格式都一样，先按json.dump的输出格式拼出模板，再按块把整块表项套进模板一次写出
+    #列式表项按块转成文本，外部表项文件边读边写，不会整体载入内存
+    #参数：entry文件，表名，action名，key列表，表项，是否输出action参数
+    def generate_entry(self, file, table_name:str, action_name:str, keys:list,
+                       entry, with_params=True):
+        key_num = len(keys)
+        template = None
+        for chunk in entry_scanner.iter_chunks(entry):
+            if template is None:
+                template, columns = self.entry_template(table_name, action_name, keys,
+                                                        len(chunk[0]) - key_num if with_params else 0)
+            file.write("".join([template % tuple([row[c] for c in columns]) for row in chunk]))
+
+    #entry片段一行的模板，和 json.dump({'table':..., 'match':..., 'action_name':..., 'action_params':...}) 的输出一致
+    #表项的值只能是数字、名字、IP之类，不需要转义
+    #返回：模板，模板中依次填入的列号
+    def entry_template(self, table_name:str, action_name:str, keys:list, param_num:int):
+        #同名的key在dict中只保留最后一个值，位置是第一次出现的位置
+        match = {}
+        for k_i in range(len(keys)):
+            match[keys[k_i]] = k_i
+        columns = list(match.values()) + [len(keys) + p_i for p_i in range(param_num)]
+        match_t = ", ".join([json.dumps(key).replace("%", "%%") + ': ["%s"]' for key in match])
+        params_t = ", ".join(['"value_' + str(p_i) + '": ["%s"]' for p_i in range(param_num)])
+        template = '{"table": ' + json.dumps(table_name).replace("%", "%%") + ', "match": {' + match_t + '}, ' + \
+                   '"action_name": ' + json.dumps(action_name).replace("%", "%%") + ', "action_params": {' + params_t + '}}\n'
+        return template, columns
+
+    #把service.json中绑定的外部表项文件对应到map/set上，记在table_entries中
+    #同一张表不能既有内联表项又绑定外部文件
+    def bind_entry_files(self, modules:dict):
+        bound = {}
+        for module_name in modules:
+            module = modules[module_name]
+            for table in list(module.mapl.values()) + list(module.setl.values()):
+                if table.name not in self.entry_files:
+                    continue
+                if entry_scanner.has_rows(table.entry):
+                    print("error-generate-bind_entry_files entry both inline and in file", table.name)
+                    exit()
+                self.table_entries[table.name] = entry_scanner.open_entry_file(self.entry_files[table.name])
+                bound[table.name] = 1
+        for name in self.entry_files:
+            if name not in bound:
+                print("error-generate-bind_entry_files what map or set", name)
+                exit()
+
+    #map/set的表项：绑定了外部表项文件时用文件，否则用源码中的entry块
+    def table_entry(self, table):
+        return self.table_entries.get(table.name, table.entry)
+
     #生成赋值语句。这个情况可以是赋值也可以是table，还可以是寄存器。它要返回是什么情况。
     def generate_ins_assign(self, 
                             ins:data_structure.LYNETTE_INS,
@@ -66,8 +167,14 @@ class Generator():
             file_write = self.component_dir + file_write_o + "_action.pne"
         else:
             file_write = self.component_dir + file_write_o + "_control.pne"
+        #右边只有一个操作数时是data节点，否则是表达式
+        right = fold.operand(ins.right1)
+        if if_generate == "yes" and if_action == "no":
+            assign_type = self.generate_reuse(ins,right,var_list_o,mapl_o,file_write_o)
+            if assign_type is not None:
+                return assign_type
         if if_generate == "yes":
-            with open(file_write,'a') as file:
+            with self.fragments.open(file_write) as file:
                 for i in range(level_o):
                     file.write("    ")
         assign_type = ''
@@ -75,25 +182,25 @@ class Generator():
             #这个情况一定是给寄存器赋值
             print("generate-ins-assign error function 2")
             exit()
-        elif ins.right1.children[0].data == "array":
+        elif right is not None and right.children[0].data == "array":
             #这个情况一定是从寄存器取值或者是从table里面取值
             #看一下这个是不是map
-            map_name = ins.right1.children[0].children[0].children[0].children[0].value
+            map_name = right.children[0].children[0].children[0].children[0].value
             if map_name in mapl_o:
                 #所以这东西是个map
                 if if_generate == "no":
                     #不生成，所以这是if和switch在检查
                     assign_type = 'table_assign_yes'
-                    if ins.right1.children[0].children[1].data == "index_null":
+                    if right.children[0].children[1].data == "index_null":
                         print("error-generate-ins-assign map[_]")
                         exit()
                     else:
                         #检查用的key的数量
-                        if len(ins.right1.children[0].children[1].children) > len(available_key):
+                        if len(right.children[0].children[1].children) > len(available_key):
                             assign_type = 'table_assign_no'
                         else:
                             #检查用的key能不能用，其实还应该检查一下table是不是对的
-                            for data in ins.right1.children[0].children[1].children:
+                            for data in right.children[0].children[1].children:
                                 data_name,data_type = self.generate_data(data.children[0],var_list_o,if_generate="no")
                                 if data_name not in available_key:
                                     assign_type = 'table_assign_no'
@@ -103,11 +210,11 @@ class Generator():
                         for data_i in ins.left:
                             if int_i != 0:
                                 for i in range(level_o):
-                                    with open(file_write,"a") as file:
+                                    with self.fragments.open(file_write) as file:
                                         file.write("    ")
                             data_name,_ = self.generate_data(data_i,var_list_o,file_write_o=file_write)
-                            self.frag_relation_dict[file_write_o].output.append(data_name)
-                            with open(file_write,"a") as file:
+                            self.generate_output(file_write_o, data_name)
+                            with self.fragments.open(file_write) as file:
                                 file.write(" = value_" + str(int_i) + ";\n")
                             int_i = int_i + 1
                     else:
@@ -116,37 +223,35 @@ class Generator():
                         #构造table名字和key列表
                         """table_name = prefix + "_" + map_name + "_" + str(self.table_id)
                         self.table_id = self.table_id + 1 """
-                        table_name = prefix + "_" + map_name
-                        if table_name not in self.table_name:
-                            self.table_name[table_name] = 0
-                        else:
-                            self.table_name[table_name] = self.table_name[table_name] + 1
-                            table_name = table_name + "_" + str(self.table_name[table_name])
+                        table_name = symbols.text(symbols.join(prefix, map_name))
+                        table_name = self.generate_name("table", table_name)
                         keys = []
-                        if ins.right1.children[0].children[1].data == "index_null":
+                        key_datas = []
+                        if right.children[0].children[1].data == "index_null":
                             print("error-generate-ins-assign map[_]")
                             exit()
                         else:
-                            for key in ins.right1.children[0].children[1].children:
+                            for key in right.children[0].children[1].children:
                                 key = key.children[0]
                                 key,key_type = self.generate_data(key,var_list_o,if_generate="no")
                                 if key_type != "hdr" and key_type != "var" and key_type != "pkt":
                                     print("error-generate-ins-assign what key",key_type)
                                     exit()
                                 keys.append(key)
+                                key_datas.append((key,key_type))
 
                         #key列表应该是每个frag的input
                         for key in keys:
-                            self.frag_relation_dict[file_write_o].input.append(key)
+                            self.frag_relation_dict[file_write_o].input.append(symbols.intern(key))
                         
                         #生成一下table名字和key列表
                         file_write_table  = file_write_o + "_table.pne"
-                        with open(self.component_dir + file_write_table,"a") as file:
+                        with self.fragments.open(self.component_dir + file_write_table) as file:
                             file.write("table " + table_name + "{\n")
-                        with open(self.component_dir + file_write_table,'a') as file:
+                        with self.fragments.open(self.component_dir + file_write_table) as file:
                             file.write("    key = {\n")
                         for key in keys:
-                            with open(self.component_dir + file_write_table,'a') as file:
+                            with self.fragments.open(self.component_dir + file_write_table) as file:
                                 file.write("        ")
                                 file.write(key)
                                 file.write(" : exact;\n")
@@ -155,16 +260,12 @@ class Generator():
                         #构造一个目标动作
                         file_write_action = file_write_o + "_action.pne"
                         values = []
-                        with open(self.component_dir + file_write_action,'a') as file:
+                        with self.fragments.open(self.component_dir + file_write_action) as file:
                             file.write("action ")
                             """ action_name = table_name + "_action_" + str(self.action_id)
                             self.action_id = self.action_id + 1  """
                             action_name = table_name + "_action"
-                            if action_name not in self.action_name:
-                                self.action_name[action_name] = 0
-                            else:
-                                self.action_name[action_name] = self.action_name[action_name] + 1
-                                action_name = action_name + "_" + str(self.action_name[action_name])
+                            action_name = self.generate_name("action", action_name)
                             file.write(action_name)
                             file.write("(")
                             value_i = 0
@@ -182,17 +283,19 @@ class Generator():
                             file.write(")\n")
                             file.write("{\n")
                             value_i = 0
+                            left_datas = []
                             #所有被赋值的left应该是frag的output
                             for left in ins.left:
-                                left,_ = self.generate_data(left,var_list_o,if_generate="no")
-                                self.frag_relation_dict[file_write_o].output.append(left)
+                                left,left_type = self.generate_data(left,var_list_o,if_generate="no")
+                                left_datas.append((left,left_type))
+                                self.generate_output(file_write_o, left)
                                 file.write("    " + left)
                                 file.write(" = value_" + str(value_i) + ";\n")
                                 value_i = value_i + 1
                             file.write("}\n")
 
                         #关联table和action
-                        with open(self.component_dir + file_write_table,'a') as file:
+                        with self.fragments.open(self.component_dir + file_write_table) as file:
                             file.write("    actions = {\n")
                             file.write("        " + action_name + ";\n")
                             file.write("    }\n")
@@ -200,39 +303,26 @@ class Generator():
 
                         #构造entry
                         file_write_entry = file_write_o + "_entry.pne"
-                        with open(self.component_dir + file_write_entry,'a') as file:
-                            entry = mapl_o[map_name].entry
-                            if len(entry) != 0:
-                                if len(keys) + len(values) != len(entry[0]):
+                        with self.fragments.open(self.component_dir + file_write_entry) as file:
+                            entry = self.table_entry(mapl_o[map_name])
+                            if entry_scanner.has_rows(entry):
+                                if len(keys) + len(values) != entry_scanner.width(entry):
                                     print("error-generate_if_single_table key value entry")
                                     print(keys)
                                     print(values)
                                     print(entry)
                                     exit()
-                                for e in entry:
-                                    ae = {}
-                                    ae['table'] = table_name
-                                    matchs = {}
-                                    k_i = 0
-                                    while k_i < len(keys):
-                                        matchs[keys[k_i]] = [entry[e][k_i]]
-                                        k_i = k_i + 1
-                                    ae['match'] = matchs
-                                    ae['action_name'] = action_name
-                                    pa = {}
-                                    zero = k_i
-                                    while k_i < len(entry[e]):
-                                        pa["value_" + str(k_i - zero)] = [entry[e][k_i]]
-                                        k_i = k_i + 1
-                                    ae['action_params'] = pa
-                                    json.dump(ae,file)
-                                    file.write("\n")
+                                self.generate_entry(file, table_name, action_name, keys, entry)
 
 
                         #在control中调用
                         file_write_control = file_write_o + "_control.pne"
-                        with open(self.component_dir + file_write_control,'a') as file:
+                        with self.fragments.open(self.component_dir + file_write_control) as file:
                             file.write(table_name + ".apply();\n")
+
+                        #记下这次取值，后面同样的取值可以复用左值
+                        self.available.add(("lookup", id(mapl_o[map_name]), tuple(keys)), file_write_o, key_datas, left_datas,
+                                           portable=cse.portable(self.table_entry(mapl_o[map_name])))
                 else:
                     print("error-generate-ins-assign what generate?")
                     exit()
@@ -246,92 +336,119 @@ class Generator():
             if if_generate == "yes":
                 #先生成一下左边
                 data_name,data_type = self.generate_data(ins.left[0],var_list_o,file_write_o=file_write)
+                left_data = (data_name,data_type)
                 if data_type == "var" or data_type == "hdr" or data_type == "meta":
-                    self.frag_relation_dict[file_write_o].output.append(data_name)
+                    self.generate_output(file_write_o, data_name)
+                else:
+                    self.available.wrote(data_name)
                 #然后是中间这个等于号
-                with open(file_write,"a") as file:
+                with self.fragments.open(file_write) as file:
                     file.write(" = ")
                 #然后是右边
-                data_name,data_type = self.generate_data(ins.right1,var_list_o,file_write_o=file_write)
-                if data_type == "var" or data_type == "hdr" or data_type == "meta":
-                    self.frag_relation_dict[file_write_o].input.append(data_name)
+                if right is not None:
+                    data_name,data_type = self.generate_data(right,var_list_o,file_write_o=file_write)
+                    if data_type == "var" or data_type == "hdr" or data_type == "meta":
+                        self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
+                    if if_action == "no" and data_name != left_data[0]:
+                        self.available.add(("store", left_data[0], data_name), file_write_o, [(data_name,data_type)], [left_data])
+                else:
+                    for data_name in self.generate_expression(ins.right1,var_list_o,file_write):
+                        self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
                 #然后换行
-                with open(file_write,"a") as file:
+                with self.fragments.open(file_write) as file:
                     file.write(";\n")
         return assign_type
-    
+
+    #前面已经生成过同样的map取值或赋值并且还能用（见cse.py）时直接复用，返回assign_type；不能复用返回None
+    def generate_reuse(self,
+                        ins:data_structure.LYNETTE_INS,
+                        right:Tree,#右边的data节点，表达式时为None
+                        var_list_o:dict,#当前可用变量列表
+                        mapl_o:dict,#当前可用map
+                        file_write_o:str #往啥片段放
+                        ):
+        if right is None or ins.left[0].children[0].data == "array":
+            return None
+        lefts = [self.generate_data(left,var_list_o,if_generate="no") for left in ins.left]
+        if right.children[0].data == "array":
+            map_name = right.children[0].children[0].children[0].children[0].value
+            if map_name not in mapl_o or right.children[0].children[1].data == "index_null":
+                return None
+            keys = []
+            for key in right.children[0].children[1].children:
+                key,_ = self.generate_data(key.children[0],var_list_o,if_generate="no")
+                keys.append(key)
+            found = self.available.get(("lookup", id(mapl_o[map_name]), tuple(keys)), file_write_o)
+            #只有左值和前一次完全相同时才去掉这次取值：命中时写入的值相同，未命中时两次都不改左值；
+            #左值不同时从前一次的左值赋值会在未命中时改写左值，不复用
+            if found is None or [left[0] for left in lefts] != [prev[0] for prev in found]:
+                return None
+            self.available.counts["lookup"] = self.available.counts["lookup"] + 1
+            return "table_assign_yes"
+        if len(lefts) != 1:
+            return None
+        #同样的赋值已经做过，左右两边都没有再被改写，直接去掉
+        data_name,_ = self.generate_data(right,var_list_o,if_generate="no")
+        if self.available.get(("store", lefts[0][0], data_name), file_write_o) is None:
+            return None
+        self.available.counts["store"] = self.available.counts["store"] + 1
+        return "simple_assign"
+
+    #生成表达式（expression/term/factor/bitwise_expr），写到文件里面去，返回读取的变量和头部字段
+    def generate_expression(self, tree:Tree,
+                            var_list_o:dict,
+                            file_write:str #往啥片段放，完整路径
+                            ):
+        inputs = []
+        if tree.data == "data":
+            if tree.children[0].data == "expression":
+                #括号里面的表达式
+                with self.fragments.open(file_write) as file:
+                    file.write("(")
+                inputs = self.generate_expression(tree.children[0],var_list_o,file_write)
+                with self.fragments.open(file_write) as file:
+                    file.write(")")
+                return inputs
+            data_name,data_type = self.generate_data(tree,var_list_o,file_write_o=file_write)
+            if data_type == "var" or data_type == "hdr" or data_type == "meta":
+                inputs.append(data_name)
+            return inputs
+        for child in tree.children:
+            if isinstance(child, Token):
+                #二元运算符两边加空格
+                with self.fragments.open(file_write) as file:
+                    file.write(" " + child.value + " ")
+            elif child.data == "unary_op":
+                with self.fragments.open(file_write) as file:
+                    file.write(child.children[0].value)
+            elif child.data == "expression" and tree.data == "factor":
+                #factor中括号里面的表达式
+                inputs.extend(self.generate_expression(Tree("data", [child]),var_list_o,file_write))
+            else:
+                inputs.extend(self.generate_expression(child,var_list_o,file_write))
+        return inputs
+
     #生成data，输入一个data为根的树，返回生成出来的这个str串，顺便写到文件里面去
     def generate_data(self, data_o:Tree, 
                     var_list_o:dict,
                     file_write_o = 'need to be full path', #往啥片段放
                     if_generate = 'yes' #是否实际生成，如果为no则只是转换成字符串
                     ):
-        data = data_o.children[0]
-        data_name = ''
-        data_type = ''
-        if data.data == "name":
-            data_name = data.children[0].value
+        #解析结果按IR节点记在operands中，检查和生成共用，局部变量每次按当前命名域取名字
+        operand = self.operands.get(id(data_o))
+        if operand is None:
+            operand = operands.resolve(data_o, self.sys_data_dict_global)
+            self.operands[id(data_o)] = operand
+        data_name = operand.name
+        data_type = operand.type
+        if operand.local:
             if data_name not in var_list_o:
                 print("error-generate_data no find this data")
                 print(data_name)
                 exit()
-            else:
-                data_name = var_list_o[data_name]
-                data_type = "var"
-        elif data.data == "name_field":
-            data_len = len(data.children)
-            data_name = data.children[0].value
-            for i in range(data_len-1):
-                data_name = data_name + "." + data.children[i+1].value
-            if data.children[0].value == "hdr":
-                data_type = "hdr"
-            elif data.children[0].value == "pkt":
-                if data_len != 2:
-                    print("error-generate_data pkt small than 2")
-                    exit()
-                data_type = "pkt"
-                data_name = "LynettePKT"
-                if data.children[1].value == 'out_port':
-                    data_name = data_name + ".LynetteOutPort"
-                elif data.children[1].value == 'in_port':
-                    data_name = data_name + ".LynetteInPort"
-                else:
-                    print("error-generate_data pkt what")
-                    exit()
-            elif data.children[0].value == "gmeta":
-                if data_len != 2:
-                    print("error-generate_data pkt small than 2")
-                    exit()
-                data_type = "gmeta"
-                data_name = "gmeta."
-                data_name = data_name + data.children[1].value
-            else:
-                print("generate_data what type? error function 2")
-                print(data.children[0].value)
-                exit()
-        elif data.data == "sys_data":
-            data_name = data.children[0].value
-            if data_name in self.sys_data_dict_global:
-                data_name = self.sys_data_dict_global[data_name]
-                data_type = "sys_data"
-            else:
-                print("error-generate_data what sys data")
-                exit()
-        elif data.data == "int":
-            data_type = "int"
-            data_name = str(data.children[0].value)
-        elif data.data == "ip_data":
-            ip = data.children[0].value
-            ip = ip.split(".")
-            data_name = (int(ip[0])<<24) + (int(ip[1])<<16) + (int(ip[2])<<8) + int(ip[3])
-            data_name = str(data_name)
-            data_type = "ip_data"
-        else:
-            print("generate_data what type? error function 1")
-            print(data.data)
-            exit()
+            data_name = var_list_o[data_name]
         if if_generate == "yes":
-            with open(file_write_o,"a") as file:
+            with self.fragments.open(file_write_o) as file:
                 file.write(data_name)
         return data_name,data_type
 
@@ -449,7 +566,6 @@ class Generator():
         setl = setl_o
         func = func_o
         reg = reg_o
-        assert_num = 0
         fragment_num = 0
         for ins in all_ins:
             if can_cut == 'yes':
@@ -465,71 +581,100 @@ class Generator():
                 file_write_table   = file_write + "_table.pne"
                 file_write_tem     = file_write + "_tem.pne"
                 file_write_entry   = file_write + "_entry.pne"
-                with open(self.component_dir + file_write_control,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_control) as file:
                     file.write("")
-                with open(self.component_dir + file_write_reg,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_reg) as file:
                     file.write("")
-                with open(self.component_dir + file_write_action,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_action) as file:
                     file.write("")
-                with open(self.component_dir + file_write_table,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_table) as file:
                     file.write("")
-                with open(self.component_dir + file_write_tem,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_tem) as file:
                     file.write("")
-                with open(self.component_dir + file_write_entry,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_entry) as file:
                     file.write("")
             else:
                 file_write = file_write_o
             ins : data_structure.LYNETTE_INS
             var_list = self.copy_dict_for_no_struct(var_list_o)
-            if ins.type == "ins_assign":
-                #赋值指令
-                self.generate_ins_assign(ins,var_list,prefix,level,tuple,mapl,setl,reg,file_write_o=file_write,if_action=if_action)
-            elif ins.type == "ins_call":
-                #调用module了
-                self.generate_module(ins,modules,prefix,var_list,level,file_write)
-            elif ins.type == "if":
-                #if指令，先尝试能不能单表，然后展开
-                if_single_table = self.generate_if_can_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
-                if if_single_table == "yes":
-                    #是单表，那么按照单表展开
-                    self.generate_if_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
-                else:
-                    #不是单表，按照大if展开
-                    self.generate_if_big_if(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
-            elif ins.type == "ins_cul":
-                #计算指令
-                self.generate_ins_cul(ins,var_list,level,file_write,if_action=if_action)
-            elif ins.type == "switch":
-                #swich，先试试能不能单表展开
-                if_single_table = self.generate_switch_can_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
-                if if_single_table == "yes":
-                    #是单表，那么按照单表展开
-                    self.generate_switch_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
-                else:
-                    print("error here 7894")
-                    exit()
-            elif ins.type == "assert":
-                self.generate_condition(ins.condition[0],modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write_o)
-                assert_num = assert_num + 1
-                with open(self.component_dir+file_write_o+"_control.pne",'a') as file:
-                    for i in range(level):
-                        file.write("    ")
-                    file.write("{\n")
-                level = level + 1
-            elif ins.type == "primitive":
-                #展开源语
-                self.generate_primitive(ins,var_list,level,file_write,if_action=if_action)
-            else:
+            generate_ins = self.INS_GENERATORS.get(type(ins))
+            if generate_ins is None:
                 print("?-generate.py-generate_ins what ins",ins.type)
                 exit()
-        while assert_num > 0:
-            assert_num = assert_num - 1
+            level = generate_ins(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action)
+        #每个assert多开了一层缩进，这里依次闭合
+        while level > level_o:
             level = level - 1
-            with open(self.component_dir+file_write_o+"_control.pne",'a') as file:
+            self.available.pop()
+            with self.fragments.open(self.component_dir+file_write_o+"_control.pne") as file:
                 for i in range(level):
                     file.write("    ")
                 file.write("}\n")
 
+    #generate_ins_all中各种指令的展开，参数相同，返回展开后的缩进等级（只有assert会加一层）
+    def generate_all_assign(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        #赋值指令
+        self.generate_ins_assign(ins,var_list,prefix,level,tuple,mapl,setl,reg,file_write_o=file_write,if_action=if_action)
+        return level
+
+    def generate_all_call(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        #调用module了
+        self.generate_module(ins,modules,prefix,var_list,level,file_write)
+        return level
+
+    def generate_all_if(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        #if指令，先尝试能不能单表，然后展开
+        if_single_table = self.generate_if_can_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
+        if if_single_table == "yes":
+            #是单表，那么按照单表展开
+            self.generate_if_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
+        else:
+            #不是单表，按照大if展开
+            self.generate_if_big_if(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
+        return level
+
+    def generate_all_cul(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        #计算指令
+        self.generate_ins_cul(ins,var_list,level,file_write,if_action=if_action)
+        return level
+
+    def generate_all_switch(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        #swich，先试试能不能单表展开
+        if_single_table = self.generate_switch_can_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
+        if if_single_table == "yes":
+            #是单表，那么按照单表展开
+            self.generate_switch_single_table(ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write)
+        else:
+            print("error here 7894")
+            exit()
+        return level
+
+    def generate_all_assert(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        self.generate_condition(ins.condition[0],modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write_o=file_write_o)
+        with self.fragments.open(self.component_dir+file_write_o+"_control.pne") as file:
+            for i in range(level):
+                file.write("    ")
+            file.write("{\n")
+        #assert之后的指令都在它的块里，块闭合时（generate_ins_all末尾）记录的结果失效
+        self.available.push()
+        return level + 1
+
+    def generate_all_primitive(self,ins,modules,var_list,prefix,level,tuple,mapl,setl,func,reg,file_write,file_write_o,if_action):
+        #展开源语
+        self.generate_primitive(ins,var_list,level,file_write,if_action=if_action)
+        return level
+
+    #指令类型 -> 展开函数
+    INS_GENERATORS = {
+        data_structure.LYNETTE_INS_ASSIGN: generate_all_assign,
+        data_structure.LYNETTE_INS_CALL: generate_all_call,
+        data_structure.LYNETTE_INS_IF: generate_all_if,
+        data_structure.LYNETTE_INS_CUL: generate_all_cul,
+        data_structure.LYNETTE_INS_SWITCH: generate_all_switch,
+        data_structure.LYNETTE_INS_ASSERT: generate_all_assert,
+        data_structure.LYNETTE_INS_PRIMITIVE: generate_all_primitive,
+    }
+
     #展开源语
     def generate_primitive(self, 
                         ins:data_structure.LYNETTE_INS,
@@ -543,21 +688,23 @@ class Generator():
         else:
             file_write = self.component_dir + file_write_o + "_control.pne"
         
-        with open(file_write,'a') as file:
+        with self.fragments.open(file_write) as file:
             for i in range(level_o):
                 file.write("    ")
 
         if ins.primitive_type == "drop":
-            with open(file_write,'a') as file:
+            with self.fragments.open(file_write) as file:
                 file.write("LynetteDrop;\n")
         elif ins.primitive_type == "headercompress":
-            with open(file_write,'a') as file:
+            #头部被改写，之前的结果都不再复用
+            self.available.clear()
+            with self.fragments.open(file_write) as file:
                 file.write("LynetteHeaderCompress(")
             self.generate_data(ins.primitive_par[0],var_list_o,file_write)
-            with open(file_write,'a') as file:
+            with self.fragments.open(file_write) as file:
                 file.write(");\n")
         elif ins.primitive_type == "nop":
-            with open(file_write,'a') as file:
+            with self.fragments.open(file_write) as file:
                 file.write(";\n")
         else:
             print("error-generate_primitive what primitive",ins.primitive_type)
@@ -587,18 +734,14 @@ class Generator():
         #生成table名字和key信息
         """ table_name = prefix + "_" + ins.case[0].children[0].children[0].value + "_" + str(self.table_id)
         self.table_id = self.table_id + 1 """
-        table_name = prefix + "_" + ins.case[0].children[0].children[0].value
-        if table_name not in self.table_name:
-            self.table_name[table_name] = 0
-        else:
-            self.table_name[table_name] = self.table_name[table_name] + 1
-            table_name = table_name + "_" + str(self.table_name[table_name])
+        table_name = symbols.text(symbols.join(prefix, ins.case[0].children[0].children[0].value))
+        table_name = self.generate_name("table", table_name)
         keys = []
         for key in ins.key:
             key_name,_ = self.generate_data(key,var_list_o,if_generate="no")
             keys.append(key_name)
-            self.frag_relation_dict[file_write_o].input.append(key_name)
-        with open(self.component_dir + file_write_table,"a") as file:
+            self.frag_relation_dict[file_write_o].input.append(symbols.intern(key_name))
+        with self.fragments.open(self.component_dir + file_write_table) as file:
             file.write("table " + table_name + "{\n")
             file.write("    key = {\n")
             for key in keys:
@@ -606,7 +749,7 @@ class Generator():
             file.write("    }\n")
 
         #开始逐个生成action
-        with open(self.component_dir + file_write_table,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_table) as file:
             file.write("    actions = {\n")
         default_action = ''
         int_ic = 0
@@ -615,14 +758,10 @@ class Generator():
             """ action_name = table_name + "_action_" + str(self.action_id)
             self.action_id = self.action_id + 1 """
             action_name = table_name + "_action"
-            if action_name not in self.action_name:
-                self.action_name[action_name] = 0
-            else:
-                self.action_name[action_name] = self.action_name[action_name] + 1
-                action_name = action_name + "_" + str(self.action_name[action_name])
+            action_name = self.generate_name("action", action_name)
             action_par = []
             condition_case = ins.case[int_ic].children[0].children[0].value
-            with open(self.component_dir + file_write_table,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("        " + action_name + ";\n")
             
             if condition_case != "default":
@@ -638,7 +777,7 @@ class Generator():
                 default_action = action_name
             #向action里边构造内容
             #先打变量
-            with open(self.component_dir + file_write_action,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("action " + action_name + "(")
                 par_num = 0
                 for par_i in action_par:
@@ -651,15 +790,15 @@ class Generator():
             if ins.func[int_ic].call_name in func_o:
                 self.generate_ins_all(func_o[ins.func[int_ic].call_name].ins,modules,var_list_o,prefix,1,tuple_o,mapl_o,setl_o,func_o,reg_o,can_cut="no",file_write_o=file_write,if_action="yes")
             elif ins.func[int_ic].call_name == "nop":
-                with open(self.component_dir + file_write_action,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_action) as file:
                     file.write("    ;\n")
             elif ins.func[int_ic].call_name == "drop":
-                with open(self.component_dir + file_write_action,"a") as file:
+                with self.fragments.open(self.component_dir + file_write_action) as file:
                     file.write("    mark_to_drop(im);\n")
             else:
                 print("error-generate_switch_single_table what call",ins.func[int_ic].call_name)
                 exit()
-            with open(self.component_dir + file_write_action,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("}\n")
         
             int_ic = int_ic + 1
@@ -667,43 +806,26 @@ class Generator():
             values = action_par
             file_write_entry = file_write_o + "_entry.pne"
             if condition_case != "default" and condition_case in mapl_o:
-                with open(self.component_dir + file_write_entry,'a') as file:
-                    entry = mapl_o[condition_case].entry
-                    if len(entry) != 0:
-                        if len(keys) + len(values) != len(entry[0]):
+                with self.fragments.open(self.component_dir + file_write_entry) as file:
+                    entry = self.table_entry(mapl_o[condition_case])
+                    if entry_scanner.has_rows(entry):
+                        if len(keys) + len(values) != entry_scanner.width(entry):
                             print("error-generate_if_single_table key value entry")
                             print(keys)
                             print(values)
                             print(entry)
                             exit()
-                        for e in entry:
-                            ae = {}
-                            ae['table'] = table_name
-                            matchs = {}
-                            k_i = 0
-                            while k_i < len(keys):
-                                matchs[keys[k_i]] = [entry[e][k_i]]
-                                k_i = k_i + 1
-                            ae['match'] = matchs
-                            ae['action_name'] = action_name
-                            pa = {}
-                            zero = k_i
-                            while k_i < len(entry[e]):
-                                pa["value_" + str(k_i - zero)] = [entry[e][k_i]]
-                                k_i = k_i + 1
-                            ae['action_params'] = pa
-                            json.dump(ae,file)
-                            file.write("\n")
+                        self.generate_entry(file, table_name, action_name, keys, entry)
 
         
-        with open(self.component_dir + file_write_table,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_table) as file:
             file.write("    }\n")
             if default_action != '':
                 file.write("    default_action = " + default_action + "();\n")
             file.write("}\n")
 
         #在control中实际调用一下
-        with open(self.component_dir + file_write_control,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_control) as file:
             file.write(table_name)
             file.write(".apply();\n")
 
@@ -799,6 +921,18 @@ class Generator():
                 print("error-generate_condition check what")
                 exit()
             file_write_control = file_write_o + "_control.pne"
+
+            #同一个片段中前面已经查过同样的key，直接用前一次的命中变量
+            key_datas = [self.generate_data(key,var_list_o,if_generate="no") for key in condition.left]
+            check = ("check", id(table_data), tuple(data_name for data_name,_ in key_datas))
+            found = self.available.get(check, file_write_o)
+            if found is not None:
+                with self.fragments.open(self.component_dir + file_write_control) as file:
+                    for i in range(level_o):
+                        file.write("    ")
+                    file.write("if(" + found[0][0] + " == 1)\n")
+                self.available.counts["check"] = self.available.counts["check"] + 1
+                return
             file_write_table   = file_write_o + "_table.pne"
             file_write_action  = file_write_o + "_action.pne"
             file_write_tem     = file_write_o + "_tem.pne"
@@ -807,32 +941,24 @@ class Generator():
             #先构造一下table的名字
             """ table_name = prefix + "_" + condition.right[0].children[0].children[0].value + "_hit_table_" + str(self.table_id)
             self.table_id = self.table_id + 1 """
-            table_name = prefix + "_" + condition.right[0].children[0].children[0].value
-            if table_name not in self.table_name:
-                self.table_name[table_name] = 0
-            else:
-                self.table_name[table_name] = self.table_name[table_name] + 1
-                table_name = table_name + "_" + str(self.table_name[table_name])
+            table_name = symbols.text(symbols.join(prefix, condition.right[0].children[0].children[0].value))
+            table_name = self.generate_name("table", table_name)
             
             self.frag_relation_dict[file_write_o].table_num = self.frag_relation_dict[file_write_o].table_num + 1
 
             #构造一下目标变量，有hit到就是1，没有是0.这里采用变量方案而不是meta方案
             tem_name = table_name + "_data"
-            with open(self.component_dir + file_write_tem,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_tem) as file:
                 file.write("bit<1> " + tem_name + ";\n")
 
             #然后构造两个目标动作
             action_names = []
-            with open(self.component_dir + file_write_action,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("action ")
                 """ action_name = table_name + "_action_" + str(self.action_id)
                 self.action_id = self.action_id + 1  """
                 action_name = table_name + "_action"
-                if action_name not in self.action_name:
-                    self.action_name[action_name] = 0
-                else:
-                    self.action_name[action_name] = self.action_name[action_name] + 1
-                    action_name = action_name + "_" + str(self.action_name[action_name])
+                action_name = self.generate_name("action", action_name)
                 file.write(action_name)
                 file.write("()\n")
                 file.write("{\n")
@@ -840,16 +966,12 @@ class Generator():
                 file.write(tem_name)
                 file.write(" = 1;\n}\n")
                 action_names.append(action_name)
-            with open(self.component_dir + file_write_action,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("action ")
                 """ action_name = table_name + "_action_" + str(self.action_id)
                 self.action_id = self.action_id + 1  """
                 action_name = table_name + "_action"
-                if action_name not in self.action_name:
-                    self.action_name[action_name] = 0
-                else:
-                    self.action_name[action_name] = self.action_name[action_name] + 1
-                    action_name = action_name + "_" + str(self.action_name[action_name])
+                action_name = self.generate_name("action", action_name)
                 file.write(action_name)
                 file.write("()\n")
                 file.write("{\n")
@@ -859,96 +981,86 @@ class Generator():
                 action_names.append(action_name)
 
             #然后构造表
-            with open(self.component_dir + file_write_table,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("table ")
                 file.write(table_name) 
                 file.write("{\n")
             #构造表的key
-            with open(self.component_dir + file_write_table,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("    key = {\n")
             keys = []
             for key in condition.left:
-                with open(self.component_dir + file_write_table,'a') as file:
+                with self.fragments.open(self.component_dir + file_write_table) as file:
                     file.write("        ")
                 data_name,_ = self.generate_data(key,var_list_o, self.component_dir + file_write_table)
-                self.frag_relation_dict[file_write_o].input.append(data_name)
+                self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
                 keys.append(data_name)
-                with open(self.component_dir + file_write_table,'a') as file:
+                with self.fragments.open(self.component_dir + file_write_table) as file:
                     file.write(" : exact;\n")
-            with open(self.component_dir + file_write_table,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("    }\n")
 
             #构造表的action
-            with open(self.component_dir + file_write_table,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("    actions = {\n")
             for action_name in action_names:
-                with open(self.component_dir + file_write_table,'a') as file:
+                with self.fragments.open(self.component_dir + file_write_table) as file:
                     file.write("        " + action_name + ";\n")
-            with open(self.component_dir + file_write_table,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("    }\n")
             #构造表的default
-            with open(self.component_dir + file_write_table,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("    default_action = " + action_names[-1] + "();\n}\n")
             
             #构造entry，hit到了为1
-            with open(self.component_dir + file_write_entry,'a') as file:
-                entry = table_data.entry
-                if len(entry) != 0:
-                    for e in entry:
-                        ae = {}
-                        ae['table'] = table_name
-                        matchs = {}
-                        k_i = 0
-                        while k_i < len(keys):
-                            matchs[keys[k_i]] = [entry[e][k_i]]
-                            k_i = k_i + 1
-                        ae['match'] = matchs
-                        ae['action_name'] = action_name
-                        pa = {}
-                        ae['action_params'] = pa
-                        json.dump(ae,file)
-                        file.write("\n")
+            with self.fragments.open(self.component_dir + file_write_entry) as file:
+                entry = self.table_entry(table_data)
+                if entry_scanner.has_rows(entry):
+                    self.generate_entry(file, table_name, action_name, keys, entry, with_params=False)
 
             #在control中调用这个table
-            with open(self.component_dir + file_write_control,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write(table_name + ".apply();\n")
 
             #写入if
-            with open(self.component_dir + file_write_control,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("if(" + tem_name + " == 1)\n")
+            self.available.wrote(tem_name)
+            self.available.add(check, file_write_o, key_datas, [(tem_name,"var")])
         elif condition.type in self.compare_type:
             #比较型的condition
             file_write_control = file_write_o + "_control.pne"
-            with open(self.component_dir + file_write_control,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("if(")
             data_name,data_type = self.generate_data(condition.left[0],var_list_o,file_write_o=self.component_dir+file_write_control)
             if data_type == "hdr" or data_type == "pkt" or data_type == "var":
-                self.frag_relation_dict[file_write_o].input.append(data_name)
-            with open(self.component_dir + file_write_control,'a') as file:
+                self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 file.write(self.compare_type[condition.type])
             data_name,data_type = self.generate_data(condition.right[0],var_list_o,file_write_o=self.component_dir+file_write_control)
             if data_type == "hdr" or data_type == "pkt" or data_type == "var":
-                self.frag_relation_dict[file_write_o].input.append(data_name)
-            with open(self.component_dir + file_write_control,'a') as file:
+                self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 file.write(")\n")
         elif condition.type == "isvalid":
             #isvalid型的condition
             file_write_control = file_write_o + "_control.pne"
-            with open(self.component_dir + file_write_control,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 file.write("if(")
             #这里需要一个语义检查来保障
             hdr  = condition.left[0].children[0].children[0].value
             hdrr = condition.left[0].children[0].children[1].value
-            self.frag_relation_dict[file_write_o].input.append(hdr+"."+hdrr)
-            with open(self.component_dir + file_write_control,'a') as file:
-                file.write(hdr+"."+hdrr)
-            with open(self.component_dir + file_write_control,'a') as file:
+            hdr_id = symbols.join(hdr, hdrr, ".")
+            self.frag_relation_dict[file_write_o].input.append(hdr_id)
+            with self.fragments.open(self.component_dir + file_write_control) as file:
+                file.write(symbols.text(hdr_id))
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 file.write(".isValid())\n")
         else:
             print("generate_condition error function 1")
@@ -973,42 +1085,48 @@ class Generator():
         #展开条件
         self.generate_condition(condition,modules,var_list_o,prefix,level_o,tuple_o,mapl_o,setl_o,func_o,reg_o,file_write_o=file_write_o)
         #展开代码块
-        with open(self.component_dir + file_write_control,'a') as file:
+        with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("{\n")
+        self.available.push()
         self.generate_ins_all(ins.condition_block[0].ins,modules,var_list_o,prefix,level_o + 1,tuple_o,mapl_o,setl_o,func_o,reg_o,can_cut="no",file_write_o=file_write_o)
-        with open(self.component_dir + file_write_control,'a') as file:
+        self.available.pop()
+        with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("}\n")
 
         #展开else if
         if ins.else_ins_t == 1:
-            with open(self.component_dir + file_write_control,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("else\n")
                 for i in range(level_o):
                     file.write("    ")
                 file.write("{\n")
+            self.available.push()
             self.generate_if_big_if(ins.else_ins,modules,var_list_o,prefix,level_o + 1,tuple_o,mapl_o,setl_o,func_o,reg_o,file_write_o=file_write_o)
-            with open(self.component_dir + file_write_control,'a') as file:
+            self.available.pop()
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("}\n")
 
         #展开else
         if ins.default == 1:
-            with open(self.component_dir + file_write_control,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("else\n")
                 for i in range(level_o):
                     file.write("    ")
                 file.write("{\n")
+            self.available.push()
             self.generate_ins_all(ins.default_bolck.ins,modules,var_list_o,prefix,level_o + 1,tuple_o,mapl_o,setl_o,func_o,reg_o,can_cut="no",file_write_o=file_write_o)
-            with open(self.component_dir + file_write_control,'a') as file:
+            self.available.pop()
+            with self.fragments.open(self.component_dir + file_write_control) as file:
                 for i in range(level_o):
                     file.write("    ")
                 file.write("}\n")
@@ -1025,27 +1143,27 @@ class Generator():
         else:
             file_write = self.component_dir + file_write_o + "_control.pne"
         
-        with open(file_write,'a') as file:
+        with self.fragments.open(file_write) as file:
             for i in range(level_o):
                 file.write("    ")
 
         #先生成左值
         data_name,_ = self.generate_data(ins.left[0],var_list_o,file_write)
-        self.frag_relation_dict[file_write_o].output.append(data_name)
+        self.generate_output(file_write_o, data_name)
         #然后是赋值
-        with open(file_write,"a") as file:
+        with self.fragments.open(file_write) as file:
             file.write(" = ")
         #然后右边
         data_name,data_type = self.generate_data(ins.right1,var_list_o,file_write)
         if data_type == "hdr" or data_type == "var":
-            self.frag_relation_dict[file_write_o].input.append(data_name)
-        with open(file_write,"a") as file:
+            self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
+        with self.fragments.open(file_write) as file:
             file.write(" " + ins.op + " ")
         data_name,data_type = self.generate_data(ins.right2,var_list_o,file_write)
         if data_type == "hdr" or data_type == "var":
-            self.frag_relation_dict[file_write_o].input.append(data_name)
+            self.frag_relation_dict[file_write_o].input.append(symbols.intern(data_name))
         #换行
-        with open(file_write,"a") as file:
+        with self.fragments.open(file_write) as file:
             file.write(";\n")
 
     #把if按照单表展开
@@ -1072,18 +1190,14 @@ class Generator():
         first_condition = ins.condition[0]
         """ table_name = prefix + "_" + first_condition.right[0].children[0].children[0].value + "_" + str(self.table_id)
         self.table_id = self.table_id + 1 """
-        table_name = prefix + "_" + first_condition.right[0].children[0].children[0].value
-        if table_name not in self.table_name:
-            self.table_name[table_name] = 0
-        else:
-            self.table_name[table_name] = self.table_name[table_name] + 1
-            table_name = table_name + "_" + str(self.table_name[table_name])
+        table_name = symbols.text(symbols.join(prefix, first_condition.right[0].children[0].children[0].value))
+        table_name = self.generate_name("table", table_name)
         keys = []
         for key in first_condition.left:
             #这里key在生成的时候会有隐性bug，因为变量的链式提取，到了根部可能会是个常量
             key_name,_ = self.generate_data(key,var_list_o,if_generate="no")
             keys.append(key_name)
-        with open(self.component_dir + file_write_table,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_table) as file:
             file.write("table " + table_name + "{\n")
             file.write("    key = {\n")
             for key in keys:
@@ -1092,10 +1206,10 @@ class Generator():
 
         #key列表应该是每个frag的input
         for key in keys:
-            self.frag_relation_dict[file_write_o].input.append(key)
+            self.frag_relation_dict[file_write_o].input.append(symbols.intern(key))
 
         #开始逐个生成action
-        with open(self.component_dir + file_write_table,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_table) as file:
             file.write("    actions = {\n")
         action_till = 1
         ins_i = ins
@@ -1103,16 +1217,12 @@ class Generator():
             """ action_name = table_name + "_action_" + str(self.action_id)
             self.action_id = self.action_id + 1 """
             action_name = table_name + "_action"
-            if action_name not in self.action_name:
-                self.action_name[action_name] = 0
-            else:
-                self.action_name[action_name] = self.action_name[action_name] + 1
-                action_name = action_name + "_" + str(self.action_name[action_name])
-            with open(self.component_dir + file_write_table,"a") as file:
+            action_name = self.generate_name("action", action_name)
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("        " + action_name + ";\n")
             #向action里边构造内容
             #先打变量
-            with open(self.component_dir + file_write_action,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("action " + action_name + "(")
                 #action的参数，直接取用条件里面这个map的参数，但是其实有可能是set
                 map_name = ins_i.condition[0].right[0].children[0].children[0].value
@@ -1132,42 +1242,25 @@ class Generator():
                 file.write(")\n{\n")
             #然后打指令
             self.generate_ins_all(ins_i.condition_block[0].ins,modules,var_list_o,prefix,1,tuple_o,mapl_o,setl_o,func_o,reg_o,can_cut="no",file_write_o=file_write,if_action="yes")
-            with open(self.component_dir + file_write_action,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("}\n")
 
             #构造entry
             values = map_value
             file_write_entry = file_write_o + "_entry.pne"
-            with open(self.component_dir + file_write_entry,'a') as file:
+            with self.fragments.open(self.component_dir + file_write_entry) as file:
                 if map_name in mapl_o:
-                    entry = mapl_o[map_name].entry
+                    entry = self.table_entry(mapl_o[map_name])
                 else:
-                    entry = setl_o[map_name].entry
-                if len(entry) != 0:
-                    if len(keys) + len(values) != len(entry[0]):
+                    entry = self.table_entry(setl_o[map_name])
+                if entry_scanner.has_rows(entry):
+                    if len(keys) + len(values) != entry_scanner.width(entry):
                         print("error-generate_if_single_table key value entry")
                         print(keys)
                         print(values)
                         print(entry)
                         exit()
-                    for e in entry:
-                        ae = {}
-                        ae['table'] = table_name
-                        matchs = {}
-                        k_i = 0
-                        while k_i < len(keys):
-                            matchs[keys[k_i]] = [entry[e][k_i]]
-                            k_i = k_i + 1
-                        ae['match'] = matchs
-                        ae['action_name'] = action_name
-                        pa = {}
-                        zero = k_i
-                        while k_i < len(entry[e]):
-                            pa["value_" + str(k_i - zero)] = [entry[e][k_i]]
-                            k_i = k_i + 1
-                        ae['action_params'] = pa
-                        json.dump(ae,file)
-                        file.write("\n")
+                    self.generate_entry(file, table_name, action_name, keys, entry)
 
 
             #循环终止条件，其实这是写了个do while 5555555555555
@@ -1181,32 +1274,28 @@ class Generator():
             """ action_name = table_name + "_action_" + str(self.action_id)
             self.action_id = self.action_id + 1 """
             action_name = table_name + "_action"
-            if action_name not in self.action_name:
-                self.action_name[action_name] = 0
-            else:
-                self.action_name[action_name] = self.action_name[action_name] + 1
-                action_name = action_name + "_" + str(self.action_name[action_name])
-            with open(self.component_dir + file_write_table,"a") as file:
+            action_name = self.generate_name("action", action_name)
+            with self.fragments.open(self.component_dir + file_write_table) as file:
                 file.write("        " + action_name + ";\n")
             #向action里边构造内容
             #先打变量
-            with open(self.component_dir + file_write_action,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("action " + action_name + "(")
                 #default action不会有参数
                 file.write(")\n{\n")
             #然后打指令
             self.generate_ins_all(ins_i.default_bolck.ins,modules,var_list_o,prefix,1,tuple_o,mapl_o,setl_o,func_o,reg_o,can_cut="no",file_write_o=file_write,if_action="yes")
-            with open(self.component_dir + file_write_action,"a") as file:
+            with self.fragments.open(self.component_dir + file_write_action) as file:
                 file.write("}\n")
 
-        with open(self.component_dir + file_write_table,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_table) as file:
             file.write("    }\n")
             if ins_i.default == 1:
                 file.write("    default_action = " + action_name + "();\n")
             file.write("}\n")
         
         #在control调用table
-        with open(self.component_dir + file_write_control,"a") as file:
+        with self.fragments.open(self.component_dir + file_write_control) as file:
             for i in range(level_o):
                 file.write("    ")
             file.write(table_name + ".apply();\n")
@@ -1233,7 +1322,43 @@ class Generator():
         if  len(module.call_par) != len(ins.call_par):
             print("error-generate_module error call")
             exit()
-        prefix = prefix_o + "_" + ins.call_name
+        prefix = symbols.text(symbols.join(prefix_o, ins.call_name))
+        #同样形式的展开已经记下来时改名重放；第一次出现时只占个位置，多数module只调起一次，不值得记录
+        bindings = [self.generate_data(par, var_list_o, if_generate='no') for par in ins.call_par]
+        key, names = expansion.signature(module, level_o, bindings)
+        if key not in self.expansions:
+            self.expansions[key] = None
+            self.generate_module_body(ins, module, modules, prefix, var_list_o, level_o, file_write_o)
+            return
+        if self.expansions[key] is not None and self.generate_replay(self.expansions[key], prefix, names, file_write_o):
+            return
+        relation = self.frag_relation_dict[file_write_o]
+        before = (len(relation.input), len(relation.output), len(relation.varfile), relation.table_num,
+                  dict(relation.module), dict(self.available.counts), len(self.frag_relation_dict))
+        start = self.record_start()
+        self.generate_module_body(ins, module, modules, prefix, var_list_o, level_o, file_write_o)
+        events = self.record_stop(start)
+        if len(self.frag_relation_dict) != before[6]:
+            return
+        record = expansion.Expansion(prefix, file_write_o, names, events)
+        record.input = relation.input[before[0]:]
+        record.output = relation.output[before[1]:]
+        record.varfile = relation.varfile[before[2]:]
+        record.table_num = relation.table_num - before[3]
+        record.modules = [name for name in relation.module if name not in before[4]]
+        record.counts = {kind: self.available.counts[kind] - before[5][kind] for kind in before[5]}
+        if record.cacheable():
+            self.expansions[key] = record
+
+    #module的实际展开：参数、变量和指令序列
+    def generate_module_body(self, ins:data_structure.LYNETTE_INS,
+                        module:data_structure.LYNETTE_MODULE,
+                        modules:dict,
+                        prefix:str,
+                        var_list_o:dict,#上层可用变量列表
+                        level_o:int,#当前缩进等级
+                        file_write_o:str #往啥片段放
+                        ):
         #处理一下参数的问题
         par_len = len(module.call_par)
         var_list = {}
@@ -1250,23 +1375,24 @@ class Generator():
                 data_name,_ = self.generate_data(ins.call_par[par_i],var_list_o,if_generate='no')
 
                 #新建一个变量出来
-                var_name = prefix + "_" + module.call_par[par_i]
+                var_name = symbols.text(symbols.join(prefix, module.call_par[par_i]))
                 var_type = module.call_par_type[par_i]
                 if var_type in self.type_dict:
                     var_type = self.type_dict[var_type]
 
                 #在var文件中注册一个
-                with open(self.component_dir + prefix + "_var.pne","a") as file:
+                with self.fragments.open(self.component_dir + prefix + "_var.pne") as file:
                     file.write(var_type + " " + var_name + ";\n")
 
                 #在control中赋值
-                with open(self.component_dir + file_write_o + "_control.pne","a") as file:
+                with self.fragments.open(self.component_dir + file_write_o + "_control.pne") as file:
                     for i in range(level_o):
                         file.write("    ")
                         file.write(var_name)
                         file.write(" = ")
                         file.write(data_name)
                         file.write(";\n")
+                self.available.wrote(var_name)
 
                 var_list[module.call_par[par_i]] = var_name
             else:
@@ -1279,9 +1405,81 @@ class Generator():
         #然后根据指令序列开始生成构造
         self.generate_ins_all(module.ins,modules,var_list,prefix,level_o,module.tuple,module.mapl,module.setl,module.func,module.reg,can_cut="no",file_write_o=file_write_o)
 
+    #开始记录一次展开，可以嵌套，返回这次展开的事件从哪里开始
+    def record_start(self):
+        if self.recording == 0:
+            self.events = []
+            self.fragments.log = self.events
+            self.available.log = self.events
+        self.recording = self.recording + 1
+        return len(self.events)
+
+    #结束记录，返回这次展开的事件
+    def record_stop(self, start:int):
+        events = self.events[start:]
+        self.recording = self.recording - 1
+        if self.recording == 0:
+            self.events = None
+            self.fragments.log = None
+            self.available.log = None
+        return events
+
+    #把记下来的module展开改名后重放，当前位置的名字或可复用结果和记录时不一致时返回False，由调用方重新展开
+    def generate_replay(self, record:expansion.Expansion, prefix:str, names:list, file_write_o:str):
+        renamer = expansion.Renamer(record, prefix, names, file_write_o)
+        added = set()
+        for event in record.events:
+            if event[0] == "name":
+                if renamer.text(event[2]) in (self.table_name if event[1] == "table" else self.action_name):
+                    return False
+            elif event[0] == "var":
+                if renamer.text(event[1]) in self.var_dict:
+                    return False
+            elif event[0] == "add":
+                added.add(event[1])
+            elif event[0] == "clear":
+                break
+            elif event[0] == "get" and event[1] not in added:
+                if self.available.find(renamer.key(event[1]), file_write_o) is not None:
+                    return False
+        for name in record.writes:
+            with self.fragments.open(self.component_dir + renamer.stream(name)) as file:
+                file.write(renamer.text(record.writes[name]))
+        for name in record.spans:
+            with self.fragments.open(self.component_dir + renamer.stream(name)) as file:
+                self.fragments.copy(name, record.spans[name], file, renamer.text)
+        for event in record.events:
+            if event[0] == "name":
+                self.generate_name(event[1], renamer.text(event[2]))
+            elif event[0] == "var":
+                self.generate_var({}, {}, renamer.text(event[1]))
+            elif event[0] == "wrote":
+                self.available.wrote(renamer.text(event[1]))
+            elif event[0] == "add":
+                self.available.add(renamer.key(event[1]), file_write_o, renamer.datas(event[2]), renamer.datas(event[3]), event[4])
+            elif event[0] == "get":
+                self.available.get(renamer.key(event[1]), file_write_o)
+            elif event[0] == "push":
+                self.available.push()
+            elif event[0] == "pop":
+                self.available.pop()
+            elif event[0] == "clear":
+                self.available.clear()
+        relation = self.frag_relation_dict[file_write_o]
+        relation.input.extend(renamer.symbol(sid) for sid in record.input)
+        relation.output.extend(renamer.symbol(sid) for sid in record.output)
+        relation.varfile.extend(renamer.text(name) for name in record.varfile)
+        relation.table_num = relation.table_num + record.table_num
+        for name in record.modules:
+            relation.module[name] = 1
+        for kind in record.counts:
+            self.available.counts[kind] = self.available.counts[kind] + record.counts[kind]
+        return True
+
     #展开app
     def generate_app(self, app:data_structure.LYNETTE_APP,modules:dict,prefix:str):
         var_list = {}
+        self.available.app = prefix
         #别管干啥先把变量生成出来。注意是变量，不是meta
         self.generate_var(app.var,var_list,prefix)
         #然后根据指令序列开始生成构造
@@ -1294,17 +1492,108 @@ class Generator():
         with open(path + "//log_out//log.txt","a") as file:
             file.write('generate...\n')
         self.generate_all_clear()
-        self.type_dict = self.construct_type_dict_global()
-        for service_name_i in services:
-            service = services[service_name_i]
-            for app_name_i in service.application:
-                if app_name_i[:4] == "host":
-                    service.application.pop(service.application.index(app_name_i))
-                    continue
-                self.generate_app(applications[app_name_i],modules,service_name_i + "_" + app_name_i)
+        if self.define_table is None:
+            self.define_table = defines.load(path)
+        self.type_dict = self.define_table.types
+        self.bind_entry_files(modules)
+        units = [(service_name_i, self.service_apps(services[service_name_i])) for service_name_i in services]
+        if self.jobs > 1 and len(units) > 1:
+            #每个服务交给进程池独立生成，按服务顺序合并，和已经合并的名字冲突时在主进程中重新生成
+            init = (self.sys_path, self.entry_files, self.define_table, applications, modules, self.fragments.spill_directory())
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(units)), initializer=_unit_init, initargs=init) as executor:
+                for (service_name_i, apps), unit in zip(units, executor.map(_unit_worker, units)):
+                    if not self.merge_unit(unit):
+                        self.generate_service(service_name_i, apps, applications, modules)
+        else:
+            for service_name_i, apps in units:
+                self.generate_service(service_name_i, apps, applications, modules)
+        counts = self.available.counts
+        with open(path + "//log_out//log.txt","a") as file:
+            file.write("cse: " + str(counts["lookup"]) + " lookups, " + str(counts["check"]) + " checks, " + str(counts["store"]) + " assignments reused\n")
         return self.frag_relation_dict
     
 
+    #服务中要生成的app，host开头的是主机，从服务中去掉
+    def service_apps(self, service:data_structure.LYNETTE_SERVICE):
+        apps = []
+        for app_name_i in service.application:
+            if app_name_i[:4] == "host":
+                service.application.pop(service.application.index(app_name_i))
+                continue
+            apps.append(app_name_i)
+        return apps
+
+    #展开一个服务中的所有app
+    def generate_service(self, service_name:str, apps:list, applications:dict, modules:dict):
+        #可复用的结果只在一个服务内有效
+        self.available.reset()
+        for app_name_i in apps:
+            self.generate_app(applications[app_name_i],modules,service_name + "_" + app_name_i)
+
+    #在进程池中独立生成一个服务，从空的名字表、片段开始，返回可以跨进程传递的结果
+    #片段关系中的符号ID只在当前进程内有效，换成名字
+    #表项片段写在主进程的表项目录（spill_directory）下，只传回文件路径
+    def generate_unit(self, service_name:str, apps:list, applications:dict, modules:dict, spill_directory:str=None):
+        self.frag_relation_dict = {}
+        self.table_name = {}
+        self.action_name = {}
+        self.var_dict = {}
+        self.fragments = fragments.FragmentStore(spill_directory)
+        self.available = cse.Available()
+        #记下的展开引用的是上一个服务的片段，操作数按IR节点的id记忆，同一进程生成下一个服务前都清掉
+        self.expansions = {}
+        self.operands = {}
+        self.generate_service(service_name, apps, applications, modules)
+        relations = {}
+        for name, relation in self.frag_relation_dict.items():
+            if isinstance(relation, data_structure.LYNETTE_FRAG_RELATION):
+                relation = (relation.name, [symbols.text(sid) for sid in relation.input], [symbols.text(sid) for sid in relation.output],
+                            relation.varfile, relation.module, relation.table_num)
+            relations[name] = relation
+        return {"streams": {name: self.fragments.read(name) for name in self.fragments.streams},
+                "files": self.fragments.detach(),
+                "relations": relations,
+                "table_name": self.table_name,
+                "action_name": self.action_name,
+                "var_dict": list(self.var_dict),
+                "counts": self.available.counts}
+
+    #按顺序合并一个服务的生成结果
+    #名字、命名域、片段已经被前面的服务占用时，串行生成会加上_1之类的后缀或者共用命名域，不合并，返回False由调用方重新生成
+    def merge_unit(self, unit:dict):
+        if any(name in self.table_name for name in unit["table_name"]) \
+                or any(name in self.action_name for name in unit["action_name"]) \
+                or any(prefix in self.var_dict for prefix in unit["var_dict"]) \
+                or any(name in self.frag_relation_dict for name in unit["relations"]) \
+                or any(name in self.fragments for name in unit["streams"]) \
+                or any(name in self.fragments for name in unit["files"]):
+            for file_path, _ in unit["files"].values():
+                fragments.discard(file_path)
+            return False
+        self.table_name.update(unit["table_name"])
+        self.action_name.update(unit["action_name"])
+        for prefix in unit["var_dict"]:
+            self.var_dict[prefix] = {}
+        for name, text in unit["streams"].items():
+            with self.fragments.open(self.component_dir + name) as file:
+                file.write(text)
+        for name, (file_path, size) in unit["files"].items():
+            self.fragments.adopt(name, file_path, size)
+        for name, relation in unit["relations"].items():
+            if isinstance(relation, tuple):
+                relation_name, input, output, varfile, module, table_num = relation
+                relation = data_structure.LYNETTE_FRAG_RELATION()
+                relation.name = relation_name
+                relation.input = [symbols.intern(data_name) for data_name in input]
+                relation.output = [symbols.intern(data_name) for data_name in output]
+                relation.varfile = varfile
+                relation.module = module
+                relation.table_num = table_num
+            self.frag_relation_dict[name] = relation
+        for kind in unit["counts"]:
+            self.available.counts[kind] = self.available.counts[kind] + unit["counts"][kind]
+        return True
+
     #重置一下组件
     def generate_all_clear(self):
         pass
@@ -1320,31 +1609,30 @@ class Generator():
                 # 如果是文件则直接删除
                 os.remove(file_path) """
 
-    #这是构建define列表
-    #其实预编译应该扔出去做
-    def construct_type_dict_global(self):
-        self.type_dict = {}
-        parser = Lark(grammar_define)
-        with open('include//define.pne','r') as file:
-            code = file.read()
-            tree = parser.parse(code)
-            for define_t in tree.children:
-                if define_t.data == "type_define":
-                    self.type_dict[define_t.children[1].value] = define_t.children[0].value
-                elif define_t.data == "const_define":
-                    name = define_t.children[1]
-                    value = define_t.children[2]
-                    self.const_dict[name.children[0].children[0].value] = value.children[0].children[0].value
-                else:
-                    print("666565",define_t.data)
-                    exit()
-                self.type_dict['bool'] = 'bit<1>'
-        return self.type_dict
-
     #这函数把dict复制一遍
     #别跟我扯有库函数，我更信任我自己写的
     def copy_dict_for_no_struct(self, dict_o:dict):
         dict = {}
         for name in dict_o:
             dict[name] = dict_o[name]
-        return dict
\ No newline at end of file
+        return dict
+
+
+#进程池中每个进程的Generator和IR，由_unit_init建立
+_unit = None
+
+
+def _unit_init(sys_path, entry_files, define_table, applications, modules, spill_directory):
+    """进程池的初始化，每个进程只传一次IR。"""
+    global _unit
+    generator = Generator(sys_path=sys_path, entry_files=entry_files, define_table=define_table)
+    generator.type_dict = define_table.types
+    generator.bind_entry_files(modules)
+    _unit = (generator, applications, modules, spill_directory)
+
+
+def _unit_worker(item):
+    """进程池中执行的生成任务，item为 (服务名, app列表)。"""
+    service_name, apps = item
+    generator, applications, modules, spill_directory = _unit
+    return generator.generate_unit(service_name, apps, applications, modules, spill_directory)
@@ -156,8 +156,8 @@ grammar = """
     // 赋值左侧：可以是单个变量或多个变量的元组
     ins_assign_left : data ("," data)*
     
-    // 赋值右侧：表达式或值
-    ins_assign_right : expression
+    // 赋值右侧：表达式或值，或者位运算表达式
+    ins_assign_right : expression | bitwise_expr
     
     // 表/模块调用：格式 TableName.apply([params]);
     // 调用P4表或模块，对应P4的table.apply()或control.apply()
@@ -297,13 +297,11 @@ grammar = """
     // 支持固定大小的表（通过[size]指定），可以预定义表项
     map: "map" "<" map_key "," map_value ">" ("[" map_len "]")? map_name entry?";"
     
-    // 表项定义：格式 { entry1; entry2; ... }
+    // 表项定义：格式 { (key1, key2, ...); (key1, key2, ...); ... }
     // 定义表的初始表项，对应P4的table entries
-    entry: "{" (single_entry (single_entry)*)? "}"
-    
-    // 单个表项：格式 (key1, key2, ...);
-    // 定义表的一个条目，键值用逗号分隔
-    single_entry: "(" (data ("," data)*)? ")" ";"
+    // 表项可能有上万条，整块作为一个终结符捕获，由entry_scanner按列批量解析
+    entry: ENTRY_BLOCK
+    ENTRY_BLOCK: /\\{(\\s*\\([^(){};]*\\)\\s*;)*\\s*\\}/
     
     // 映射表名称：标识符
     map_name: NAME
@@ -437,19 +435,24 @@ grammar = """
     
     // 表达式：支持算术、位运算、括号等
     // 对应P4的表达式，支持多种运算符
-    expression: term (("+"|"-") term)*
+    // 运算符都是具名终结符，保留在语法树中，常量折叠（fold.py）和生成代码时要用到
+    expression: term (ADD_OP term)*
+    ADD_OP: "+" | "-"
     
     // 项：乘除运算的优先级高于加减
-    term: factor (("*"|"/"|"%") factor)*
+    term: factor (MUL_OP factor)*
+    MUL_OP: "*" | "/" | "%"
     
     // 因子：基本数据或括号表达式
     factor: data | "(" expression ")" | unary_op factor
     
     // 一元运算符：正负号、位取反、逻辑非
-    unary_op: "+" | "-" | "~" | "!"
+    unary_op: UNARY_OP
+    UNARY_OP: "+" | "-" | "~" | "!"
     
     // 位运算表达式：格式 left OP right
-    // 支持位与、位或、位异或、左移、右移
+    // 支持位与、位或、位异或、左移、右移，优先级和P4相同（移位 > & > ^ > |）
+    // 操作数只能是data，算术表达式需要加括号，例如 (a + 1) & 0xFF
     bitwise_expr: data (BITWISE_OP data)+
     
     // 位运算符：&, |, ^, <<, >>
@@ -0,0 +1,200 @@
+"""
+PNE 语言的 LALR(1) 版本语法
+
+grammar.py 中的主语法是写给 Earley 用的，里面有不少二义性（例如 "(" expression ")"
+同时出现在 data 和 factor 里、&& 和 || 没有结合性、DATA_TYPE 和 NAME 两个终结符
+完全重叠），Earley 靠动态词法和二义性消解可以解析，但 LALR 不行。
+
+这里按照 Earley 对这些二义性的实际选择改写了规则，保证两个后端在合法输入上
+得到完全相同的语法树：
+- start 中的 include 和 code 不再是可选的（两者本身都可以为空，Earley 也总是生成它们）；
+- ins_cul 不出现在 instruction 中：Earley 总是优先把 a = b + c 解析成 ins_assign；
+- 括号表达式只走 data 这条路径，factor 不再重复定义 "(" expression ")"；
+- && 和 || 同优先级、左结合，! 只作用在整个条件的最外层；
+- DATA_TYPE 改为规则层面的 NAME|BIT_TYPE，解析后由 RetagDataType 把 token 类型改回 DATA_TYPE；
+- BIT_TYPE、IP、IPS、OX_NUM 等终结符加了优先级，避免被 NAME/INT 抢先匹配；
+- 数组下标里的 _ 和 Earley 一样解析为 sys_data，不再有 index_null。
+
+规则的含义和注释见 grammar.py，这里只保留和 Earley 版本有差异的说明。
+"""
+
+from lark import Transformer, Tree, Token
+
+grammar_lalr = """
+    start: include usingparser? code
+
+    include: (include_sys_file|include_sys_domain|include_user_file|include_user_domain|annotation)*
+    include_sys_file: ("#include" "<" NAME("/"NAME)*".pne" ">")
+    include_sys_domain: "#include" "<" NAME ".domain" ">"
+    include_user_file: ("#include" ">-<" NAME("/"NAME)* ".pne" ">-<")
+    include_user_domain: "#include" ">-<" NAME("/"NAME)* ".domain" ">-<"
+
+    usingparser: "using" NAME ";"
+
+    code: (service|application|module)*
+    service: "service[" NAME "]" "{" ser_app "}"
+    ser_app: NAME ("->" NAME)*
+    application: "application" NAME ("using" NAME)?  "{" code_body "}"
+    module: "module" module_name "(" module_pars? ")" module_parser? "{" parser? control "}"
+    module_name : NAME
+    module_parser: ("using" NAME)
+    module_pars : module_par ("," module_par)*
+    module_par : NAME _data_type data
+
+    parser: "parser" "{" (data ";")* "}"
+    control: "control" "{" code_body "}"
+    code_body: (instruction)*
+
+    // 和Earley版本不同：没有ins_cul，见文件头说明
+    instruction: ins_assign|ins_call|if|assert|define|switch|primitive|annotation|ins_null|for_loop|while_loop
+    annotation: "/*" (instruction|include_sys_file|include_sys_domain|include_user_file|include_user_domain)* "*/"
+
+    ins_define_var: _data_type NAME ";"
+    ins_assign: ins_assign_left "=" ins_assign_right ";"
+    ins_assign_left : data ("," data)*
+    ins_assign_right : expression | bitwise_expr
+    ins_call: NAME ".apply" "("  ins_call_par? ")" ";"
+    ins_call_par:((data) (","(data))*)
+    ins_null: ";"
+
+    func : "func" NAME "(" func_params? ")" "{" code_body "}"
+    func_params: func_param ("," func_param)*
+    func_param: _data_type NAME
+
+    primitive: sendtocpu|nop|drop|removeheader|addheader|return|updatechecksum|headercompress
+    sendtocpu: "sendToCPU" "(" ")" ";"
+    nop: "nop" "(" ")" ";"
+    drop: "drop" "(" ")" ";"
+    removeheader: "removeHeader" "(" data ")" ";"
+    headercompress: "HeaderCompress" "(" data ")" ";"
+    addheader: "addHeader" "(" data ")" ";"
+    return: "return" "(" ")" ";"
+    updatechecksum: "updateChecksum" "(" data ("," data)* ")" ";"
+
+    switch: "switch" "(" switch_key ")" "{" switch_item* "}"
+    switch_key : data ("," data)*
+    switch_item: data ":" (func_call|ins_call)
+    func_call: NAME "(" func_call_par? ")" ";"
+    func_call_par: ((data) (","(data))*)
+
+    define: tuple|set|map|ins_define_var|func|reg
+    reg: "static" _data_type NAME ( "[" INT "]" )? ";"
+    tuple: "tuple" NAME "{" tuple_data "}"
+    tuple_data: data ("," data)*
+    set: "set" "<" set_key ">" set_name entry?";"
+    set_key: (BIT_TYPE|NAME) ("," (BIT_TYPE|NAME))*
+    set_name: NAME
+    map: "map" "<" map_key "," map_value ">" ("[" map_len "]")? map_name entry?";"
+    entry: ENTRY_BLOCK
+    ENTRY_BLOCK: /\\{(\\s*\\([^(){};]*\\)\\s*;)*\\s*\\}/
+    map_name: NAME
+    map_key: (BIT_TYPE|NAME) | ("<" (BIT_TYPE|NAME) ("," (BIT_TYPE|NAME))* ">")
+    map_value: (BIT_TYPE|NAME) | ("<" (BIT_TYPE|NAME) ("," (BIT_TYPE|NAME))* ">")
+    map_len: int
+
+    assert: "assert" "(" condition ")" ";"
+
+    if: "if" "(" if_block "}" else_block?
+    if_block: condition ")" "{" code_body
+    else_block: "else" (if|else)
+    else: "{" code_body "}"
+
+    for_loop: "for" "(" for_init? ";" for_condition? ";" for_update? ")" "{" code_body "}"
+    for_init: ins_define_var | ins_assign
+    for_condition: condition
+    for_update: ins_assign | ins_call
+    while_loop: "while" "(" condition ")" "{" code_body "}"
+
+    // 条件：! 只出现在最外层；逻辑运算左结合，左操作数可以是逻辑链，右操作数只能是单个条件
+    not: "!"
+    condition: (not)? (compare | check | isvalid | logical)
+    logical: logical_and | logical_or
+    logical_and: logical_left "&&" logical_right
+    logical_or: logical_left "||" logical_right
+    logical_left: compare -> condition
+                | check -> condition
+                | isvalid -> condition
+                | logical -> condition
+    logical_right: (not)? compare -> condition
+                 | (not)? check -> condition
+                 | (not)? isvalid -> condition
+
+    compare: compare_e | compare_ne | compare_b | compare_be | compare_s | compare_se
+    compare_e: (data) "==" (data)
+    compare_ne: (data) "!=" (data)
+    compare_b: (data) ">" (data)
+    compare_be: (data) ">=" (data)
+    compare_s: (data) "<" (data)
+    compare_se: (data) "<=" (data)
+    check: check_left "in" check_right
+    check_left: data ("," data)*
+    check_right: data
+    isvalid: (data ".isValid()")|(_ISVALID data ("," data)* ")")
+    _ISVALID.3: "isValid("
+
+    // 表达式：括号只走data这一条路径
+    expression: term (ADD_OP term)*
+    ADD_OP: "+" | "-"
+    term: factor (MUL_OP factor)*
+    MUL_OP: "*" | "/" | "%"
+    factor: data | unary_op factor
+    unary_op: UNARY_OP
+    UNARY_OP: "+" | "-" | "~" | "!"
+    bitwise_expr: data (BITWISE_OP data)+
+    BITWISE_OP: "&" | "|" | "^" | "<<" | ">>"
+
+    data: name_field | int | name | array | sys_data | ip_data | ox_num | "(" expression ")"
+    ip_data : IP | IPS
+    IP.2 : INT"."INT"."INT"."INT
+    IPS.2: INT":"INT":"INT":"INT":"INT":"INT":"INT":"INT
+    name_field: NAME "." NAME ("." NAME)?
+    int : INT
+    sys_data : SYS_DATA
+    SYS_DATA : "_" (LCASE_LETTER|UCASE_LETTER|DIGIT)*
+    name: NAME
+    index: data
+    indexs : index ("," index)*
+    // Earley 会把 [_] 解析成 sys_data，这里同样不单独区分 index_null
+    array: data "[" indexs "]"
+    ox_num: OX_NUM
+    OX_NUM.2 :  "0x" (INT|UCASE_LETTER)+
+
+    NAME: (LCASE_LETTER|UCASE_LETTER)(("_")?(LCASE_LETTER|UCASE_LETTER|DIGIT))*
+    _data_type: NAME | BIT_TYPE
+    BIT_TYPE.2 : "bit" "<" INT ">"
+
+    %import common.LETTER
+    %import common.LCASE_LETTER
+    %import common.UCASE_LETTER
+    %import common.DIGIT
+    %import common.INT
+    %import common.WS
+    %ignore WS
+"""
+
+
+def _retag(token:Token):
+    return Token.new_borrow_pos("DATA_TYPE", token, token)
+
+
+class RetagDataType(Transformer):
+    """把 _data_type 位置上的 NAME/BIT_TYPE token 改回 Earley 版本中的 DATA_TYPE。
+
+    作为 LALR 解析器的内联 transformer 使用，在规约时直接处理，不需要额外遍历语法树。
+    """
+
+    def ins_define_var(self, children):
+        children[0] = _retag(children[0])
+        return Tree("ins_define_var", children)
+
+    def func_param(self, children):
+        children[0] = _retag(children[0])
+        return Tree("func_param", children)
+
+    def reg(self, children):
+        children[0] = _retag(children[0])
+        return Tree("reg", children)
+
+    def module_par(self, children):
+        children[1] = _retag(children[1])
+        return Tree("module_par", children)
@@ -0,0 +1,113 @@
+"""registry.py - Lark语法解析器注册表
+
+功能说明：
+    编译流程中 parser_tree、Generator、aggregate 都需要 Lark 解析器，
+    以前每次编译都会调用 Lark(grammar...) 重新构建，构建语法本身就占了不少时间。
+    这里把各套语法（grammar、grammar_lalr、grammar_define、grammar_header、grammar_parser）集中注册：
+    1. 每个进程内每套语法只构建一次，之后直接复用同一个解析器对象；
+    2. 构建结果同时写入磁盘缓存，key 为语法文本+构建参数+Lark版本的哈希，
+       CLI 和 agent 冷启动时直接加载，不用再从头分析语法。
+
+磁盘缓存说明：
+    - LALR 解析器使用 Lark 自带的 cache 机制，缓存完整的解析表；
+    - Earley 解析器 Lark 不支持序列化，这里缓存的是语法文本解析后的 Grammar 对象，
+      加载后只需要再做规则编译，省去了解析语法文本这一步。
+"""
+
+import os
+import pickle
+
+import lark
+from lark import Lark
+from lark.load_grammar import load_grammar
+
+from lynette.lynette_lib import cache
+from lynette.lynette_lib.collect import CollectTransformer
+from lynette.lynette_lib.grammar.grammar import grammar
+from lynette.lynette_lib.grammar.grammar_lalr import grammar_lalr, RetagDataType
+from lynette.lynette_lib.grammar.grammar_define import grammar_define
+from lynette.lynette_lib.grammar.grammar_header import grammar_header
+from lynette.lynette_lib.grammar.grammar_parser import grammar_parser
+
+#名字 -> (语法文本, Lark构建参数)
+GRAMMARS = {
+    "grammar"        : (grammar, {}),
+    "grammar_lalr"   : (grammar_lalr, {"parser": "lalr", "transformer": RetagDataType()}),
+    #和grammar_lalr相同的语法，transformer在解析的同时完成collect
+    "grammar_collect": (grammar_lalr, {"parser": "lalr", "transformer": CollectTransformer()}),
+    "grammar_define" : (grammar_define, {}),
+    "grammar_header" : (grammar_header, {}),
+    "grammar_parser" : (grammar_parser, {}),
+}
+
+#进程内已经构建好的解析器
+_parsers = {}
+#进程内已经算好的缓存key，语法文本不会在运行中变化
+_keys = {}
+
+
+def grammar_key(name:str):
+    """计算某套语法的缓存key：语法文本、构建参数和Lark版本任何一个变了都会失效。"""
+    if name in _keys:
+        return _keys[name]
+    text, options = GRAMMARS[name]
+    #transformer之类的对象不参与key，repr里带内存地址，每个进程都不一样
+    options_str = repr(sorted((k, v) for k, v in options.items() if isinstance(v, (str, int, bool, type(None)))))
+    _keys[name] = cache.digest(name, text, options_str, lark.__version__)
+    return _keys[name]
+
+
+def get_parser(name:str):
+    """获取指定语法的解析器，进程内只构建一次。
+
+    Args:
+        name (str): GRAMMARS中注册的语法名，例如 grammar、grammar_define。
+
+    Returns:
+        Lark: 构建好的解析器。
+    """
+    if name in _parsers:
+        return _parsers[name]
+    if name not in GRAMMARS:
+        print("error-registry-get_parser what grammar", name)
+        exit()
+    parser = _build_parser(name)
+    _parsers[name] = parser
+    return parser
+
+
+def clear():
+    """清空进程内的解析器，主要给测试和watch模式在语法变化后使用。"""
+    _parsers.clear()
+    _keys.clear()
+
+
+def _build_parser(name:str):
+    text, options = GRAMMARS[name]
+    cache_path = None
+    if cache.cache_enabled():
+        directory = cache.cache_dir("grammar")
+        if directory is not None:
+            cache_path = os.path.join(directory, name + "_" + grammar_key(name))
+
+    if cache_path is None:
+        return Lark(text, **options)
+
+    if options.get("parser") == "lalr":
+        #LALR直接用Lark自带的缓存，缓存的是完整的解析表
+        return Lark(text, cache=cache_path + ".lalr", **options)
+
+    #Earley：缓存Grammar对象
+    grammar_file = cache_path + ".grammar"
+    grammar_obj = None
+    if os.path.exists(grammar_file):
+        try:
+            with open(grammar_file, "rb") as file:
+                grammar_obj = pickle.load(file)
+        except Exception:
+            #缓存损坏就当没有，重新构建后覆盖
+            grammar_obj = None
+    if grammar_obj is None:
+        grammar_obj, _ = load_grammar(text, "<" + name + ">", None, options.get("keep_all_tokens", False))
+        cache.atomic_write(grammar_file, pickle.dumps(grammar_obj, protocol=pickle.HIGHEST_PROTOCOL))
+    return Lark(grammar_obj, **options)
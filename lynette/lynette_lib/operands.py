@@ -0,0 +1,80 @@
+"""operands.py - 操作数解析的记忆
+
+功能说明：
+    generate_data 把一个操作数（data子树）解析成 (生成的名字, 类型)。同一个操作数会被反复解析：
+    单表可行性检查（generate_if_can_single_table、generate_switch_can_single_table）先用 if_generate="no"
+    解析一遍，实际生成时再解析一遍，公共子表达式和module参数绑定也要解析；每次都要遍历子树、
+    拼接点分名字、split IP。这里按IR节点记下解析结果 Operand，检查和生成共用：
+    - 局部变量（name）生成的名字取决于所在的命名域，只记下源码中的名字，每次查 var_list；
+    - 其余（hdr/pkt/gmeta字段、系统数据、整数、IP）和命名域无关，直接记下生成的名字和类型。
+    IR在用户之间共享，不在节点上加属性，Generator.operands 按节点的id记录（Operand持有节点，id不会被复用）。
+"""
+
+from lark import Tree
+
+from lynette.lynette_lib import symbols
+
+
+class Operand():
+    """一个操作数的解析结果。
+
+    Attributes:
+        node (Tree): 解析的data节点
+        local (bool): 是不是局部变量，是时name为源码中的名字
+        name (str): 生成的名字
+        type (str): hdr/pkt/gmeta/sys_data/int/ip_data，局部变量为var
+    """
+    __slots__ = ("node", "local", "name", "type")
+
+    def __init__(self, node:Tree, local:bool, name:str, data_type:str):
+        self.node = node
+        self.local = local
+        self.name = name
+        self.type = data_type
+
+
+def resolve(data_o:Tree, sys_data:dict):
+    """解析data子树，出错时和原来的generate_data一样报错退出。"""
+    data = data_o.children[0]
+    if data.data == "name":
+        return Operand(data_o, True, data.children[0].value, "var")
+    elif data.data == "name_field":
+        data_len = len(data.children)
+        if data.children[0].value == "hdr":
+            return Operand(data_o, False, symbols.text(symbols.path(tuple(c.value for c in data.children))), "hdr")
+        elif data.children[0].value == "pkt":
+            if data_len != 2:
+                print("error-generate_data pkt small than 2")
+                exit()
+            if data.children[1].value == 'out_port':
+                return Operand(data_o, False, "LynettePKT.LynetteOutPort", "pkt")
+            elif data.children[1].value == 'in_port':
+                return Operand(data_o, False, "LynettePKT.LynetteInPort", "pkt")
+            else:
+                print("error-generate_data pkt what")
+                exit()
+        elif data.children[0].value == "gmeta":
+            if data_len != 2:
+                print("error-generate_data pkt small than 2")
+                exit()
+            return Operand(data_o, False, "gmeta." + data.children[1].value, "gmeta")
+        else:
+            print("generate_data what type? error function 2")
+            print(data.children[0].value)
+            exit()
+    elif data.data == "sys_data":
+        if data.children[0].value in sys_data:
+            return Operand(data_o, False, sys_data[data.children[0].value], "sys_data")
+        else:
+            print("error-generate_data what sys data")
+            exit()
+    elif data.data == "int" or data.data == "ox_num":
+        return Operand(data_o, False, str(data.children[0].value), "int")
+    elif data.data == "ip_data":
+        ip = data.children[0].value.split(".")
+        ip = (int(ip[0])<<24) + (int(ip[1])<<16) + (int(ip[2])<<8) + int(ip[3])
+        return Operand(data_o, False, str(ip), "ip_data")
+    else:
+        print("generate_data what type? error function 1")
+        print(data.data)
+        exit()
@@ -1,6 +1,78 @@
 from lark import Lark, Tree, Token
 
-import json,os
+import json,os,shutil
+
+def bfrt_key_value(key_v:str):
+    """match的值转成bfrt的写法：IPv4加引号，IPv6转成16进制整数，其它原样输出。"""
+    if "." in key_v:
+        key_v = "\"" + key_v + "\""
+    if ":" in key_v:
+        key_vt = key_v.split(":")
+        key_v = "0x" + key_vt[0] + "".join([g.rjust(4, "0") for g in key_vt[1:]])
+    return key_v
+
+
+class JsonEntries():
+    """逐条写出节点的表项json（node_entry），输出和 json.dump({"target": node, "entries": 表项列表}, f_w, indent=2) 一致。
+
+    表项一条一条地写，不需要先把节点的所有表项放进一个列表。
+    """
+
+    def __init__(self, f_w, node:str):
+        self.f_w = f_w
+        self.count = 0
+        f_w.write('{\n  "target": ' + json.dumps(node) + ',\n  "entries": [')
+
+    def write(self, entry:dict):
+        self.f_w.write(("\n    " if self.count == 0 else ",\n    ") + json.dumps(entry, indent=2).replace("\n", "\n    "))
+        self.count = self.count + 1
+
+    def close(self):
+        self.f_w.write("]\n}" if self.count == 0 else "\n  ]\n}")
+
+
+class BfrtEntries():
+    """逐条写出bfrt脚本，每条表项一行 bfrt.<node>.pipe.LynetteIngress.<table>.add_with_<action>(...)。
+
+    同一张表的表项连续出现，表名、action名、key名只在变化时重新拼接一次，
+    每条表项拼成一整行后按块写出。
+    """
+
+    def __init__(self, f_w, node:str):
+        self.f_w = f_w
+        self.node = node
+        self.lines = []
+        self.last = None
+        self.head = ""
+        self.key_names = []
+
+    def write(self, entry:dict):
+        match = entry['match']
+        shape = (entry['table'], entry['action_name'], tuple(match))
+        if shape != self.last:
+            self.last = shape
+            self.head = "bfrt." + self.node + ".pipe.LynetteIngress." + shape[0] + ".add_with_" + shape[1] + "("
+            #key名只取最后一段：hdr.ipv4.dst_addr -> dst_addr
+            self.key_names = [key.split(".")[-1] + " = " for key in shape[2]]
+        keys = ", ".join([self.key_names[i] + bfrt_key_value(v[0]) for i, v in enumerate(match.values())])
+        params = "".join([", value_" + str(i) + " = " + v[0] for i, v in enumerate(entry['action_params'].values())])
+        self.lines.append(self.head + keys + params + ")\n")
+        if len(self.lines) >= 4096:
+            self.f_w.write("".join(self.lines))
+            self.lines = []
+
+    def close(self):
+        self.f_w.write("".join(self.lines))
+        self.lines = []
+
+
+def write_bfrt_entries(f_w, node:str, entries):
+    """把表项（可以是迭代器）写成bfrt脚本，见 BfrtEntries。"""
+    writer = BfrtEntries(f_w, node)
+    for entry in entries:
+        writer.write(entry)
+    writer.close()
+
 
 def execute(output_parameter):
     print("output...")
@@ -180,59 +252,11 @@ def execute(output_parameter):
                 else:
                     print("error-lynette-output-what resource 78451")
                     exit()
-        with open(read_dir + file_entry) as f_r:
-            json_t = json.load(f_r)
-            if topo[node]["resource"] == "CPU":
-                json_file_to_w = write_dir + node + "_entry.json"
-            elif topo[node]["resource"] == "ASIC":
-                json_file_to_w = write_dir + node + "_entry.py"
-            with open(json_file_to_w,"w") as f_w:
-                if topo[node]["resource"] == "CPU":
-                    json.dump(json_t,f_w,indent=2)
-                elif topo[node]["resource"] == "ASIC":
-                    for entry in json_t["entries"]:
-                        #print("out put 55",entry)
-                        f_w.write("bfrt." + node + ".pipe.LynetteIngress.")
-                        f_w.write(entry['table'])
-                        f_w.write(".add_with_")
-                        f_w.write(entry['action_name'])
-                        f_w.write("(")
-                        douhao = 0
-                        for key in entry['match']:
-                            if douhao == 0:
-                                douhao = douhao + 1
-                            else:
-                                f_w.write(", ")
-                            key_v = entry['match'][key][0]
-                            if "." in key_v:
-                                key_v = "\"" + key_v + "\""
-                            if ":" in key_v:
-                                key_vt = key_v.split(":")
-                                key_v = "0x" + key_vt[0]
-                                i = 1
-                                while i < len(key_vt):
-                                    for v in range(4-len(key_vt[i])):
-                                        key_v = key_v + "0"
-                                    key_v = key_v + key_vt[i]
-                                    i = i + 1
-                            if "." in key:
-                                key_m = key.split(".")
-                                key_m = key_m[-1]
-                            else:
-                                key_m = key
-                            f_w.write(key_m)
-                            f_w.write(" = ")
-                            f_w.write(key_v)
-                        int_v = 0
-                        for value in entry['action_params']:
-                            f_w.write(", ")
-                            value_m = "value_" + str(int_v)
-                            value_v = entry['action_params'][value][0]
-                            f_w.write(value_m)
-                            f_w.write(" = ")
-                            f_w.write(value_v)
-                            int_v = int_v + 1
-                        f_w.write(")\n")
+        #aggregate已经逐条写好了json和bfrt两种表项，这里只按资源类型复制，不整体载入
+        if topo[node]["resource"] == "CPU":
+            shutil.copyfile(read_dir + file_entry, write_dir + node + "_entry.json")
+        elif topo[node]["resource"] == "ASIC":
+            shutil.copyfile(read_dir + file_entry + "_bfrt", write_dir + node + "_entry.py")
                 
     
 
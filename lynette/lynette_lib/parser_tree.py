@@ -1,65 +1,405 @@
-from lark import Lark
-from lynette.lynette_lib.grammar.grammar import grammar
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 
-#执行一下文件的符号替换, " -> >-<
-def change_1(file):
-    """将domain文件中的双引号替换为内部使用的占位符\">-<\"。
+from lark import Tree
+from lark.exceptions import UnexpectedInput
+from lark.parsers.lalr_analysis import Reduce
+
+from lynette.lynette_lib import cache
+from lynette.lynette_lib import collect
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib.grammar import registry
+
+#默认解析后端，lalr解析失败时会自动回退到earley
+DEFAULT_BACKEND = "lalr"
+#解析后端 -> 注册的语法名，fused 是带 collect 的 LALR，code 中直接是收集好的组件
+BACKENDS = {
+    "lalr"   : "grammar_lalr",
+    "fused"  : "grammar_collect",
+    "earley" : "grammar",
+}
+
+#缓存的语法树格式有变化时加一（2：module节点的meta中带源码片段的哈希，3：融合解析的module也带哈希）
+TREE_VERSION = "3"
+
+#进程内的语法树缓存 {内容哈希: Tree}，同一次编译中多个用户共享的include只解析一次，
+#按pickle后的大小计入和磁盘缓存相同的上限，--watch 常驻时不会无限增长
+_trees = cache.LRU()
+
+#执行一下代码的符号替换, " -> >-<
+def replace_quotes(code, left=">-<", right=">-<"):
+    """在内存中把代码里的双引号替换为内部使用的占位符。
 
     Lark语法中include_user_domain/include_sys_domain规则使用\">-<\"来代表字符串，
-    因此在解析domain文件前需要把所有\"替换成\">-<\"，解析完成后再替换回去。
+    因此在解析前需要把成对的\"依次替换成left和right。只处理内存中的字符串，
+    不会改写用户的源文件，多个编译同时读取同一份输入也是安全的。
 
     Args:
-        file (str): 待转换的domain文件绝对路径。
+        code (str): 源代码。
+        left (str): 替换左引号的占位符。
+        right (str): 替换右引号的占位符。
+
+    Returns:
+        str: 替换后的代码。
     """
-    pre_code = ''
-    with open(file,"r") as f:
-        pre_code = f.read()
-    pre_code = pre_code.split('"')
-    code = ''
-    if len(pre_code) > 1:
-        len_c = len(pre_code)
-        code = pre_code[0] + ">-<" + pre_code[1] + ">-<" + pre_code[2]
-        i = 3
-        while i < len_c:
-            code = code + ">-<" + pre_code[i] + ">-<" + pre_code[i+1]
-            i = i + 2
+    pieces = code.split('"')
+    if left == right:
+        return left.join(pieces)
+    out = [pieces[0]]
+    for i in range(1, len(pieces)):
+        out.append(left if i % 2 == 1 else right)
+        out.append(pieces[i])
+    return ''.join(out)
+
+
+def read_source(file_name, left=">-<", right=">-<"):
+    """读取源文件并在内存中完成双引号替换。"""
+    with open(file_name, "r") as file:
+        return replace_quotes(file.read(), left, right)
+
+
+def _failed_rule(e):
+    """从LALR的解析错误中找出出错位置所在的规则名，用于回退时的提示。"""
+    rules = []
+    interactive = getattr(e, "interactive_parser", None)
+    if interactive is not None:
+        parser_state = interactive.parser_state
+        states = parser_state.parse_conf.parse_table.states
+        for action, arg in states.get(parser_state.position, {}).values():
+            if action is Reduce and arg.origin.name not in rules:
+                rules.append(arg.origin.name)
+        if not rules and parser_state.value_stack:
+            last = parser_state.value_stack[-1]
+            rules.append(last.data if hasattr(last, "data") else last.type)
+    if not rules:
+        return "start"
+    return ",".join(str(r) for r in sorted(rules))
+
+
+def tree_key(code, backend=DEFAULT_BACKEND):
+    """语法树缓存的key：代码内容、解析后端和两套语法的哈希，任何一个变了都会失效。"""
+    parts = [code, backend, registry.grammar_key("grammar"), registry.grammar_key("grammar_lalr"), TREE_VERSION]
+    if backend == "fused":
+        #融合解析缓存的是collect的结果，collect和data_structure的代码变了也要失效
+        parts.append(_collect_key())
+    return cache.digest(*parts)
+
+
+_collect_keys = []
+
+
+def _collect_key():
+    if not _collect_keys:
+        sources = []
+        for module in (collect, data_structure):
+            with open(module.__file__, "r") as file:
+                sources.append(file.read())
+        _collect_keys.append(cache.digest(*sources))
+    return _collect_keys[0]
+
+
+def parse_code(code, file_name, backend=DEFAULT_BACKEND):
+    """解析一段PNE代码，结果按内容哈希缓存。
+
+    先查进程内缓存，再查磁盘缓存（~/.cache/lynette/tree），都没有才真正解析，
+    解析结果写回两级缓存，磁盘缓存超过上限后按LRU淘汰。内容没变的文件
+    无论在同一次编译还是多次编译之间都不会重复解析。
+
+    Args:
+        code (str): 已经做过双引号替换的PNE代码。
+        file_name (str): 文件名，只用于警告信息。
+        backend (str): lalr、fused 或 earley。
+
+    Returns:
+        Tree: Lark语法树，多个调用方共享同一个对象，不要修改。
+    """
+    key = tree_key(code, backend)
+    tree = _cached_tree(key)
+    if tree is None:
+        tree = _parse(code, file_name, backend)
+        _store_tree(key, tree)
+    return tree
+
+
+def parse_codes(items, jobs=1):
+    """批量解析多段互不依赖的PNE代码，jobs大于1时未命中缓存的部分交给进程池并行解析。
+
+    Args:
+        items (list): [(code, file_name, backend)]，参数含义同 parse_code。
+        jobs (int): 并行进程数，1表示串行。
+
+    Returns:
+        list: 和items一一对应的语法树。
+    """
+    trees = [None] * len(items)
+    misses = []
+    for i, (code, file_name, backend) in enumerate(items):
+        key = tree_key(code, backend)
+        trees[i] = _cached_tree(key)
+        if trees[i] is None:
+            misses.append((i, key))
+    if jobs > 1 and len(misses) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(misses))) as executor:
+            results = executor.map(_parse_worker, [items[i] for i, _ in misses])
+            for (i, key), tree in zip(misses, results):
+                trees[i] = tree
+                _store_tree(key, tree)
     else:
-        code = pre_code[0]
-    with open(file,"w") as f:
-        f.write(code)
+        for i, key in misses:
+            code, file_name, backend = items[i]
+            #同一批里可能有内容相同的文件，前面刚解析过的直接复用
+            trees[i] = _cached_tree(key)
+            if trees[i] is None:
+                trees[i] = _parse(code, file_name, backend)
+                _store_tree(key, trees[i])
+    return trees
+
+
+def _cached_tree(key):
+    """依次查进程内缓存和磁盘缓存，都没有时返回None。"""
+    tree = _trees.get(key)
+    if tree is not None:
+        return tree
+    cache_path = _tree_cache_path(key)
+    if cache_path is not None:
+        data = cache.read(cache_path)
+        if data is not None:
+            try:
+                tree = pickle.loads(data)
+                _trees.put(key, tree, len(data))
+                return tree
+            except Exception:
+                #缓存损坏就当没有，重新解析后覆盖
+                pass
+    return None
+
+
+def _store_tree(key, tree):
+    """把解析结果写入进程内缓存和磁盘缓存，两者超过上限后都按LRU淘汰。"""
+    data = pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL)
+    _trees.put(key, tree, len(data))
+    cache_path = _tree_cache_path(key)
+    if cache_path is not None:
+        cache.atomic_write(cache_path, data)
+        cache.evict(os.path.dirname(cache_path))
+
+
+def _tree_cache_path(key):
+    if not cache.cache_enabled():
+        return None
+    directory = cache.cache_dir("tree")
+    if directory is None:
+        return None
+    return os.path.join(directory, key + ".tree")
+
 
-#执行一下文件的符号替换, >-< -> "
-def change_2(file):
-    """把change_1生成的\">-<\"占位符恢复成标准的双引号。
+def _parse_worker(item):
+    """进程池中执行的解析任务，只解析不碰缓存，结果由主进程统一写缓存。"""
+    code, file_name, backend = item
+    return _parse(code, file_name, backend)
+
+
+def clear():
+    """清空进程内的语法树缓存（磁盘缓存不受影响）。"""
+    _trees.clear()
+
+
+def _parse(code, file_name, backend):
+    """不经过缓存直接解析。
+
+    默认使用LALR语法（grammar_lalr），速度比Earley快很多；
+    遇到LALR语法处理不了的写法时打印警告并回退到Earley语法（grammar），
+    两者在合法输入上得到的语法树完全一致。
+    fused 使用带collect的LALR（grammar_collect），回退时得到的是普通语法树，
+    collect.execute 两种都能处理。
 
     Args:
-        file (str): 需要还原的domain文件绝对路径。
+        code (str): 已经做过双引号替换的PNE代码。
+        file_name (str): 文件名，只用于警告信息。
+        backend (str): lalr、fused 或 earley。
+
+    Returns:
+        Tree: Lark语法树。
     """
-    pre_code = ''
-    with open(file,"r") as f:
-        pre_code = f.read()
-    pre_code = pre_code.split('>-<')
-    code = ''
-    if len(pre_code) > 1:
-        len_c = len(pre_code)
-        code = pre_code[0] + "\"" + pre_code[1] + "\"" + pre_code[2]
-        i = 3
-        while i < len_c:
-            code = code + "\"" + pre_code[i] + "\"" + pre_code[i+1]
-            i = i + 2
+    if backend not in BACKENDS:
+        print("error-parser_tree-parse_code what backend", backend)
+        exit()
+    if backend == "earley":
+        tree = registry.get_parser("grammar").parse(code)
     else:
-        code = pre_code[0]
-    with open(file,"w") as f:
-        f.write(code)
+        try:
+            tree = registry.get_parser(BACKENDS[backend]).parse(code)
+        except UnexpectedInput as e:
+            print("warning-parser_tree-parse_code lalr failed in rule", _failed_rule(e),
+                  "at", str(file_name) + ":" + str(getattr(e, "line", "?")), "fallback to earley")
+            tree = registry.get_parser("grammar").parse(code)
+    _mark_modules(code, tree)
+    return tree
+
+
+def _first_pos(node):
+    """组件中第一个token在源码中的位置，融合解析收集好的组件记在组件的第4项中。"""
+    if isinstance(node, tuple):
+        return node[3] if len(node) > 3 else None
+    while isinstance(node, Tree):
+        if not node.children:
+            return None
+        node = node.children[0]
+    return getattr(node, "start_pos", None)
+
+
+def _mark_modules(code, tree):
+    """在每个module节点的meta中记下源码片段的哈希（meta.source_key），collect据此在用户之间共享模块IR。
+
+    片段从模块名开始，到下一个组件的第一个token为止，最后一个组件到文件末尾，
+    module关键字之外的源码都在片段中，片段相同的模块收集出的IR一定相同。
+    融合解析的组件已经收集好了，module的哈希直接记在IR上并登记为共享的模块IR（collect.share_fused）。
+    """
+    for node in tree.children:
+        if not isinstance(node, Tree) or node.data != "code":
+            continue
+        starts = [_first_pos(component) for component in node.children] + [len(code)]
+        for i, component in enumerate(node.children):
+            key = None
+            if starts[i] is not None and starts[i + 1] is not None:
+                key = cache.digest(code[starts[i]:starts[i + 1]])
+            if isinstance(component, tuple):
+                node.children[i] = collect.share_fused(component, key)
+            elif isinstance(component, Tree) and component.data == "module" and key is not None:
+                component.meta.source_key = key
+
+
+def _read(file_name, kind):
+    """读取一个待解析的文件，domain文件需要在内存中做双引号替换，入口文件已经替换过。"""
+    if kind in ("user_domain", "sys_domain"):
+        return read_source(file_name)
+    with open(file_name,'r') as file:
+        return file.read()
+
+
+def _main_includes(tree, parser_tree_paremeter):
+    """找出入口文件的include，返回 [(forest中的key, 文件路径, 类型)]，类型为 pne/user_domain/sys_domain。"""
+    includes = []
+    for node_main in tree.children:
+        if node_main.data == "include":
+            for include in node_main.children:
+                if include.data == "include_user_file":
+                    file_path = ''
+                    for i in range(len(include.children)-1):
+                        file_path = file_path + '//' + include.children[i]
+                    tree_name = file_path + '//' + include.children[-1]
+                    file_name = parser_tree_paremeter["input_path"] + tree_name + '.pne'
+                    includes.append((tree_name, file_name, "pne"))
+                elif include.data == "include_user_domain":
+                    file_path = ''
+                    for i in range(len(include.children)-1):
+                        file_path = file_path + '//' + include.children[i]
+                    file_name = parser_tree_paremeter["input_path"][:-2] + file_path + "//" + include.children[-1] + '.domain'
+                    includes.append((None, file_name, "user_domain"))
+                elif include.data == "include_sys_domain":
+                    file_name = parser_tree_paremeter["input_path"] + "//include//" + include.children[-1] + '.domain'
+                    includes.append((None, file_name, "sys_domain"))
+    return includes
+
+
+def _domain_includes(tree, domain_file_name, kind):
+    """找出domain文件中列出的PNE文件，这些文件和domain文件在同一目录，parser单独处理不在这里解析。"""
+    rule = "include_user_file" if kind == "user_domain" else "include_sys_file"
+    directory = domain_file_name[:domain_file_name.rfind("//")]
+    includes = []
+    for file_i_t in tree.children[0].children:
+        if file_i_t.data == rule:
+            file_name_t = file_i_t.children[0].value
+            if file_name_t == "parser":
+                continue
+            includes.append((file_name_t, directory + "//" + file_name_t + ".pne", "pne"))
+    return includes
+
+
+def build_include_graph(parameters):
+    """为多个用户的入口文件建立include依赖图（DAG），每个文件只读取和解析一次。
+
+    compile_service 中每个用户都会include相同的domain和模块库，
+    先对所有用户建图，再由 execute 从图中组装各自的语法森林，
+    公共include的解析开销不会随用户数增长。
+
+    同一层互不依赖的文件通过 parse_codes 批量解析，parser_tree_paremeter 中
+    jobs 大于1时使用进程池并行，结果和串行完全相同。
+
+    Args:
+        parameters (list): 每个用户的parser_tree_paremeter，参数含义同 execute。
+
+    Returns:
+        dict: include依赖图。
+            - roots (dict): {入口文件名: 入口文件路径}
+            - edges (dict): {文件路径: [(forest中的key, 文件路径, 类型)]}
+            - trees (dict): {文件路径: Lark Tree}
+    """
+    include_graph = {"roots": {}, "edges": {}, "trees": {}}
+    edges = include_graph["edges"]
+    trees = include_graph["trees"]
+    jobs = max([parser_tree_paremeter.get("jobs", 1) for parser_tree_paremeter in parameters] + [1])
+
+    #按层展开：入口文件 -> include的PNE/domain文件 -> domain中列出的PNE文件，
+    #同一层的文件互不依赖，可以一起交给进程池解析
+    frontier = []
+    for parser_tree_paremeter in parameters:
+        main_file_name = parser_tree_paremeter["sys_path"] + "//component//main//" + parser_tree_paremeter["main_file_name"]
+        include_graph["roots"][parser_tree_paremeter["main_file_name"]] = main_file_name
+        frontier.append((main_file_name, "main", parser_tree_paremeter))
+    while frontier:
+        todo = []
+        for file_name, kind, parser_tree_paremeter in frontier:
+            if file_name in edges:
+                continue
+            edges[file_name] = []
+            todo.append((file_name, kind, parser_tree_paremeter))
+        items = []
+        for file_name, kind, parser_tree_paremeter in todo:
+            items.append((_read(file_name, kind), file_name, parser_tree_paremeter.get("backend", DEFAULT_BACKEND)))
+        frontier = []
+        for (file_name, kind, parser_tree_paremeter), tree in zip(todo, parse_codes(items, jobs)):
+            trees[file_name] = tree
+            if kind == "main":
+                edges[file_name] = _main_includes(tree, parser_tree_paremeter)
+            elif kind != "pne":
+                edges[file_name] = _domain_includes(tree, file_name, kind)
+            for _, file_name_t, kind_t in edges[file_name]:
+                frontier.append((file_name_t, kind_t, parser_tree_paremeter))
+    return include_graph
+
+
+def graph_files(include_graph, main_file_name):
+    """某个入口文件在include依赖图中能到达的所有文件（包括入口文件和domain文件）。
+
+    Args:
+        include_graph (dict): build_include_graph 的结果。
+        main_file_name (str): 入口文件名，例如 Alice_main.pne。
+
+    Returns:
+        list: 文件路径列表，按遍历顺序排列。
+    """
+    files = []
+    stack = [include_graph["roots"][main_file_name]]
+    while stack:
+        file_name = stack.pop()
+        if file_name in files:
+            continue
+        files.append(file_name)
+        for _, file_name_t, _ in reversed(include_graph["edges"].get(file_name, [])):
+            stack.append(file_name_t)
+    return files
+
 
 #整个提取树的逻辑有大问题
 #和预编译一起重构一下
-def execute(parser_tree_paremeter):
+def execute(parser_tree_paremeter, include_graph=None):
     """解析入口文件及其include形成的语法森林。
 
     1. 读取component/main目录下的入口PNE文件并生成语法树；
     2. 扫描include语句，递归解析普通PNE文件和domain文件；
-    3. domain文件会列出额外需要解析的PNE文件，因此需要先进行双引号替换；
+    3. domain文件会列出额外需要解析的PNE文件，读取时在内存中进行双引号替换；
     4. 所有解析结果存放到forest字典中，key为文件标识，value为Lark语法树。
 
     Args:
@@ -67,6 +407,10 @@ def execute(parser_tree_paremeter):
             - main_file_name (str): 入口PNE文件名，例如 Alice_main.pne。
             - input_path (str): 用户工程输入目录，用于定位include文件。
             - sys_path (str): lynette包目录，用于定位component/main路径。
+            - backend (str, 可选): 解析后端，lalr（默认）、fused（解析时直接collect）或 earley。
+            - jobs (int, 可选): 并行解析include文件的进程数，默认1。
+        include_graph (dict, 可选): build_include_graph 的结果，多个用户共用，
+            不传则只为当前入口文件建图。
 
     Returns:
         dict: {文件名: Lark Tree} 的语法森林，供后续collect阶段使用。
@@ -74,71 +418,18 @@ def execute(parser_tree_paremeter):
     print('parser_tree...')
     with open(parser_tree_paremeter["input_path"] + "//log_out//log.txt","a") as file:
         file.write('parser_tree...\n')
-    parser = Lark(grammar)
+    if include_graph is None or parser_tree_paremeter["main_file_name"] not in include_graph["roots"]:
+        include_graph = build_include_graph([parser_tree_paremeter])
+    edges = include_graph["edges"]
+    trees = include_graph["trees"]
+
     forest = {}
-    with open(parser_tree_paremeter["sys_path"] + "//component//main//" + parser_tree_paremeter["main_file_name"],'r') as file:
-        code = file.read()
-        tree = parser.parse(code)
-        forest['main'] = tree
-        for node_main in tree.children:
-            if node_main.data == "include":
-                for include in node_main.children:
-                    if include.data == "include_user_file":
-                        file_path = ''
-                        for i in range(len(include.children)-1):
-                            file_path = file_path + '//' + include.children[i]
-                        file_name = file_path + '//' + include.children[-1]
-                        tree_name = file_name
-                        file_name = parser_tree_paremeter["input_path"] + file_name + '.pne'
-                        with open(file_name,'r') as file:
-                            code = file.read()
-                            tree = parser.parse(code)
-                            forest[tree_name] = tree
-                    elif include.data == "include_user_domain":
-                        file_path = ''
-                        for i in range(len(include.children)-1):
-                            file_path = file_path + '//' + include.children[i]
-                        file_name = parser_tree_paremeter["input_path"][:-2] + file_path + "//" + include.children[-1] + '.domain'
-                        domain_file_name = file_name
-                        #print("parser - 44",domain_file_name)
-                        change_1(domain_file_name)
-                        with open(domain_file_name,"r") as domain_file:
-                            domain_code = domain_file.read()
-                            domain_tree = parser.parse(domain_code)
-                        change_2(domain_file_name)
-                        domain_tree_include = domain_tree.children[0]
-                        for file_i_t in domain_tree_include.children:
-                            if file_i_t.data == "include_user_file":
-                                file_name_t = file_i_t.children[0].value
-                                if file_name_t == "parser":
-                                    continue
-                                file_name = parser_tree_paremeter["input_path"][:-2] + file_path + "//" + file_name_t + ".pne"
-                                #print("parser - 45",file_name)
-                                with open(file_name,'r') as file:
-                                    code = file.read()
-                                    tree = parser.parse(code)
-                                    forest[file_name_t] = tree
-                    elif include.data == "include_sys_domain":
-                        file_path = "//include"
-                        file_name = parser_tree_paremeter["input_path"] + file_path + "//" + include.children[-1] + '.domain'
-                        domain_file_name = file_name
-                        #print("parser - 44",domain_file_name)
-                        change_1(domain_file_name)
-                        with open(domain_file_name,"r") as domain_file:
-                            domain_code = domain_file.read()
-                            domain_tree = parser.parse(domain_code)
-                        change_2(domain_file_name)
-                        domain_tree_include = domain_tree.children[0]
-                        for file_i_t in domain_tree_include.children:
-                            if file_i_t.data == "include_sys_file":
-                                file_name_t = file_i_t.children[0].value
-                                if file_name_t == "parser":
-                                    continue
-                                file_name = parser_tree_paremeter["input_path"] + file_path + "//" + file_name_t + ".pne"
-                                #print("parser - 45",file_name)
-                                with open(file_name,'r') as file:
-                                    code = file.read()
-                                    tree = parser.parse(code)
-                                    forest[file_name_t] = tree
-
-    return forest
\ No newline at end of file
+    main_file_name = include_graph["roots"][parser_tree_paremeter["main_file_name"]]
+    forest['main'] = trees[main_file_name]
+    for tree_name, file_name, kind in edges[main_file_name]:
+        if kind == "pne":
+            forest[tree_name] = trees[file_name]
+        else:
+            for file_name_t_key, file_name_t, _ in edges[file_name]:
+                forest[file_name_t_key] = trees[file_name_t]
+    return forest
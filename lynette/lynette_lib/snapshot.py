@@ -0,0 +1,302 @@
+"""snapshot.py - 收集结果（IR）的二进制快照
+
+功能说明：
+    collect.execute 得到的 services/applications/modules 以前用完就丢，
+    AnalyzeService.analyze、agent 的编译流程、debug 模式的 generate_service_conf
+    每次都要从源码重新解析和收集。这里把收集结果写成带版本号的二进制快照，
+    之后直接 mmap 回来，源文件和编译器代码都没变时跳过解析和收集。
+
+文件格式（小端）：
+    头部   : magic(5s) 版本(H) 代码key(32s) 源文件数(I) 组件数(I)
+    源文件 : 路径长度(H) 路径(utf-8) 内容sha256(32s)            × 源文件数
+    索引   : 类型(B) 名字长度(H) 名字(utf-8) 源码片段哈希(32s) 偏移(Q) 长度(Q) crc32(I) × 组件数
+    校验   : 头部、源文件和索引的crc32(I)
+    数据   : 每个组件单独pickle，偏移从文件开头算起
+
+    类型 0 是元信息（语法森林的key列表），1/2/3 分别是 service/application/module。
+    源码片段哈希只有module有（LYNETTE_MODULE.source），其它为全0。
+
+校验：
+    1. magic、版本、索引crc32和每个组件的crc32，文件损坏或写了一半时整体失效；
+    2. 代码key：collect、data_structure、entry_scanner、语法的代码、解析后端、
+       Python和Lark的版本，任何一个变了都失效；
+    3. 源文件：入口文件及include依赖图中的全部文件，内容哈希和写入时不同就失效。
+    源文件列表本身记在快照里，include关系只由这些文件的内容决定，所以校验时不需要重新解析。
+
+    组件在第一次访问时才反序列化。带源码片段哈希的module先查 collect 中进程内共享的模块IR，
+    已经有的直接复用同一个对象，不再反序列化。
+    快照默认放在 ~/.cache/lynette/ir，和其它磁盘缓存一样受 LYNETTE_NO_CACHE、LYNETTE_CACHE_SIZE 控制。
+"""
+
+import gc
+import hashlib
+import mmap
+import os
+import pickle
+import platform
+import struct
+import zlib
+from collections.abc import Mapping
+
+import lark
+
+from lynette.lynette_lib import cache
+from lynette.lynette_lib import collect as collect_stage
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import entry_scanner
+from lynette.lynette_lib import parser_tree
+from lynette.lynette_lib.grammar import grammar_lalr
+from lynette.lynette_lib.grammar import registry
+
+MAGIC = b"LYNIR"
+#格式或IR结构有不兼容的变化时加一
+VERSION = 2
+
+_HEADER = struct.Struct("<5sH32sII")
+_SOURCE = struct.Struct("<H")
+_DIGEST = struct.Struct("<32s")
+_SECTION = struct.Struct("<BH")
+_SOURCE_KEY = struct.Struct("<32s")
+_OFFSET = struct.Struct("<QQI")
+_CRC = struct.Struct("<I")
+
+KIND_META = 0
+KIND_SERVICE = 1
+KIND_APP = 2
+KIND_MODULE = 3
+
+_code_keys = {}
+
+
+def code_key(backend=parser_tree.DEFAULT_BACKEND):
+    """编译器一侧的key：收集相关的代码、语法、解析后端以及Python和Lark的版本。"""
+    if backend not in _code_keys:
+        sources = []
+        for module in (collect_stage, data_structure, entry_scanner, grammar_lalr):
+            with open(module.__file__, "r") as file:
+                sources.append(file.read())
+        _code_keys[backend] = hashlib.sha256(cache.digest(
+            str(VERSION), backend, registry.grammar_key("grammar"), registry.grammar_key("grammar_lalr"),
+            platform.python_version(), lark.__version__, *sources).encode("utf-8")).digest()
+    return _code_keys[backend]
+
+
+def file_digest(file_name):
+    """源文件内容的sha256，文件不存在时返回None。"""
+    try:
+        with open(file_name, "rb") as file:
+            return hashlib.sha256(file.read()).digest()
+    except OSError:
+        return None
+
+
+class LazySection(Mapping):
+    """某一类组件的只读字典，值在第一次访问时才从映射的文件中反序列化。"""
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+        self.values = {}
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            offset, length, source = self.index[name]
+            if source is not None:
+                self.values[name] = collect_stage.shared_module(source, lambda: self.decode(offset, length))
+            else:
+                self.values[name] = self.decode(offset, length)
+        return self.values[name]
+
+    def decode(self, offset, length):
+        #反序列化一次会新建大量对象，期间关掉分代GC，否则GC的时间是反序列化本身的好几倍
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.loads(self.buffer[offset:offset + length])
+        finally:
+            if enabled:
+                gc.enable()
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class Snapshot():
+    """一份收集结果。
+
+    Attributes:
+        services (Mapping): {服务名: LYNETTE_SERVICE}
+        applications (Mapping): {应用名: LYNETTE_APP}
+        modules (Mapping): {模块名: LYNETTE_MODULE}
+        includes (list): 语法森林的key列表（main以及各个include）
+        sources (list): [(源文件路径, 内容sha256)]
+    """
+
+    def __init__(self, services, applications, modules, includes, sources):
+        self.services = services
+        self.applications = applications
+        self.modules = modules
+        self.includes = includes
+        self.sources = sources
+
+
+def write(file_name, snapshot, key):
+    """把快照写到文件，先写临时文件再rename。
+
+    Args:
+        file_name (str): 快照文件路径。
+        snapshot (Snapshot): 要写入的收集结果。
+        key (bytes): code_key() 的结果。
+    """
+    sections = [(KIND_META, "", None, pickle.dumps(list(snapshot.includes), pickle.HIGHEST_PROTOCOL))]
+    for kind, components in ((KIND_SERVICE, snapshot.services),
+                             (KIND_APP, snapshot.applications),
+                             (KIND_MODULE, snapshot.modules)):
+        for name in components:
+            source = components[name].source if kind == KIND_MODULE else None
+            sections.append((kind, name, source, pickle.dumps(components[name], pickle.HIGHEST_PROTOCOL)))
+
+    head = [_HEADER.pack(MAGIC, VERSION, key, len(snapshot.sources), len(sections))]
+    for source, source_digest in snapshot.sources:
+        path = source.encode("utf-8")
+        head.append(_SOURCE.pack(len(path)) + path + _DIGEST.pack(source_digest))
+    index_size = sum(_SECTION.size + len(name.encode("utf-8")) + _SOURCE_KEY.size + _OFFSET.size
+                     for _, name, _, _ in sections)
+    offset = sum(len(part) for part in head) + index_size + _CRC.size
+    for kind, name, source, data in sections:
+        name = name.encode("utf-8")
+        source = bytes.fromhex(source) if source else bytes(_SOURCE_KEY.size)
+        head.append(_SECTION.pack(kind, len(name)) + name + _SOURCE_KEY.pack(source) +
+                    _OFFSET.pack(offset, len(data), zlib.crc32(data)))
+        offset = offset + len(data)
+    head = b"".join(head)
+    cache.atomic_write(file_name, b"".join([head, _CRC.pack(zlib.crc32(head))] + [data for _, _, _, data in sections]))
+
+
+def read(file_name, key):
+    """mmap一个快照文件并校验，任何一项校验不通过都返回None。
+
+    Args:
+        file_name (str): 快照文件路径。
+        key (bytes): 期望的 code_key()。
+
+    Returns:
+        Snapshot: 组件按需反序列化的收集结果；失效时返回None。
+    """
+    try:
+        with open(file_name, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        return _read(buffer, key)
+    except (struct.error, UnicodeDecodeError, pickle.UnpicklingError):
+        return None
+
+
+def _read(buffer, key):
+    magic, version, key_t, source_num, section_num = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION or key_t != key:
+        return None
+    pos = _HEADER.size
+    sources = []
+    for _ in range(source_num):
+        length, = _SOURCE.unpack_from(buffer, pos)
+        pos = pos + _SOURCE.size
+        source = bytes(buffer[pos:pos + length]).decode("utf-8")
+        source_digest, = _DIGEST.unpack_from(buffer, pos + length)
+        pos = pos + length + _DIGEST.size
+        sources.append((source, source_digest))
+    index = {KIND_META: {}, KIND_SERVICE: {}, KIND_APP: {}, KIND_MODULE: {}}
+    for _ in range(section_num):
+        kind, length = _SECTION.unpack_from(buffer, pos)
+        pos = pos + _SECTION.size
+        name = bytes(buffer[pos:pos + length]).decode("utf-8")
+        source, = _SOURCE_KEY.unpack_from(buffer, pos + length)
+        offset, size, crc = _OFFSET.unpack_from(buffer, pos + length + _SOURCE_KEY.size)
+        pos = pos + length + _SOURCE_KEY.size + _OFFSET.size
+        if kind not in index or offset + size > len(buffer) or zlib.crc32(buffer[offset:offset + size]) != crc:
+            return None
+        index[kind][name] = (offset, size, source.hex() if any(source) else None)
+    crc, = _CRC.unpack_from(buffer, pos)
+    if zlib.crc32(buffer[:pos]) != crc or "" not in index[KIND_META]:
+        return None
+    #源文件有任何变化都失效
+    for source, source_digest in sources:
+        if file_digest(source) != source_digest:
+            return None
+    meta = LazySection(buffer, index[KIND_META])
+    return Snapshot(LazySection(buffer, index[KIND_SERVICE]),
+                    LazySection(buffer, index[KIND_APP]),
+                    LazySection(buffer, index[KIND_MODULE]),
+                    meta[""], sources)
+
+
+def path(parser_tree_paremeter):
+    """某个入口文件的快照路径，磁盘缓存关闭时返回None。"""
+    if not cache.cache_enabled():
+        return None
+    directory = cache.cache_dir("ir")
+    if directory is None:
+        return None
+    main_file_name = parser_tree_paremeter["sys_path"] + "//component//main//" + parser_tree_paremeter["main_file_name"]
+    name = cache.digest(os.path.abspath(main_file_name), os.path.abspath(parser_tree_paremeter["input_path"]),
+                        parser_tree_paremeter.get("backend", parser_tree.DEFAULT_BACKEND))
+    return os.path.join(directory, name + ".lir")
+
+
+def load(parser_tree_paremeter):
+    """读取某个入口文件的快照，没有或已失效时返回None。参数含义同 parser_tree.execute。"""
+    file_name = path(parser_tree_paremeter)
+    if file_name is None:
+        return None
+    snapshot = read(file_name, code_key(parser_tree_paremeter.get("backend", parser_tree.DEFAULT_BACKEND)))
+    if snapshot is not None:
+        #刷新修改时间，供LRU淘汰使用
+        try:
+            os.utime(file_name)
+        except OSError:
+            pass
+    return snapshot
+
+
+def collect(parser_tree_paremeter, include_graph=None, label=None):
+    """得到某个入口文件的收集结果：快照有效时直接读取，否则解析、收集并写快照。
+
+    Args:
+        parser_tree_paremeter (dict): 参数含义同 parser_tree.execute。
+        include_graph (dict, 可选): build_include_graph 的结果，多个用户共用。
+        label (str, 可选): 收集阶段日志前的标签，默认是入口文件名。
+
+    Returns:
+        Snapshot: 收集结果。
+    """
+    input_path = parser_tree_paremeter["input_path"]
+    snapshot = load(parser_tree_paremeter)
+    if snapshot is not None:
+        print('snapshot...')
+        with open(input_path + "//log_out//log.txt","a") as file:
+            file.write('snapshot...\n')
+        return snapshot
+
+    if include_graph is None or parser_tree_paremeter["main_file_name"] not in include_graph["roots"]:
+        include_graph = parser_tree.build_include_graph([parser_tree_paremeter])
+    forest = parser_tree.execute(parser_tree_paremeter, include_graph)
+    if label is None:
+        label = parser_tree_paremeter["main_file_name"]
+    print(label + " ", end='')
+    with open(input_path + "//log_out//log.txt","a") as file:
+        file.write(label + " ")
+    services, applications, modules = collect_stage.execute(forest, input_path)
+    sources = [(source, file_digest(source))
+               for source in parser_tree.graph_files(include_graph, parser_tree_paremeter["main_file_name"])]
+    snapshot = Snapshot(services, applications, modules, list(forest.keys()), sources)
+
+    file_name = path(parser_tree_paremeter)
+    if file_name is not None and all(source_digest is not None for _, source_digest in sources):
+        write(file_name, snapshot, code_key(parser_tree_paremeter.get("backend", parser_tree.DEFAULT_BACKEND)))
+        cache.evict(os.path.dirname(file_name))
+    return snapshot
@@ -0,0 +1,90 @@
+"""symbols.py - 符号表
+
+功能说明：
+    PNE中的名字（变量、表、模块、头部字段）和生成出来的P4标识符（prefix_name、hdr.ipv4.ttl ...）
+    在generate中会被反复拼接：同一个 prefix + "_" + name 每展开一次就重新拼一次，
+    FRAG_RELATION 的 input/output 中存的也是这些字符串，aggregate 再逐个 split 判断是不是hdr。
+    这里给每个名字分配一个小整数ID：
+    1. 同一个名字只有一个ID和一个字符串对象，字符串只在第一次出现时构建；
+    2. 拼接（join）和字段路径（path）按组成部分记忆，再次拼接直接查表；
+    3. header(sid) 记忆某个标识符引用的是哪个hdr，aggregate统计hdr使用情况时不再split。
+
+    ID只在当前进程内有效，一次编译中表只增不减，出现的名字数量很有限；
+    --watch 常驻时每次重编译前用 reset 清空，还要用的ID由调用方先换回名字、清空后重新intern。
+"""
+
+import sys
+
+
+class SymbolTable():
+    """名字 <-> 整数ID 的双向表。
+
+    Attributes:
+        names (list): ID -> 名字字符串
+        ids (dict): 名字字符串 -> ID
+        joins (dict): (前缀, 分隔符, 名字) -> 拼接后的ID
+        paths (dict): 字段路径各部分组成的tuple -> ID
+        headers (dict): ID -> 引用的hdr名，不是hdr字段时为None
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """清空符号表，之前分配的ID全部失效。"""
+        self.names = []
+        self.ids = {}
+        self.joins = {}
+        self.paths = {}
+        self.headers = {}
+
+    def intern(self, name:str):
+        """返回名字的ID，第一次出现时分配。"""
+        sid = self.ids.get(name)
+        if sid is None:
+            sid = len(self.names)
+            name = sys.intern(str(name))
+            self.names.append(name)
+            self.ids[name] = sid
+        return sid
+
+    def text(self, sid:int):
+        """ID对应的名字字符串。"""
+        return self.names[sid]
+
+    def join(self, prefix:str, name:str, sep:str = "_"):
+        """prefix + sep + name 的ID，同样的组合只拼接一次。"""
+        key = (prefix, sep, name)
+        sid = self.joins.get(key)
+        if sid is None:
+            sid = self.intern(prefix + sep + name)
+            self.joins[key] = sid
+        return sid
+
+    def path(self, parts:tuple):
+        """字段路径 a.b.c 的ID，parts为各部分组成的tuple。"""
+        sid = self.paths.get(parts)
+        if sid is None:
+            sid = self.intern(".".join(parts))
+            self.paths[parts] = sid
+        return sid
+
+    def header(self, sid:int):
+        """标识符引用的hdr名（hdr.ipv4.ttl -> ipv4），不是hdr字段时返回None。"""
+        if sid in self.headers:
+            return self.headers[sid]
+        parts = self.names[sid].split(".")
+        header = parts[1] if parts[0] == "hdr" and len(parts) > 1 else None
+        self.headers[sid] = header
+        return header
+
+
+#进程内共用的符号表
+SYMBOLS = SymbolTable()
+
+intern = SYMBOLS.intern
+text = SYMBOLS.text
+join = SYMBOLS.join
+path = SYMBOLS.path
+header = SYMBOLS.header
+reset = SYMBOLS.reset
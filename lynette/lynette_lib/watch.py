@@ -0,0 +1,248 @@
+"""watch.py - 监视模式（--watch）
+
+功能说明：
+    开发和CI中每次修改都要重新执行一遍 python -m lynette，每次都从clean_component开始全部重做。
+    监视模式保持进程常驻，轮询输入文件的修改时间，有变化时增量重编译：
+    1. 语法树：进程内按内容哈希缓存，只有内容变化的文件才会重新解析；
+    2. 用户：每个用户的输入（入口文件、include依赖图中的文件、service.json中该用户的配置、
+       绑定的外部表项文件）算一个key，key没变的用户直接复用上次的服务和代码片段，
+       变了的用户先删掉上次生成的片段再重新collect/generate；
+    3. 聚合和输出：依赖全部片段和拓扑，有变化时整体重做（只清理topo/path/code目录）。
+    service.json、path/path.json 以及 include 下的 define/header/parser 是全局输入，变化时全部重编译。
+    4. 进程内的表：每次编译前清理一次（见 trim），常驻进程的内存不随修改次数增长。
+
+监视的文件：
+    - service.json、path/path.json、include/define.pne、include/header.pne、include/parser.pne
+    - 每个用户的入口文件及其include依赖图中的所有文件
+    - service.json中绑定的外部表项文件
+    - debug模式（--debug-main）下为入口文件及其include依赖图中的所有文件
+"""
+
+import json
+import os
+import time
+
+from lynette.lynette_lib import cache
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import parser_tree
+from lynette.lynette_lib import symbols
+
+#轮询间隔（秒）
+DEFAULT_INTERVAL = 1.0
+
+
+class Watcher():
+    """监视输入文件并增量重编译。
+
+    Attributes:
+        runner (LynetteRunner): 编译器实例，复用其中的各个编译阶段
+        interval (float): 轮询间隔（秒）
+        users (dict): {用户名: 上次编译的状态}，状态包括 key、services、relation、fragments
+        files (dict): {文件路径: (修改时间, 大小)}，上次编译时所有监视文件的状态
+        debug_files (list): debug模式下入口文件及其include依赖图中的文件
+    """
+
+    def __init__(self, runner, interval=DEFAULT_INTERVAL):
+        self.runner = runner
+        self.interval = interval
+        self.users = {}
+        self.files = {}
+        self.debug_files = []
+
+    def global_files(self):
+        """全局输入文件，变化时需要全部重编译。"""
+        input_path = self.runner.input_path
+        return [os.path.abspath(self.runner.service_conf),
+                input_path + "//path//path.json",
+                input_path + "//include//define.pne",
+                input_path + "//include//header.pne",
+                input_path + "//include//parser.pne"]
+
+    def snapshot(self, files):
+        """记录文件的修改时间和大小，文件不存在时记为None。"""
+        state = {}
+        for file_name in files:
+            try:
+                st = os.stat(file_name)
+                state[file_name] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                state[file_name] = None
+        return state
+
+    def watched_files(self):
+        """当前需要监视的全部文件。"""
+        files = self.global_files()
+        for file_name in self.debug_files:
+            if file_name not in files:
+                files.append(file_name)
+        for u in self.users:
+            for file_name in self.users[u]["files"]:
+                if file_name not in files:
+                    files.append(file_name)
+        return files
+
+    def run(self, if_deploy=False, if_entry=False):
+        """首次全量编译，之后一直轮询，直到Ctrl-C退出。"""
+        self.rebuild(if_deploy, if_entry, full=True)
+        try:
+            while True:
+                time.sleep(self.interval)
+                files = self.watched_files()
+                state = self.snapshot(files)
+                changed = [f for f in files if state[f] != self.files.get(f)]
+                if len(changed) == 0:
+                    continue
+                print("watch: changed", ", ".join(os.path.basename(f) for f in changed))
+                full = any(f in self.global_files() for f in changed)
+                self.rebuild(if_deploy, if_entry, full=full)
+        except KeyboardInterrupt:
+            print("watch: stop")
+
+    def rebuild(self, if_deploy=False, if_entry=False, full=False):
+        """执行一次（增量）编译，并打印耗时。编译出错时保留进程，等待下一次修改。"""
+        start = time.time()
+        try:
+            rebuilt = self.build(full)
+            if if_deploy:
+                self.runner.deploy_code()
+            if if_entry:
+                self.runner.deploy_entry()
+            print("watch: rebuilt", len(rebuilt), "of", len(self.users), "users",
+                  "(" + ", ".join(rebuilt) + ")" if rebuilt else "",
+                  "in %.3fs" % (time.time() - start))
+        except SystemExit:
+            #编译各阶段出错时会直接exit()，这里拦下来，下一次修改时全部重编译
+            self.users = {}
+            print("watch: build failed in %.3fs, waiting for changes" % (time.time() - start))
+        #无论成败都记录当前文件状态，避免对同一次修改反复重编译
+        self.files = self.snapshot(self.watched_files())
+
+    def build(self, full):
+        """编译一次，返回本次重新编译的用户列表。"""
+        runner = self.runner
+        self.trim()
+        if runner.debug == 'yes':
+            #debug模式需要先根据入口文件生成服务配置，直接整体重编译
+            #编译失败时至少还要监视入口文件
+            if not self.debug_files:
+                self.debug_files = [os.path.abspath(runner.debug_main)]
+            runner.service_json = {}
+            runner.run()
+            self.users = {}
+            self.debug_files = self.debug_main_files()
+            return ["debug"]
+
+        if full:
+            runner.service_json = {}
+            self.users = {}
+        #不同用户的片段文件有重叠时无法单独删除，只能全部重编译
+        fragments = [f for u in self.users for f in self.users[u]["fragments"]]
+        if len(fragments) != len(set(fragments)):
+            self.users = {}
+        runner.clean_component(fragments=len(self.users) == 0)
+
+        users = runner.read_service_conf()
+        parser_tree_paremeters = {}
+        for u in users:
+            parser_tree_paremeters[u] = runner.parser_tree_paremeter(u)
+        #语法树有进程内缓存，这里重新建图只会解析内容变化的文件
+        include_graph = parser_tree.build_include_graph(list(parser_tree_paremeters.values()))
+
+        for u in list(self.users):
+            if u not in users:
+                self.remove_fragments(u)
+                del self.users[u]
+
+        services = {}
+        relation = {}
+        rebuilt = []
+        for u in users:
+            files = self.user_files(u, include_graph)
+            key = self.user_key(u, files)
+            if u not in self.users or self.users[u]["key"] != key:
+                if u in self.users:
+                    self.remove_fragments(u)
+                before = runner.fragments.sizes()
+                services_t, relation_t = runner.compile_user(u, parser_tree_paremeters[u], include_graph)
+                after = runner.fragments.sizes()
+                self.users[u] = {
+                    "key": key,
+                    "files": files,
+                    "services": services_t,
+                    "relation": relation_t,
+                    "fragments": [f for f in after if before.get(f) != after[f]],
+                }
+                rebuilt.append(u)
+            for s in self.users[u]["services"]:
+                if s not in services:
+                    services[s] = self.users[u]["services"][s]
+            for r in self.users[u]["relation"]:
+                if r not in relation:
+                    relation[r] = self.users[u]["relation"][r]
+
+        runner.output_service(relation, services)
+        return rebuilt
+
+    def debug_main_files(self):
+        """debug模式的输入文件：入口源文件和include依赖图中的文件，语法树有进程内缓存，建图不会重新解析。"""
+        runner = self.runner
+        parser_tree_paremeter = runner.parser_tree_paremeter(runner.debug_main.split("_main.pne")[0])
+        parser_tree_paremeter["main_file_name"] = runner.debug_main
+        include_graph = parser_tree.build_include_graph([parser_tree_paremeter])
+        files = [os.path.abspath(runner.debug_main)]
+        for file_name in parser_tree.graph_files(include_graph, runner.debug_main):
+            if file_name not in files:
+                files.append(file_name)
+        return files
+
+    def trim(self):
+        """清理进程内只增不减的表。
+
+        模块IR、折叠结果、define表（cache.Memo）只保留上一次编译用到的项；
+        符号表清空后只重新登记复用的用户的片段关系中的名字，其余ID在这之后都不再使用。
+        """
+        cache.sweep()
+        live = []
+        for u in self.users:
+            for relation in self.users[u]["relation"].values():
+                if isinstance(relation, data_structure.LYNETTE_FRAG_RELATION):
+                    live.append((relation, [symbols.text(sid) for sid in relation.input],
+                                 [symbols.text(sid) for sid in relation.output]))
+        symbols.reset()
+        for relation, input, output in live:
+            relation.input = [symbols.intern(data_name) for data_name in input]
+            relation.output = [symbols.intern(data_name) for data_name in output]
+
+    def user_files(self, u, include_graph):
+        """某个用户的全部输入文件：入口源文件、include依赖图中的文件、外部表项文件。"""
+        services = self.runner.service_json[u]["services"]
+        main_source = os.path.abspath(services[0].get("main_file", u + "_main.pne"))
+        files = [main_source]
+        for file_name in parser_tree.graph_files(include_graph, u + "_main.pne"):
+            if file_name not in files:
+                files.append(file_name)
+        for file_name in self.runner.read_entry_files(u).values():
+            if file_name not in files:
+                files.append(file_name)
+        return files
+
+    def user_key(self, u, files):
+        """某个用户输入的哈希：service.json中的配置、源文件内容；外部表项文件可能很大，只看修改时间和大小。"""
+        parts = [json.dumps(self.runner.service_json[u], sort_keys=True)]
+        entry_files = list(self.runner.read_entry_files(u).values())
+        for file_name in files:
+            parts.append(file_name)
+            if file_name in entry_files:
+                parts.append(repr(self.snapshot([file_name])[file_name]))
+                continue
+            try:
+                with open(file_name, "rb") as file:
+                    parts.append(file.read())
+            except OSError:
+                parts.append("")
+        return cache.digest(*parts)
+
+    def remove_fragments(self, u):
+        """删除某个用户上次生成的代码片段，generate以追加方式写片段，重新生成前必须先删掉。"""
+        for name in self.users[u]["fragments"]:
+            self.runner.fragments.remove(name)
@@ -0,0 +1,60 @@
+"""
+服务内复用测试脚本
+检查map取值、check、赋值的复用不改变程序的行为
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette import testing
+
+PROGRAM = """
+module Hop() {
+    control {
+        map< bit<32>, bit<32> >[16] hopTable
+            {
+                (1, 7);
+            };
+        %s
+    }
+}
+
+application Router using Parser {
+    Hop.apply();
+}
+"""
+
+
+def _control(tmp_path, body):
+    path = testing.workdir(tmp_path)
+    _, applications, modules = testing.collect_code(PROGRAM % body, path)
+    generator, _ = testing.generate({"geo": ["Router"]}, applications, modules, path)
+    return generator.fragments.read("geo_Router_0_control.pne"), generator.available.counts
+
+
+def test_lookup_other_left_not_reused(tmp_path):
+    """左值不同的第二次取值不能从第一次的左值赋值：表未命中时左值应该保持不变"""
+    control, counts = _control(tmp_path, "pkt.out_port = hopTable[hdr.gbc.geoAreaPosLat];\n"
+                                         "        hdr.gbc.geoAreaPosLat = hopTable[hdr.gbc.geoAreaPosLat];")
+    assert "LynetteOutPort;" not in control
+    assert control.count(".apply();") == 2
+    assert counts["lookup"] == 0
+
+
+def test_lookup_same_left_reused(tmp_path):
+    """左值相同并且中间没有改写时，第二次取值整条去掉"""
+    control, counts = _control(tmp_path, "hdr.gbc.lat = hopTable[hdr.gbc.geoAreaPosLat];\n"
+                                         "        hdr.gbc.lat = hopTable[hdr.gbc.geoAreaPosLat];")
+    assert control.count(".apply();") == 1
+    assert counts["lookup"] == 1
+
+
+def test_lookup_after_key_written(tmp_path):
+    """key被改写之后不复用"""
+    control, counts = _control(tmp_path, "hdr.gbc.lat = hopTable[hdr.gbc.geoAreaPosLat];\n"
+                                         "        hdr.gbc.geoAreaPosLat = 3;\n"
+                                         "        hdr.gbc.lat = hopTable[hdr.gbc.geoAreaPosLat];")
+    assert control.count(".apply();") == 2
+    assert counts["lookup"] == 0
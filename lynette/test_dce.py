@@ -0,0 +1,110 @@
+"""
+死代码消除测试脚本
+检查常量if/assert的裁剪、无用赋值的删除、无副作用module调用的删除，以及共享的IR不被修改
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette import testing
+from lynette.lynette_lib import data_structure
+
+PROGRAM = """
+module Calc(in bit<32> a, out bit<32> b) {
+    control {
+        bit<32> t;
+        t = a + 1;
+        b = t;
+    }
+}
+
+module Check() {
+    control {
+        assert( MODE == 1 );
+        hdr.gbc.sn = 2;
+        assert( MODE == 2 );
+        hdr.gbc.h = 1;
+    }
+}
+
+application R using Parser {
+    bit<32> used;
+    bit<32> dead;
+    bit<32> r;
+    dead = hdr.gbc.lat + 2;
+    used = hdr.gbc.lat;
+    if ( MODE == 1 ) {
+        hdr.gbc.tst = used;
+    } else {
+        hdr.gbc.tst = 5;
+    }
+    Calc.apply(hdr.gbc.lat, r);
+    Check.apply();
+}
+"""
+
+
+def _optimize(tmp_path, mode):
+    path = testing.workdir(tmp_path)
+    _, applications, modules = testing.collect_code(PROGRAM, path)
+    applications_t, modules_t = testing.optimize(applications, modules, path, {"MODE": (mode, 8)})
+    return applications, modules, applications_t, modules_t
+
+
+def _types(all_ins):
+    return [type(ins) for ins in all_ins]
+
+
+def _lefts(all_ins):
+    """赋值指令的左值，按 a.b.c 的文本给出"""
+    return [[".".join(token.value for token in left.children[0].children) for left in ins.left]
+            for ins in all_ins if type(ins) is data_structure.LYNETTE_INS_ASSIGN]
+
+
+def test_constant_if_pruned(tmp_path):
+    """条件恒真只留if分支，恒假只留else分支，分支中的指令放到if的位置"""
+    _, _, applications, _ = _optimize(tmp_path / "one", 1)
+    assert data_structure.LYNETTE_INS_IF not in _types(applications["R"].ins)
+    assert _lefts(applications["R"].ins) == [["used"], ["hdr.gbc.tst"]]
+
+    _, _, applications, _ = _optimize(tmp_path / "two", 2)
+    assert data_structure.LYNETTE_INS_IF not in _types(applications["R"].ins)
+    assert _lefts(applications["R"].ins) == [["hdr.gbc.tst"]]
+    #else分支不读used，对used的赋值和变量定义一起删掉
+    assert "used" not in applications["R"].var
+
+
+def test_constant_assert(tmp_path):
+    """恒真的assert删掉，恒假的assert连同后面的指令一起删掉"""
+    _, _, _, modules = _optimize(tmp_path, 1)
+    assert _types(modules["Check"].ins) == [data_structure.LYNETTE_INS_ASSIGN]
+    assert _lefts(modules["Check"].ins) == [["hdr.gbc.sn"]]
+
+
+def test_dead_store_removed(tmp_path):
+    """没有被读取的局部变量：赋值和定义都删掉"""
+    _, _, applications, _ = _optimize(tmp_path, 1)
+    assert ["dead"] not in _lefts(applications["R"].ins)
+    assert "dead" not in applications["R"].var
+    assert "used" in applications["R"].var
+
+
+def test_pure_call_removed(tmp_path):
+    """out参数没有被读取的无副作用module调用删掉，有副作用的保留"""
+    _, _, applications, modules = _optimize(tmp_path, 1)
+    calls = [ins.call_name for ins in applications["R"].ins if type(ins) is data_structure.LYNETTE_INS_CALL]
+    assert calls == ["Check"]
+    assert "r" not in applications["R"].var
+    #module本身不删，只删这次调用
+    assert len(modules["Calc"].ins) == 2
+
+
+def test_shared_ir_untouched(tmp_path):
+    """传入的IR不被修改，有变化的组件是复制出来的"""
+    applications, modules, applications_t, modules_t = _optimize(tmp_path, 1)
+    assert len(applications["R"].ins) == 5 and "dead" in applications["R"].var
+    assert len(modules["Check"].ins) == 4
+    assert len(modules["Calc"].ins) == 2
+    assert applications_t["R"] is not applications["R"]
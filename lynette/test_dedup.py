@@ -0,0 +1,84 @@
+"""
+同一节点上相同表合并的测试脚本
+检查结构相同的表合并、表项相同时只保留一份、不同时加服务区分key，以及结构不同时不合并
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette.lynette_lib import dedup
+
+
+def _texts(prefix, value="meta.a"):
+    table = prefix + "_t"
+    action = table + "_action"
+    return {
+        "tem": "",
+        "action": "action " + action + "(bit<32> value_0){\n    " + value + " = value_0;\n}\n",
+        "table": "table " + table + "{\n    key = {\n        hdr.gbc.lat : exact;\n    }\n"
+                 "    actions = {\n        " + action + ";\n    }\n}\n",
+        "control": table + ".apply();\n",
+    }
+
+
+def _reader(prefix, rows):
+    def entries():
+        for key, value in rows:
+            yield {"table": prefix + "_t", "match": {"hdr.gbc.lat": [key]},
+                   "action_name": prefix + "_t_action", "action_params": {"value_0": [value]}}
+    return entries
+
+
+def test_same_entries_kept_once():
+    """结构和表项都相同（顺序不同）：只保留第一张表和一份表项"""
+    texts = {"a_0": _texts("a"), "b_0": _texts("b")}
+    entries = {"a_0": _reader("a", [("1", "7"), ("2", "8")]), "b_0": _reader("b", [("2", "8"), ("1", "7")])}
+    assert dedup.share(["a_0", "b_0"], texts, entries) == 1
+    assert texts["b_0"]["table"] == "" and texts["b_0"]["action"] == ""
+    assert texts["b_0"]["control"] == "a_t.apply();\n"
+    assert [e["table"] for e in entries["a_0"]()] == ["a_t", "a_t"]
+    assert list(entries["b_0"]()) == []
+
+
+def test_different_entries_service_key():
+    """结构相同、表项不同：合并后的表加服务区分key，调用点先赋上编号，表项带上编号"""
+    texts = {"a_0": _texts("a"), "b_0": _texts("b")}
+    entries = {"a_0": _reader("a", [("1", "7")]), "b_0": _reader("b", [("1", "9")])}
+    assert dedup.share(["a_0", "b_0"], texts, entries) == 1
+    assert "a_t_service : exact;" in texts["a_0"]["table"]
+    assert texts["a_0"]["tem"] == "bit<8> a_t_service;\n"
+    assert texts["a_0"]["control"] == "a_t_service = 0; a_t.apply();\n"
+    assert texts["b_0"]["control"] == "a_t_service = 1; a_t.apply();\n"
+    rows = list(entries["a_0"]()) + list(entries["b_0"]())
+    assert [(e["table"], e["action_name"], e["match"]["a_t_service"]) for e in rows] == \
+           [("a_t", "a_t_action", ["0"]), ("a_t", "a_t_action", ["1"])]
+    assert list(rows[1]["match"]) == ["a_t_service", "hdr.gbc.lat"]
+    #读表项的函数每次调用都从头读
+    assert len(list(entries["b_0"]())) == 1
+
+
+def test_different_structure_not_merged():
+    """action体不同的表不合并"""
+    texts = {"a_0": _texts("a"), "b_0": _texts("b", value="meta.b")}
+    before = {frag: dict(texts[frag]) for frag in texts}
+    entries = {"a_0": _reader("a", [("1", "7")]), "b_0": _reader("b", [("1", "7")])}
+    assert dedup.share(["a_0", "b_0"], texts, entries) == 0
+    assert texts == before
+
+
+def test_budget_group_cap(monkeypatch):
+    """placement的表数量和share一致：一组最多合并 1 << SERVICE_BITS 张，超出的各占一张"""
+    monkeypatch.setattr(dedup, "SERVICE_BITS", 1)
+    frags = ["a_0", "b_0", "c_0"]
+    texts = {frag: _texts(frag[0]) for frag in frags}
+    loaded = {frag: dedup.tables(frag, texts[frag]["action"], texts[frag]["table"]) for frag in frags}
+    budget = dedup.Budget(lambda frag, node: loaded[frag])
+    costs = []
+    for frag in frags:
+        costs.append(budget.cost("s1", frag, 1))
+        budget.take("s1", frag)
+    assert costs == [1, 0, 1]
+    entries = {frag: _reader(frag[0], [("1", "7")]) for frag in frags}
+    assert dedup.share(frags, texts, entries) == len(frags) - sum(costs)
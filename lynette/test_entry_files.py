@@ -0,0 +1,89 @@
+"""
+外部表项文件测试脚本
+检查 entry_scanner 按行读取 csv/jsonl/bin 表项文件，以及 aggregate 逐条输出节点表项
+"""
+
+import io
+import json
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette.lynette_lib import aggregate
+from lynette.lynette_lib import entry_scanner
+from lynette.lynette_lib import fragments
+from lynette.lynette_lib import output
+
+
+def _write(tmp_path, name, data):
+    path = os.path.join(str(tmp_path), name)
+    with open(path, "wb" if isinstance(data, bytes) else "w") as file:
+        file.write(data)
+    return path
+
+
+def test_entry_file_formats(tmp_path):
+    """三种格式读出同样的表项"""
+    rows = [["1", "7"], ["10.0.0.1", "_Next"], ["2", "8"]]
+    csv_path = _write(tmp_path, "t.csv", "# key, value\n1, 7\n\n10.0.0.1, _Next\n2,8\n")
+    jsonl_path = _write(tmp_path, "t.jsonl", '[1, "7"]\n["10.0.0.1", "_Next"]\n[2, 8]\n')
+    assert [list(r) for r in entry_scanner.iter_rows(entry_scanner.open_entry_file(csv_path))] == rows
+    assert [list(r) for r in entry_scanner.iter_rows(entry_scanner.open_entry_file(jsonl_path))] == rows
+
+    bin_path = _write(tmp_path, "t.bin", b"LYNE" + bytes([1, 2, 4, 2]) + struct.pack(">IH", 1, 7) + struct.pack(">IH", 2, 8))
+    entry = entry_scanner.open_entry_file(bin_path)
+    assert [list(r) for r in entry_scanner.iter_rows(entry)] == [["1", "7"], ["2", "8"]]
+    assert entry_scanner.width(entry) == 2
+    assert [len(chunk) for chunk in entry_scanner.iter_chunks(entry, size=1)] == [1, 1]
+
+
+def test_entry_file_errors(tmp_path):
+    """列数不同、格式不对时报错退出"""
+    with pytest.raises(SystemExit):
+        list(entry_scanner.iter_rows(entry_scanner.open_entry_file(_write(tmp_path, "w.csv", "1, 2\n3\n"))))
+    with pytest.raises(SystemExit):
+        list(entry_scanner.iter_rows(entry_scanner.open_entry_file(_write(tmp_path, "v.jsonl", "[1, -2]\n"))))
+    with pytest.raises(SystemExit):
+        list(entry_scanner.iter_rows(entry_scanner.open_entry_file(_write(tmp_path, "b.bin", b"LYNE" + bytes([1, 1, 4]) + b"\0\0"))))
+    with pytest.raises(SystemExit):
+        entry_scanner.open_entry_file(_write(tmp_path, "t.txt", "1, 2\n"))
+
+
+def test_json_entries_same_as_json_dump():
+    """逐条写出的节点表项和整体 json.dump 的结果一致"""
+    entries = [{"table": "t", "match": {"hdr.a.b": ["1"]}, "action_name": "t_action", "action_params": {"value_0": ["2"]}},
+               {"table": "t", "match": {"hdr.a.b": ["3"]}, "action_name": "t_action", "action_params": {}}]
+    for rows in (entries, []):
+        file = io.StringIO()
+        writer = output.JsonEntries(file, "s1")
+        for e in rows:
+            writer.write(e)
+        writer.close()
+        expected = io.StringIO()
+        json.dump({"target": "s1", "entries": rows}, expected, indent=2)
+        assert file.getvalue() == expected.getvalue()
+
+
+def test_frag_entries_streamed():
+    """片段表项写在文件中，逐条读出并替换_Next"""
+    store = fragments.FragmentStore()
+    with store.open("component//geo_R_0_entry.pne") as file:
+        for i in range(3):
+            file.write(json.dumps({"table": "t", "match": {"k": [str(i)]}, "action_name": "a",
+                                   "action_params": {"value_0": ["_Next"]}}) + "\n")
+    assert "geo_R_0_entry.pne" in store and "geo_R_0_entry.pne" not in store.streams
+    parameter = {"fragments": store, "if_debug": "yes"}
+    path = {"geo": ["s1", "s2"]}
+    topo = {"s1": {"next": {"s2": 5}}, "s2": {"next": {}}}
+    reader = aggregate.frag_entry_reader(parameter, "geo_R_0", "s1", path, topo, {"geo_R_0": "geo"})
+    assert [e["action_params"]["value_0"] for e in reader()] == [["5"]] * 3
+    reader = aggregate.frag_entry_reader(parameter, "geo_R_0", "s2", path, topo, {"geo_R_0": "geo"})
+    assert [e["match"]["k"] for e in reader()] == [["0"], ["1"], ["2"]]
+    assert next(reader())["action_params"]["value_0"] == ["0"]
+    file_path = store.files["geo_R_0_entry.pne"][0]
+    store.clear()
+    assert not os.path.exists(file_path)
@@ -0,0 +1,126 @@
+"""
+module展开重放测试脚本
+同一个module被几个服务、几个app调起时，开着和关掉展开记录生成的片段和片段关系完全一致
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette import testing
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import symbols
+from lynette.lynette_lib.generate import Generator
+
+PROGRAM = """
+module Inner(in bit<32> x) {
+    control {
+        map< bit<32>, bit<32> >[16] innerTable
+            {
+                (1, 7);
+            };
+        hdr.gbc.sn = innerTable[x];
+        if ( hdr.gbc.sn == 3 ) { hdr.gbc.h = 1; } else { drop(); }
+    }
+}
+
+module Tag(in bit<32> k, out bit<32> o) {
+    control {
+        map< bit<32>, bit<32> >[16] tagTable
+            {
+                (1, 7);
+                (2, 8);
+            };
+        bit<32> tv;
+        tv = tagTable[k];
+        o = tv + 1;
+        if ( k in tagTable ) {
+            hdr.gbc.tst = 3;
+        }
+        Inner.apply(tv);
+        hdr.gbc.lat = tagTable[hdr.gbc.geoAreaPosLat];
+    }
+}
+
+module Plain() {
+    control {
+        if ( hdr.gbc.isValid() ) { hdr.gbc.tst = hdr.gbc.lat + 1; }
+        Inner.apply(hdr.gbc.lat);
+    }
+}
+
+application R using Parser {
+    Plain.apply();
+}
+
+application R_R using Parser {
+    bit<32> c;
+    Tag.apply(hdr.gbc.geoAreaPosLat, c);
+    Plain.apply();
+    if ( c == 2 ) {
+        Plain.apply();
+    }
+}
+
+application R3 using Parser {
+    bit<32> d;
+    Tag.apply(hdr.gbc.geoAreaPosLat, d);
+    Plain.apply();
+}
+
+application Q1 using Parser {
+    bit<32> Inner_x;
+    Inner_x = hdr.gbc.lat;
+    Inner.apply(Inner_x);
+}
+
+application Q2 using Parser {
+    bit<32> Inner_y;
+    Inner_y = hdr.gbc.tst;
+    Inner.apply(Inner_y);
+}
+"""
+
+#Inner最先在u的Q2里记下来，传进去的变量名以展开前缀开头（u_Q2_Inner_y），
+#重放到别处时要按绑定换成新变量，不能当作前缀改名
+SERVICES = {"u": ["Q1", "Q2"], "s": ["R_R", "R3"], "t": ["R3", "R"], "v": ["Q2", "Q1"]}
+
+
+def _relations(relation_dict):
+    relations = {}
+    for name, relation in relation_dict.items():
+        if isinstance(relation, data_structure.LYNETTE_FRAG_RELATION):
+            relation = ([symbols.text(sid) for sid in relation.input], [symbols.text(sid) for sid in relation.output],
+                        list(relation.varfile), relation.table_num, dict(relation.module))
+        relations[name] = relation
+    return relations
+
+
+def _generate(tmp_path, monkeypatch, memo):
+    replay = Generator.generate_replay
+    replayed = []
+
+    def generate_replay(self, *args):
+        if not memo:
+            return False
+        result = replay(self, *args)
+        replayed.append(result)
+        return result
+
+    monkeypatch.setattr(Generator, "generate_replay", generate_replay)
+    path = testing.workdir(tmp_path)
+    _, applications, modules = testing.collect_code(PROGRAM, path)
+    generator, relation = testing.generate(SERVICES, applications, modules, path)
+    return testing.fragment_texts(generator), _relations(relation), replayed
+
+
+def test_replay_same_as_expansion(tmp_path, monkeypatch):
+    """重放和重新展开得到同样的片段和片段关系"""
+    texts_on, relations_on, replayed = _generate(tmp_path / "on", monkeypatch, True)
+    texts_off, relations_off, _ = _generate(tmp_path / "off", monkeypatch, False)
+    assert any(replayed)
+    assert sorted(texts_on) == sorted(texts_off)
+    for name in texts_on:
+        assert texts_on[name] == texts_off[name], name
+    assert relations_on == relations_off
@@ -0,0 +1,83 @@
+"""
+常量折叠测试脚本
+检查常量代入和折叠后的数值、位宽取模、不折叠的情况，以及共享的IR不被修改
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette import testing
+from lynette.lynette_lib import defines
+from lynette.lynette_lib import fold
+
+PROGRAM = """
+module M(in bit<32> W) {
+    control {
+        hdr.gbc.lat = W + 1;
+    }
+}
+
+application R using Parser {
+    bit<32> c;
+    hdr.gbc.tst = BASE + 2 * 5;
+    hdr.gbc.sn = 1 << 4 | 3;
+    hdr.gbc.h = BASE + 255;
+    hdr.gbc.lat = hdr.gbc.lat + BASE;
+    c = 10 - 20;
+    M.apply(hdr.gbc.lat);
+}
+"""
+
+CONSTS = {"BASE": (2, 8), "W": (9, 8)}
+
+
+def _fold(tmp_path):
+    path = testing.workdir(tmp_path)
+    _, applications, modules = testing.collect_code(PROGRAM, path)
+    define_table = defines.DefineTable("test_fold", {}, {}, CONSTS)
+    applications_t, modules_t = fold.execute(applications, modules, path, define_table)
+    return applications, modules, applications_t, modules_t
+
+
+def _value(ins):
+    """右边折叠成一个整数时返回这个数，否则返回None"""
+    data = fold.operand(ins.right1)
+    if data is None or data.children[0].data != "int":
+        return None
+    return int(data.children[0].children[0].value)
+
+
+def test_constant_expression(tmp_path):
+    """常量代入后整条右边算出结果，按P4的优先级计算"""
+    _, _, applications, _ = _fold(tmp_path)
+    ins = applications["R"].ins
+    assert _value(ins[0]) == 12
+    assert _value(ins[1]) == 19
+
+
+def test_width_wrap(tmp_path):
+    """带位宽的常量参与运算，结果按位宽取模"""
+    _, _, applications, _ = _fold(tmp_path)
+    assert _value(applications["R"].ins[2]) == 1
+
+
+def test_not_folded(tmp_path):
+    """有非常量操作数、结果为负数、被模块参数遮住的常量都不折叠"""
+    _, _, applications, modules = _fold(tmp_path)
+    ins = applications["R"].ins
+    assert _value(ins[3]) is None
+    assert _value(ins[4]) is None
+    assert _value(modules["M"].ins[0]) is None
+    #常量BASE仍然代入成数值
+    assert "BASE" not in str(ins[3].right1)
+    assert "W" in str(modules["M"].ins[0].right1)
+
+
+def test_shared_ir_untouched(tmp_path):
+    """传入的IR不被修改，没有可折叠指令的组件仍是原来的对象"""
+    applications, modules, applications_t, modules_t = _fold(tmp_path)
+    assert _value(applications["R"].ins[0]) is None
+    assert applications_t["R"] is not applications["R"]
+    assert modules_t["M"] is modules["M"]
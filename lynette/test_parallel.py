@@ -0,0 +1,96 @@
+"""
+服务并行生成测试脚本
+检查 --jobs 按服务并行生成后合并的结果和串行生成完全一致，包括名字冲突时回到主进程重新生成的情况
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lynette import testing
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import symbols
+from lynette.lynette_lib.generate import Generator
+
+PROGRAM = """
+module Hop(in bit<32> k) {
+    control {
+        map< bit<32>, bit<32> >[16] hopTable
+            {
+                (1, 7);
+                (2, 8);
+            };
+        hdr.gbc.sn = hopTable[k];
+        if ( hdr.gbc.sn == 3 ) { hdr.gbc.h = 1; } else { drop(); }
+    }
+}
+
+application R using Parser {
+    Hop.apply(hdr.gbc.lat);
+}
+
+application R_R using Parser {
+    bit<32> c;
+    c = hdr.gbc.tst + 1;
+    Hop.apply(c);
+}
+
+application Q using Parser {
+    Hop.apply(hdr.gbc.geoAreaPosLat);
+    hdr.gbc.tst = 2;
+}
+"""
+
+#服务s的app R_R和服务s_R的app R前缀都是 s_R_R，并行时后一个和已经合并的名字冲突，要在主进程中重新生成
+SERVICES = {"s": ["R_R", "Q"], "s_R": ["R"], "t": ["Q", "R"]}
+
+
+def _relations(relation_dict):
+    relations = []
+    for name, relation in relation_dict.items():
+        if isinstance(relation, data_structure.LYNETTE_FRAG_RELATION):
+            relation = (relation.name, [symbols.text(sid) for sid in relation.input], [symbols.text(sid) for sid in relation.output],
+                        list(relation.varfile), relation.table_num, dict(relation.module))
+        relations.append((name, relation))
+    return relations
+
+
+def _generate(tmp_path, services=SERVICES, **args):
+    path = testing.workdir(tmp_path)
+    _, applications, modules = testing.collect_code(PROGRAM, path)
+    generator, relation = testing.generate(services, applications, modules, path, **args)
+    return testing.fragment_texts(generator), _relations(relation), dict(generator.available.counts)
+
+
+def _assert_same(parallel, serial):
+    assert sorted(parallel[0]) == sorted(serial[0])
+    for name in serial[0]:
+        assert parallel[0][name] == serial[0][name], name
+    assert parallel[1] == serial[1]
+    assert parallel[2] == serial[2]
+
+
+def test_parallel_same_as_serial(tmp_path, monkeypatch):
+    """并行合并的片段、片段关系（含顺序）和复用计数都和串行一致"""
+    merge_unit = Generator.merge_unit
+    merged = []
+
+    def record_merge(self, unit):
+        result = merge_unit(self, unit)
+        merged.append(result)
+        return result
+
+    monkeypatch.setattr(Generator, "merge_unit", record_merge)
+    serial = _generate(tmp_path / "serial")
+    parallel = _generate(tmp_path / "parallel", jobs=2)
+    assert merged.count(False) == 1 and merged.count(True) == 2
+    _assert_same(parallel, serial)
+
+
+def test_worker_runs_several_units(tmp_path):
+    """服务比进程多，同一个进程先后生成几个都调起Hop（带表项）的服务，前一个服务记下的展开不能在后一个服务中重放"""
+    services = {"s" + str(i): ["Q", "R_R"] for i in range(8)}
+    serial = _generate(tmp_path / "serial", services)
+    parallel = _generate(tmp_path / "parallel", services, jobs=2)
+    _assert_same(parallel, serial)
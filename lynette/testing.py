@@ -0,0 +1,53 @@
+"""
+测试用的小工具
+把一段PNE代码直接解析、收集成IR，再按需要做折叠、死代码消除和生成，不需要完整的工程目录
+"""
+
+import os
+
+from lynette.lynette_lib import collect
+from lynette.lynette_lib import data_structure
+from lynette.lynette_lib import dce
+from lynette.lynette_lib import defines
+from lynette.lynette_lib import fold
+from lynette.lynette_lib import parser_tree
+from lynette.lynette_lib.generate import Generator
+
+
+def workdir(tmp_path):
+    """建立一个只有 log_out 的工程目录，返回各阶段使用的路径。"""
+    path = str(tmp_path)
+    os.makedirs(os.path.join(path, "log_out"), exist_ok=True)
+    return path
+
+
+def collect_code(code:str, path:str, backend="lalr"):
+    """解析并收集一段PNE代码，返回 (services, applications, modules)。"""
+    tree = parser_tree.parse_code(parser_tree.replace_quotes(code), "test.pne", backend)
+    return collect.execute({"test": tree}, path)
+
+
+def optimize(applications:dict, modules:dict, path:str, consts:dict=None):
+    """常量折叠和死代码消除，consts为 {常量名: (数值, 位宽)}。"""
+    #折叠结果按define.pne哈希记忆，不同常量用不同的哈希
+    define_table = defines.DefineTable("test" + repr(sorted((consts or {}).items())), {}, {}, consts or {})
+    applications, modules = fold.execute(applications, modules, path, define_table)
+    return dce.execute(applications, modules, path, define_table)
+
+
+def generate(services:dict, applications:dict, modules:dict, path:str, **args):
+    """按 {服务名: [app名]} 生成，返回 (Generator, 片段关系)。"""
+    services_t = {}
+    for name in services:
+        service = data_structure.LYNETTE_SERVICE()
+        service.name = name
+        service.application = list(services[name])
+        services_t[name] = service
+    generator = Generator(sys_path=path, define_table=defines.DefineTable("test", {}, {}, {}), **args)
+    relation = generator.execute(services_t, applications, modules, path)
+    return generator, relation
+
+
+def fragment_texts(generator):
+    """生成的全部片段，{文件名: 文本}。"""
+    return {name: generator.fragments.read(name) for name in sorted(generator.fragments.sizes())}
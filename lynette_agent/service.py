@@ -18,7 +18,7 @@ parent_dir = os.path.dirname(os.path.dirname(current_dir))
 sys.path.insert(0, parent_dir)
 
 from lynette.__main__ import LynetteRunner
-from lynette.lynette_lib import parser_tree, collect
+from lynette.lynette_lib import snapshot
 
 
 class CompileService:
@@ -192,12 +192,13 @@ class AnalyzeService:
                 "sys_path": self.sys_path
             }
             
-            forest = parser_tree.execute(parser_tree_parameter)
+            # 源文件没变时直接读取IR快照，不再重新解析和收集
+            ir = snapshot.collect(parser_tree_parameter)
             result["syntax_valid"] = True
             
             if analysis_type in ["structure", "all"]:
                 # 收集服务、应用和模块
-                services, applications, modules = collect.execute(forest, input_path)
+                services, applications, modules = ir.services, ir.applications, ir.modules
                 
                 # 转换为字典格式
                 result["services"] = [
@@ -229,7 +230,7 @@ class AnalyzeService:
             if analysis_type in ["dependencies", "all"]:
                 # 提取依赖关系
                 result["dependencies"] = {
-                    "includes": list(forest.keys()),
+                    "includes": list(ir.includes),
                     "modules": []
                 }
         